@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Limits the number of queries running at the same time on a query server
+
+import datetime
+import logging
+import threading
+import time
+
+from beeswax import query_timings, script_runner
+from beeswax.models import QueryHistory, QUERY_SUBMISSION_TIMEOUT
+
+
+LOG = logging.getLogger(__name__)
+
+ABANDON_TIMEOUT = 30                    # Seconds after which a queued query which is not polled fails
+REFRESH_INTERVAL = 5                    # Minimum seconds between two refreshes of the running queries of a server
+
+
+def _get_running(query_server):
+  """The queries sent to the server whose last known state is submitted or running"""
+  return QueryHistory.objects.filter(server_name=query_server['server_name'],
+                                     server_host=query_server['server_host'],
+                                     server_port=query_server['server_port'],
+                                     last_state__in=(QueryHistory.STATE.submitted.index, QueryHistory.STATE.running.index),
+                                     submission_date__gte=datetime.datetime.now() - QUERY_SUBMISSION_TIMEOUT
+                                    ).exclude(server_id=None)
+
+
+def count_running(query_server):
+  """
+  count_running(query_server) -> {user id: number of running queries}
+
+  Queries submitted more than QUERY_SUBMISSION_TIMEOUT ago are ignored.
+  """
+  counts = {}
+  for owner_id in _get_running(query_server).values_list('owner', flat=True):
+    counts[owner_id] = counts.get(owner_id, 0) + 1
+  return counts
+
+
+def refresh_running(query_server):
+  """
+  Saves the state of the running queries of the server which finished. Nobody refreshes
+  it when their page is closed, and they would keep their slot until QUERY_SUBMISSION_TIMEOUT.
+  """
+  from beeswax.server import dbms
+
+  for query_history in _get_running(query_server):
+    try:
+      db = dbms.get(query_history.owner, query_server)
+      state = db.get_state(query_history.get_handle())
+    except Exception, e:
+      LOG.warn('Failed to refresh the state of query %s: %s' % (query_history.id, e))
+      continue
+
+    if state is None or state in (QueryHistory.STATE.submitted, QueryHistory.STATE.running):
+      continue
+    if state != QueryHistory.STATE.failed and script_runner.has_next_statement(query_history):
+      # Not the last statement: the runner submits the next one
+      script_runner.script_runner.start(query_history.id)
+      continue
+    query_timings.record_state(query_history, state, state)
+    db.invalidate_cache_for_finished(query_history, state)
+    query_history.save_state(state)
+
+
+def fail_abandoned(query_ids):
+  """The queued queries left the queue without being sent to the server"""
+  QueryHistory.objects.filter(id__in=query_ids, server_id=None,
+                              last_state=QueryHistory.STATE.submitted.index).update(last_state=QueryHistory.STATE.failed.index)
+
+
+class AdmissionQueue(object):
+  """
+  FIFO queue of the queries waiting for their query server.
+
+  A query is admitted when its user runs fewer than 'max_concurrent_queries_per_user'
+  queries and its server fewer than 'max_concurrent_queries' (0 is unlimited), and no
+  query queued before it on the same server can be admitted instead. The queries of a
+  user at their limit do not hold back the queries of the other users.
+
+  Queued queries are submitted when their status is polled. They leave the queue and
+  fail when not polled for ``abandon_timeout`` seconds, e.g. when their page was closed.
+
+  Before counting the running queries of a server, their state is refreshed at most
+  every ``refresh_interval`` seconds, so that the ones which finished free their slot.
+
+  The running queries are counted from the database, so they include the ones of the
+  other Hue processes, but each process has its own queue and order of admission.
+  """
+  def __init__(self, count_running=count_running, refresh_running=refresh_running, fail_abandoned=fail_abandoned,
+               abandon_timeout=ABANDON_TIMEOUT, refresh_interval=REFRESH_INTERVAL):
+    self.count_running = count_running
+    self.refresh_running = refresh_running
+    self.fail_abandoned = fail_abandoned
+    self.abandon_timeout = abandon_timeout
+    self.refresh_interval = refresh_interval
+    self._queue = []                    # [query id, server, user id, last poll, position]
+    self._starting = {}                 # Admitted query id -> (server, user id), until started
+    self._refreshed = {}                # Server -> time of the last refresh of its running queries
+    self._lock = threading.Lock()
+    self.admitted = 0
+    self.queued = 0
+
+  def admit(self, query_history, query_server):
+    """
+    admit(query_history, query_server) -> position
+
+    0 when the query can be submitted now, which must be followed by started(), or its
+    position in the queue of the server.
+    """
+    user_limit = query_server.get('max_concurrent_queries_per_user', 0)
+    server_limit = query_server.get('max_concurrent_queries', 0)
+    server = (query_server['server_name'], query_server['server_host'], query_server['server_port'])
+
+    counts = {}
+    if user_limit > 0 or server_limit > 0:
+      self._refresh(server, query_server)
+      # Out of the lock: the pages of the other queries do not wait for the database
+      counts = self.count_running(query_server)
+
+    abandoned = []
+    self._lock.acquire()
+    try:
+      now = time.time()
+      for entry in list(self._queue):
+        if now - entry[3] >= self.abandon_timeout and entry[0] != query_history.id:
+          self._queue.remove(entry)
+          abandoned.append(entry[0])
+
+      entry = None
+      for queued in self._queue:
+        if queued[0] == query_history.id:
+          entry = queued
+          break
+      if entry is None:
+        if user_limit <= 0 and server_limit <= 0:
+          return self._admitted(query_history.id, server, query_history.owner_id, None)
+        entry = [query_history.id, server, query_history.owner_id, now, 0]
+        self._queue.append(entry)
+        self.queued += 1
+      entry[3] = now
+
+      for starting_server, owner_id in self._starting.itervalues():
+        if starting_server == server:
+          counts[owner_id] = counts.get(owner_id, 0) + 1
+      total = sum(counts.values())
+
+      # The queries before this one which can go first take their slots
+      position = 0
+      for queued in self._queue:
+        if queued[1] != server:
+          continue
+        owner_id = queued[2]
+        if (server_limit <= 0 or total < server_limit) and (user_limit <= 0 or counts.get(owner_id, 0) < user_limit):
+          if queued is entry:
+            return self._admitted(query_history.id, server, owner_id, entry)
+          counts[owner_id] = counts.get(owner_id, 0) + 1
+          total += 1
+        position += 1
+        queued[4] = position
+
+      return entry[4]
+    finally:
+      self._lock.release()
+      if abandoned:
+        LOG.info('Queries %s left the admission queue without being polled' % abandoned)
+        self.fail_abandoned(abandoned)
+
+  def _refresh(self, server, query_server):
+    self._lock.acquire()
+    try:
+      if time.time() - self._refreshed.get(server, 0) < self.refresh_interval:
+        return
+      self._refreshed[server] = time.time()
+    finally:
+      self._lock.release()
+
+    try:
+      self.refresh_running(query_server)
+    except Exception, e:
+      LOG.warn('Failed to refresh the running queries of %s: %s' % (server, e))
+
+  def _admitted(self, query_id, server, owner_id, entry):
+    if entry is not None:
+      self._queue.remove(entry)
+    self._starting[query_id] = (server, owner_id)
+    self.admitted += 1
+    return 0
+
+  def started(self, query_id):
+    """The admitted query was submitted (or failed to be), its state is saved"""
+    self._lock.acquire()
+    try:
+      self._starting.pop(query_id, None)
+    finally:
+      self._lock.release()
+
+  def remove(self, query_id):
+    """The queued query was canceled"""
+    self._lock.acquire()
+    try:
+      self._queue = [entry for entry in self._queue if entry[0] != query_id]
+    finally:
+      self._lock.release()
+
+  def get_position(self, query_id):
+    """Last position of the query in the queue, 0 when it is not queued"""
+    self._lock.acquire()
+    try:
+      for entry in self._queue:
+        if entry[0] == query_id:
+          return entry[4]
+      return 0
+    finally:
+      self._lock.release()
+
+
+admission_queue = AdmissionQueue()
@@ -26,7 +26,7 @@ from django import forms
 
 HIVE_IDENTIFER_REGEX = re.compile("^[a-zA-Z0-9]\w*$")
 
-DL_FORMATS = [ 'csv', 'xls' ]
+DL_FORMATS = [ 'csv', 'xls', 'xlsx' ]
 
 SELECTION_SOURCE = [ '', 'table', 'constant', ]
 
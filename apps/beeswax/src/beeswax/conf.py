@@ -88,6 +88,12 @@ BEESWAX_SERVER_CONN_TIMEOUT = Config(
   type=int,
   help=_('Timeout in seconds for Thrift calls to Beeswax service.'))
 
+SERVER_CONN_POOL_SIZE = Config(
+  key='server_conn_pool_size',
+  default=0,
+  type=int,
+  help=_('Number of connections to the Beeswax or HiveServer2 service. 0 uses the size of [desktop] [[thrift_pool]].'))
+
 METASTORE_CONN_TIMEOUT= Config(
   key='metastore_conn_timeout',
   default=10,
@@ -111,3 +117,85 @@ SHARE_SAVED_QUERIES = Config(
   default=True,
   type=coerce_bool,
   help=_('Share saved queries with all users. If set to false, saved queries are visible only to the owner and administrators.'))
+
+RESULT_SPOOL_DIR = Config(
+  key='result_spool_dir',
+  default='',
+  help=_('Local directory where the query results are spooled while they are fetched, so that paging '
+         'and downloads do not fetch them again from the server. It is created readable only by Hue, '
+         'and should not be shared with other users. Empty disables the spool.'))
+
+RESULT_SPOOL_MAX_SIZE = Config(
+  key='result_spool_max_size',
+  default=100 * 1024 * 1024,
+  type=int,
+  help=_('Maximum size in bytes of the spool of one query result. Bigger results are not spooled.'))
+
+RESULT_SPOOL_TOTAL_SIZE = Config(
+  key='result_spool_total_size',
+  default=2 * 1024 * 1024 * 1024,
+  type=long,
+  help=_('Maximum size in bytes of all the spooled results. The least recently used are deleted first.'))
+
+RESULT_SPOOL_TTL = Config(
+  key='result_spool_ttl',
+  default=24 * 60 * 60,
+  type=int,
+  help=_('Time in seconds after which an unused spooled result is deleted.'))
+
+DOWNLOAD_MEMORY_LIMIT = Config(
+  key='download_memory_limit',
+  default=64 * 1024 * 1024,
+  type=int,
+  help=_('Approximate memory in bytes used by the rows of a query result being downloaded. '
+         'The results are fetched in batches sized to stay under this limit.'))
+
+METADATA_CACHE_TTL = Config(
+  key='metadata_cache_ttl',
+  default=5 * 60,
+  type=int,
+  help=_('Time in seconds during which the databases, tables and columns read from the query servers are cached. '
+         '0 disables the cache.'))
+
+METADATA_CACHE_SIZE = Config(
+  key='metadata_cache_size',
+  default=10000,
+  type=int,
+  help=_('Maximum number of databases lists, tables lists and tables kept in the metadata cache.'))
+
+QUERY_STATUS_LONG_POLL_TIMEOUT = Config(
+  key='query_status_long_poll_timeout',
+  default=20,
+  type=int,
+  help=_('Time in seconds during which a request for the status of a running query waits for a change. '
+         'The status of all the running queries is refreshed by a single thread of each Hue process.'))
+
+RESULT_CACHE_TTL = Config(
+  key='result_cache_ttl',
+  default=0,
+  type=int,
+  help=_('Time in seconds during which the results of a SELECT are served again from the result spool when '
+         'the same user runs the same query, with the same settings, on tables which did not change. '
+         '0 disables the result cache.'))
+
+RESULT_CACHE_TOTAL_SIZE = Config(
+  key='result_cache_total_size',
+  default=512 * 1024 * 1024,
+  type=long,
+  help=_('Maximum size in bytes of all the cached results. The least recently used are deleted first.'))
+
+MAX_CONCURRENT_QUERIES = Config(
+  key='max_concurrent_queries',
+  default=0,
+  type=int,
+  help=_('Maximum number of queries sent by Hue running at the same time on the Hive server. '
+         'The next ones wait in a queue. 0 is unlimited. The running queries of all the Hue '
+         'processes are counted, but each process admits the queries of its own queue in their order.'))
+
+MAX_CONCURRENT_QUERIES_PER_USER = Config(
+  key='max_concurrent_queries_per_user',
+  default=0,
+  type=int,
+  help=_('Maximum number of queries of a user running at the same time on the Hive server. '
+         'The next ones wait in a queue without holding back the queries of the other users. 0 is unlimited. '
+         'The running queries of all the Hue processes are counted, but each process has its own queue.'))
@@ -21,6 +21,8 @@ Views & controls for creating tables
 
 import logging
 import gzip
+import re
+import threading
 
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext as _
@@ -87,6 +89,7 @@ def create_table(request, database='default'):
 
 IMPORT_PEEK_SIZE = 8192
 IMPORT_PEEK_NLINES = 10
+IMPORT_SAMPLE_CACHE_SIZE = 100
 DELIMITERS = [ hive_val for hive_val, desc, ascii in TERMINATORS ]
 DELIMITER_READABLE = {'\\001' : _('ctrl-As'),
                       '\\002' : _('ctrl-Bs'),
@@ -96,13 +99,23 @@ DELIMITER_READABLE = {'\\001' : _('ctrl-As'),
                       ' '     : _('spaces')}
 FILE_READERS = [ ]
 
+# Column type inference
+NULL_VALUES = ('', '\\N')
+INT_RE = re.compile(r'^[-+]?\d+$')
+DOUBLE_RE = re.compile(r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$')
+TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{1,9})?$')
+INT_MAX = 2 ** 31 - 1
+BIGINT_MAX = 2 ** 63 - 1
+NUMERIC_TYPES = ('int', 'bigint', 'double')
+
 def import_wizard(request, database='default'):
   """
   Help users define table and based on a file they want to import to Hive.
   Limitations:
     - Rows are delimited (no serde).
     - No detection for map and array types.
-    - No detection for the presence of column header in the first row.
+    - No detection for the presence of column header in the first row, the
+      column types are then all guessed as string.
     - No partition table.
     - Does not work with binary data.
   """
@@ -208,10 +221,11 @@ def import_wizard(request, database='default'):
       if do_s3_column_def:
         if s3_col_formset is None:
           columns = []
+          column_types = _infer_column_types(fields_list)
           for i in range(n_cols):
             columns.append(dict(
                 column_name='col_%s' % (i,),
-                column_type='string',
+                column_type=column_types[i],
             ))
           s3_col_formset = ColumnTypeFormSet(prefix='cols', initial=columns)
         return render('define_columns.mako', request, {
@@ -285,14 +299,8 @@ def _delim_preview(fs, file_form, encoding, file_types, delimiters):
   assert file_form.is_valid()
 
   path = file_form.cleaned_data['path']
-  try:
-    file_obj = fs.open(path)
-    delim, file_type, fields_list = _parse_fields(path, file_obj, encoding, file_types, delimiters)
-    file_obj.close()
-  except IOError, ex:
-    msg = "Failed to open file '%s': %s" % (path, ex)
-    LOG.exception(msg)
-    raise PopupException(msg)
+  file_type, lines = _read_sample(fs, path, encoding, file_types)
+  delim, fields_list = _readfields(lines, delimiters)
 
   n_cols = max([ len(row) for row in fields_list ])
   # ``delimiter`` is a MultiValueField. delimiter_0 and delimiter_1 are the sub-fields.
@@ -312,32 +320,99 @@ def _delim_preview(fs, file_form, encoding, file_types, delimiters):
   return fields_list, n_cols, delim_form
 
 
-def _parse_fields(path, file_obj, encoding, filetypes, delimiters):
+class SampleCache(object):
+  """
+  The decoded first lines of the files previewed by the wizard, so that its steps do not
+  read and decompress the file again. Keys are (user, path, mtime, size, encoding, file type),
+  the least recently used entries are evicted when there are more than ``size``.
   """
-  _parse_fields(path, file_obj, encoding, filetypes, delimiters)
-                                  -> (delimiter, filetype, fields_list)
+  def __init__(self, size=IMPORT_SAMPLE_CACHE_SIZE):
+    self.size = size
+    self._entries = {}                  # key -> [last use, lines]
+    self._lock = threading.Lock()
+    self._uses = 0
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    """get(key) -> (found, lines)"""
+    self._lock.acquire()
+    try:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return False, None
+      self._uses += 1
+      entry[0] = self._uses
+      self.hits += 1
+      return True, entry[1]
+    finally:
+      self._lock.release()
+
+  def put(self, key, lines):
+    self._lock.acquire()
+    try:
+      self._uses += 1
+      self._entries[key] = [self._uses, lines]
+      if len(self._entries) > self.size:
+        oldest = min([(entry[0], old_key) for old_key, entry in self._entries.iteritems()])[1]
+        del self._entries[oldest]
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._entries.clear()
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._entries)
 
-  Go through the list of ``filetypes`` (gzip, text) and stop at the first one
-  that works for the data. Then apply the list of ``delimiters`` and pick the
-  most appropriate one.
-  ``path`` is used for debugging only.
 
-  Return the best delimiter, filetype and the data broken down into rows of fields.
+sample_cache = SampleCache()
+
+
+def _read_sample(fs, path, encoding, file_types):
   """
-  file_readers = [ reader for reader in FILE_READERS if reader.TYPE in filetypes ]
-
-  for reader in file_readers:
-    LOG.debug("Trying %s for file: %s" % (reader.TYPE, path))
-    file_obj.seek(0, hadoopfs.SEEK_SET)
-    lines = reader.readlines(file_obj, encoding)
-    if lines is not None:
-      delim, fields_list = _readfields(lines, delimiters)
-      return delim, reader.TYPE, fields_list
-  else:
-    # Even TextFileReader doesn't work
-    msg = _("Failed to decode file '%(path)s' into printable characters under %(encoding)s") % {'path': path, 'encoding': encoding}
-    LOG.error(msg)
-    raise PopupException(msg)
+  _read_sample(fs, path, encoding, file_types) -> (file_type, lines)
+
+  Go through the list of ``file_types`` (gzip, text) and stop at the first one
+  that works for the data. The file is only opened when one of its samples is not
+  in the cache yet, a new version of the file has a different mtime or size.
+  The samples are cached per user, the ones of a user are read with their permissions.
+  """
+  file_obj = None
+  try:
+    try:
+      stats = fs.stats(path)
+      version = (fs.user, path, stats['mtime'], stats['size'], encoding)
+
+      for reader in [ reader for reader in FILE_READERS if reader.TYPE in file_types ]:
+        found, lines = sample_cache.get(version + (reader.TYPE,))
+        if not found:
+          LOG.debug("Trying %s for file: %s" % (reader.TYPE, path))
+          if file_obj is None:
+            file_obj = fs.open(path)
+          else:
+            file_obj.seek(0, hadoopfs.SEEK_SET)
+          lines = reader.readlines(file_obj, encoding)
+          sample_cache.put(version + (reader.TYPE,), lines)
+        if lines is not None:
+          return reader.TYPE, lines
+    except IOError, ex:
+      msg = _("Failed to open file '%(path)s': %(error)s") % {'path': path, 'error': ex}
+      LOG.exception(msg)
+      raise PopupException(msg)
+  finally:
+    if file_obj is not None:
+      file_obj.close()
+
+  # Even TextFileReader doesn't work
+  msg = _("Failed to decode file '%(path)s' into printable characters under %(encoding)s") % {'path': path, 'encoding': encoding}
+  LOG.error(msg)
+  raise PopupException(msg)
 
 
 def _readfields(lines, delimiters):
@@ -348,61 +423,96 @@ def _readfields(lines, delimiters):
 
   Choose the best delimiter from the given list of delimiters. Return that delimiter
   and the fields parsed by using that delimiter.
-  """
-  def score_delim(fields_list):
-    """
-    How good is this fields_list? Score based on variance of the number of fields
-    The score is always non-negative. The higher the better.
-    """
-    n_lines = len(fields_list)
-    len_list = [ len(fields) for fields in fields_list ]
-
-    if not len_list:
-      raise PopupException(_("Could not find any columns to import"))
-
-    # All lines should break into multiple fields
-    if min(len_list) == 1:
-      return 0
-
-    avg_n_fields = sum(len_list) / n_lines
-    sq_of_exp = avg_n_fields * avg_n_fields
-
-    len_list_sq = [ l * l for l in len_list ]
-    exp_of_sq = sum(len_list_sq) / n_lines
-    var = exp_of_sq - sq_of_exp
-    # Favour more fields
-    return (1000.0 / (var + 1)) + avg_n_fields
-
 
+  The occurrences of all the delimiters are counted in one pass over the lines, which
+  are only split with the best one. A delimiter is scored on the variance
+  of the number of fields it gives. The score is always non-negative. The higher the better.
+  """
+  lines = [ line for line in lines if line ]
+  if not lines:
+    raise PopupException(_("Could not find any columns to import"))
+
+  # Unescape the delimiters back to their character values
+  chars = [ delim.decode('string_escape') for delim in delimiters ]
+  sums = [ 0 ] * len(chars)
+  sums_sq = [ 0 ] * len(chars)
+  mins = [ None ] * len(chars)
+  for line in lines:
+    for i, char in enumerate(chars):
+      n_fields = line.count(char) + 1
+      sums[i] += n_fields
+      sums_sq[i] += n_fields * n_fields
+      if mins[i] is None or n_fields < mins[i]:
+        mins[i] = n_fields
+
+  n_lines = len(lines)
   max_score = -1
-  res = (None, None)
-
-  for delim in delimiters:
-    fields_list = [ ]
-    for line in lines:
-      if line:
-        # Unescape the delimiter back to its character value
-        fields_list.append(line.split(delim.decode('string_escape')))
-    score = score_delim(fields_list)
+  best = None
+  for i, delim in enumerate(delimiters):
+    # All lines should break into multiple fields
+    if mins[i] == 1:
+      score = 0
+    else:
+      avg_n_fields = sums[i] / n_lines
+      var = sums_sq[i] / n_lines - avg_n_fields * avg_n_fields
+      # Favour more fields
+      score = (1000.0 / (var + 1)) + avg_n_fields
     LOG.debug("'%s' gives score of %s" % (delim, score))
     if score > max_score:
       max_score = score
-      res = (delim, fields_list)
-  return res
+      best = i
 
+  if best is None:
+    return (None, None)
+  return delimiters[best], [ line.split(chars[best]) for line in lines ]
 
-def _peek_file(fs, file_form):
-  """_peek_file(fs, file_form) -> (path, initial data)"""
-  try:
-    path = file_form.cleaned_data['path']
-    file_obj = fs.open(path)
-    file_head = file_obj.read(IMPORT_PEEK_SIZE)
-    file_obj.close()
-    return (path, file_head)
-  except IOError, ex:
-    msg = _("Failed to open file '%(path)s': %(error)s") % {'path': path, 'error': ex}
-    LOG.exception(msg)
-    raise PopupException(msg)
+
+def _infer_column_types(fields_list):
+  """
+  _infer_column_types(fields_list) -> [ Hive type of each column ]
+
+  The narrowest of int, bigint, double, timestamp and string holding all the values of
+  the column in the sample. Empty and \\N (NULL) values are ignored. A column becomes
+  string as soon as one of its values is not a number or a timestamp, and its other values
+  are then not looked at.
+  """
+  n_cols = max([ len(row) for row in fields_list ] + [ 0 ])
+  column_types = []
+  for i in range(n_cols):
+    column_type = None
+    for row in fields_list:
+      if i >= len(row) or row[i] in NULL_VALUES:
+        continue
+      if column_type is None or not _TYPE_CHECKS[column_type](row[i]):
+        column_type = _wider_type(column_type, _value_type(row[i]))
+        if column_type == 'string':
+          break
+    column_types.append(column_type or 'string')
+  return column_types
+
+
+_TYPE_CHECKS = {
+  'int': lambda value: INT_RE.match(value) is not None and -INT_MAX - 1 <= int(value) <= INT_MAX,
+  'bigint': lambda value: INT_RE.match(value) is not None and -BIGINT_MAX - 1 <= int(value) <= BIGINT_MAX,
+  'double': lambda value: DOUBLE_RE.match(value) is not None,
+  'timestamp': lambda value: TIMESTAMP_RE.match(value) is not None,
+  'string': lambda value: True,
+}
+
+def _value_type(value):
+  """The narrowest type of a single value"""
+  for column_type in ('int', 'bigint', 'double', 'timestamp'):
+    if _TYPE_CHECKS[column_type](value):
+      return column_type
+  return 'string'
+
+def _wider_type(type1, type2):
+  """The narrowest type holding the values of both types"""
+  if type1 is None or type1 == type2:
+    return type2
+  if type1 in NUMERIC_TYPES and type2 in NUMERIC_TYPES:
+    return NUMERIC_TYPES[max(NUMERIC_TYPES.index(type1), NUMERIC_TYPES.index(type2))]
+  return 'string'
 
 
 class GzipFileReader(object):
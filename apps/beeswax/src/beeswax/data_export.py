@@ -17,14 +17,18 @@
 #
 # Handling of data export
 
+import Queue
 import logging
+import marshal
+import threading
 import time
 
-from django.http import HttpResponse
+from django.db import connection
 
-from desktop.lib.export_csvxls import CSVformatter, TooBigToDownloadException
+from desktop.lib.export_csvxls import CSVformatter, XLSXformatter, XLSX_MIMETYPE, TooBigToDownloadException,\
+                                      batches, make_streaming_response
 
-from beeswax import common
+from beeswax import common, conf, query_timings, result_spool
 
 
 LOG = logging.getLogger(__name__)
@@ -32,11 +36,14 @@ LOG = logging.getLogger(__name__)
 _DATA_WAIT_SLEEP = 0.1                  # Sleep 0.1 sec before checking for data availability
 FETCH_ROWS = 100000
 
-def download(handle, format, db):
+def download(handle, format, db, spool=None, compression=None, query_history=None):
   """
   download(query_model, format) -> HttpResponse
 
   Retrieve the query result in the format specified. Return an HttpResponse object.
+  The rows are read from the result ``spool`` when available. The response is gzipped
+  according to ``compression`` (see export_csvxls.make_streaming_response). The fetches
+  are recorded in the timings of ``query_history``.
   """
   if format not in common.DL_FORMATS:
     LOG.error('Unknown download format "%s"' % (format,))
@@ -49,49 +56,164 @@ def download(handle, format, db):
     # We 'fool' the user by sending back CSV as XSL as it supports streaming and won't freeze Hue
     formatter = CSVformatter()
     mimetype = 'application/xls'
+  elif format == 'xlsx':
+    formatter = XLSXformatter()
+    mimetype = XLSX_MIMETYPE
+    compression = None                  # Already compressed
 
-  gen = data_generator(handle, formatter, db)
-  resp = HttpResponse(gen, mimetype=mimetype)
-  resp['Content-Disposition'] = 'attachment; filename=query_result.%s' % (format,)
+  gen = data_generator(handle, formatter, db, spool, query_history)
+  return make_streaming_response(gen, mimetype, 'query_result.%s' % (format,), compression)
 
-  return resp
 
-
-def data_generator(handle, formatter, db):
+def data_generator(handle, formatter, db, spool=None, query_history=None):
   """
   data_generator(query_model, formatter) -> generator object
 
   Return a generator object for a csv. The first line is the column names.
 
   This is similar to export_csvxls.generator, but has
-  one or two extra complexities.
+  one or two extra complexities. The next batch of rows is fetched
+  in the background while the current one is being formatted.
   """
-  _DATA_WAIT_SLEEP
   is_first_row = True
+  truncated = False
 
   yield formatter.init_doc()
 
-  results = db.fetch(handle, start_over=is_first_row, rows=FETCH_ROWS)
-
-  while results is not None:
-    while not results.ready:   # For Beeswax
-      time.sleep(_DATA_WAIT_SLEEP)
-      results = db.fetch(handle, start_over=is_first_row, rows=FETCH_ROWS)
-
+  for results in ResultPrefetcher(db, handle, spool):
     # TODO Check for concurrent reading when HS2 supports start_row
     if is_first_row:
       is_first_row = False
       yield formatter.format_header(results.cols())
 
-    for row in results.rows():
+    for rows in batches(results.rows()):
       try:
-        yield formatter.format_row(row)
+        yield formatter.format_rows(rows)
       except TooBigToDownloadException, ex:
-        LOG.error(ex)
+        # The next rows would not fit either, stop fetching them
+        LOG.warn(ex)
+        yield ex.partial
+        truncated = True
+        break
+    if truncated:
+      break
 
-    if results.has_more:
-      results = db.fetch(handle, start_over=is_first_row, rows=FETCH_ROWS)
-    else:
-      results = None
+  if query_history is not None:
+    query_timings.record_fetch(query_history, db.fetch_stats)
 
   yield formatter.fini_doc()
+
+
+class ResultPrefetcher(object):
+  """
+  Iterates over the batches of rows of a query result. A background thread fetches
+  the next batches while the current one is being consumed, holding at most
+  ``depth`` batches ready. The thread stops when the iteration is closed, e.g. when
+  the client of a download disconnects.
+
+  The size of the batches adapts to the observed width of the rows, so that the
+  batches in memory (ready, being fetched and being consumed) stay under
+  ``memory_limit`` bytes, and to the fetch latency, aiming at TARGET_FETCH_TIME
+  seconds per fetch.
+  """
+  FIRST_FETCH_ROWS = 1000
+  MIN_FETCH_ROWS = 100
+  TARGET_FETCH_TIME = 2.0
+  SAMPLE_ROWS = 100
+  CONSUMER_TIMEOUT = 600                # Give up when the batches are not consumed
+
+  def __init__(self, db, handle, spool=None, memory_limit=None, max_rows=FETCH_ROWS, depth=1):
+    self.db = db
+    self.handle = handle
+    self.spool = spool
+    if memory_limit is None:
+      memory_limit = conf.DOWNLOAD_MEMORY_LIMIT.get()
+    self.memory_limit = memory_limit
+    self.max_rows = max_rows
+    self.depth = depth
+    self.fetch_rows = min(self.FIRST_FETCH_ROWS, max_rows)
+    self._queue = Queue.Queue(depth)
+    self._stopped = threading.Event()
+
+  def __iter__(self):
+    fetcher = threading.Thread(target=self._fetch_all, name='ResultPrefetcher')
+    fetcher.setDaemon(True)
+    fetcher.start()
+
+    try:
+      while True:
+        kind, value = self._queue.get()
+        if kind == 'batch':
+          yield value
+        elif kind == 'error':
+          raise value
+        else:
+          return
+    finally:
+      self._stopped.set()
+
+  def _fetch_all(self):
+    next_row = 0
+    try:
+      while not self._stopped.isSet():
+        start = time.time()
+        results = self._fetch(next_row)
+        if results is None:
+          break
+
+        data = list(results.rows())
+        self._adapt_fetch_rows(data, time.time() - start)
+
+        batch = result_spool.SpooledResult(data, results.cols(), next_row, results.has_more)
+        if not self._put(('batch', batch)):
+          return
+        next_row += len(data)
+
+        if not results.has_more:
+          break
+      self._put(('done', None))
+    except Exception, ex:
+      LOG.exception('Failed to fetch the results from row %s' % next_row)
+      self._put(('error', ex))
+    finally:
+      # The HS2 session is read through the ORM in this thread
+      connection.close()
+
+  def _fetch(self, first_row):
+    results = result_spool.fetch(self.db, self.handle, self.spool, first_row, self.fetch_rows)
+    while results is not None and not results.ready and not self._stopped.isSet():   # For Beeswax
+      time.sleep(_DATA_WAIT_SLEEP)
+      results = result_spool.fetch(self.db, self.handle, self.spool, first_row, self.fetch_rows)
+    return results
+
+  def _put(self, item):
+    waited = 0
+    while waited < self.CONSUMER_TIMEOUT:
+      if self._stopped.isSet():
+        return False
+      try:
+        self._queue.put(item, True, 1)
+        return True
+      except Queue.Full:
+        waited += 1
+    LOG.warn('Stopped prefetching the results: nothing consumed for %s seconds' % self.CONSUMER_TIMEOUT)
+    return False
+
+  def _adapt_fetch_rows(self, data, duration):
+    if not data:
+      return
+
+    fetch_rows = self.fetch_rows
+    if duration < self.TARGET_FETCH_TIME / 2 and len(data) == fetch_rows:
+      fetch_rows *= 2
+    elif duration > self.TARGET_FETCH_TIME * 2:
+      fetch_rows /= 2
+
+    sample = data[:self.SAMPLE_ROWS]
+    try:
+      row_size = max(len(marshal.dumps(sample)) / len(sample), 1)
+      fetch_rows = min(fetch_rows, self.memory_limit / ((self.depth + 2) * row_size))
+    except ValueError:
+      pass # Not a marshallable type
+
+    self.fetch_rows = max(self.MIN_FETCH_ROWS, min(fetch_rows, self.max_rows))
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+from django.core.management.base import NoArgsCommand
+
+from beeswax import conf, result_cache, result_spool
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Command(NoArgsCommand):
+  """
+  Delete the expired query results from the local spool and the result cache, and the
+  least recently used ones when they are over their total size. Meant to be run from cron.
+  """
+  def handle_noargs(self, **options):
+    root = conf.RESULT_SPOOL_DIR.get()
+    if root:
+      LOG.info('Cleaning up the result spool %s' % root)
+      result_spool.cleanup(root)
+      result_cache.result_cache.cleanup()
@@ -74,6 +74,9 @@ class QueryHistory(models.Model):
 
   design = models.ForeignKey('SavedQuery', to_field='id', null=True) # Some queries (like read/create table) don't have a design
   notify = models.BooleanField(default=False)                        # Notify on completion
+  cache_key = models.CharField(max_length=40, null=True)             # Key of the results in the result cache
+  cache_hit = models.BooleanField(default=False)                     # The results were copied from the result cache
+  timings = models.TextField(null=True)                              # JSON of where the time went, see query_timings
 
   class Meta:
     ordering = ['-submission_date']
@@ -143,6 +146,10 @@ class QueryHistory(models.Model):
   def is_failure(self):
     return self.last_state in (QueryHistory.STATE.expired.index, QueryHistory.STATE.failed.index)
 
+  def is_queued(self):
+    """Waiting in the admission queue, not sent to the server yet"""
+    return self.last_state == QueryHistory.STATE.submitted.index and not self.server_id
+
   def set_to_running(self):
     self.last_state = QueryHistory.STATE.running.index
 
@@ -388,6 +395,7 @@ class QueryHandle(object):
     self.has_result_set = has_result_set
     self.modified_row_count = modified_row_count
     self.log_context = log_context
+    self.submit_time = None                     # Seconds taken by the calls which submitted the query
 
   def is_valid(self):
     return sum([bool(obj) for obj in [self.get()]]) > 0
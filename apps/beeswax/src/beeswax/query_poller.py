@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Background refresh of the status of the running queries
+
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+MIN_INTERVAL = 1.0                      # Seconds between two refreshes of a query which changes
+MAX_INTERVAL = 5.0                      # Seconds between two refreshes of a query which does not change
+IDLE_TIMEOUT = 60                       # Stop refreshing a query nobody asked about for this long
+FIRST_REFRESH_TIMEOUT = 60              # Maximum wait for the first status of a query
+REFRESH_TIMEOUT = 5                     # The other queries are refreshed if one takes longer
+MAX_WAITING_REQUESTS = 4                # Requests which can wait for a change at the same time
+
+
+class QueryStatus(object):
+  """
+  Last known status of a query. ``version`` is incremented each time ``data`` or ``error``
+  changes, it is 0 until the first refresh.
+  """
+  def __init__(self, query_id):
+    self.query_id = query_id
+    self.version = 0
+    self.data = None
+    self.error = None
+    self.finished = False
+    self.interval = MIN_INTERVAL
+    self.next_refresh = 0
+    self.last_request = time.time()
+    self.refreshing = False
+
+
+class QueryPoller(object):
+  """
+  Refreshes in one thread the status of all the queries watched in this process.
+
+  ``refresh(query_id)`` returns the status data of a query as a dictionary, which
+  has a true 'isSuccess' or 'isFailure' when the query is over. A query is refreshed
+  every MIN_INTERVAL seconds while it changes, and less often up to every MAX_INTERVAL
+  seconds while it does not.
+
+  Each refresh runs in its own thread. The poller waits at most ``refresh_timeout`` seconds
+  for it before refreshing the other queries, so that a slow server does not stall them.
+  """
+  def __init__(self, refresh, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, idle_timeout=IDLE_TIMEOUT,
+               max_waiting_requests=MAX_WAITING_REQUESTS, refresh_timeout=REFRESH_TIMEOUT):
+    self.refresh = refresh
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self.idle_timeout = idle_timeout
+    self.max_waiting_requests = max_waiting_requests
+    self.refresh_timeout = refresh_timeout
+    self.refreshes = 0
+    self._statuses = {}
+    self._waiting_requests = 0
+    self._condition = threading.Condition()
+    self._thread = None
+
+  def get_status(self, query_id, version=None, timeout=0):
+    """
+    get_status(query_id, version, timeout) -> QueryStatus
+
+    Waits at most ``timeout`` seconds for a status more recent than ``version``.
+    The first status of a query is always waited for, unless too many requests
+    are already waiting: its ``version`` is then 0 and its ``data`` None.
+    """
+    self._condition.acquire()
+    try:
+      status = self._statuses.get(query_id)
+      if status is None:
+        status = QueryStatus(query_id)
+        self._statuses[query_id] = status
+        self._start()
+        self._condition.notifyAll()
+      status.last_request = time.time()
+
+      if self._waiting_requests >= self.max_waiting_requests:
+        timeout = 0
+      elif status.version == 0:
+        timeout = max(timeout, FIRST_REFRESH_TIMEOUT)
+      elif version is None or version < status.version:
+        timeout = 0
+
+      end = time.time() + timeout
+      self._waiting_requests += 1
+      try:
+        while status.version == 0 or (version is not None and status.version <= version and not status.finished):
+          remaining = end - time.time()
+          if remaining <= 0:
+            break
+          self._condition.wait(remaining)
+      finally:
+        self._waiting_requests -= 1
+
+      return status
+    finally:
+      self._condition.release()
+
+  def _start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name='QueryPoller')
+      self._thread.setDaemon(True)
+      self._thread.start()
+
+  def _run(self):
+    while True:
+      self._condition.acquire()
+      try:
+        now = time.time()
+        for query_id, status in self._statuses.items():
+          if now - status.last_request > self.idle_timeout:
+            del self._statuses[query_id]
+
+        if not self._statuses:
+          self._thread = None
+          return
+
+        idle = [status for status in self._statuses.itervalues() if not status.refreshing]
+        due = [status for status in idle if status.next_refresh <= now]
+        if not due:
+          # The refreshes taking longer notify when they are over
+          self._condition.wait(min([status.next_refresh - now for status in idle] + [self.max_interval]))
+          continue
+        for status in due:
+          status.refreshing = True
+      finally:
+        self._condition.release()
+
+      for status in due:
+        refresher = threading.Thread(target=self._refresh, args=(status,), name='QueryPollerRefresh')
+        refresher.setDaemon(True)
+        refresher.start()
+        refresher.join(self.refresh_timeout)
+        if refresher.isAlive():
+          LOG.warn('Refresh of the status of query %s takes more than %s seconds' % (status.query_id, self.refresh_timeout))
+
+  def _refresh(self, status):
+    error = None
+    try:
+      data = self.refresh(status.query_id)
+    except Exception, e:
+      LOG.exception('Failed to refresh the status of query %s' % (status.query_id,))
+      data = status.data
+      error = e
+    self.refreshes += 1
+
+    self._condition.acquire()
+    try:
+      if data != status.data or error is not None or status.error is not None:
+        status.version += 1
+        status.interval = self.min_interval
+      else:
+        status.interval = min(status.interval * 1.5, self.max_interval)
+      status.data = data
+      status.error = error
+      # Errors are retried, they can come from a server being restarted
+      status.finished = error is None and bool(data and (data.get('isSuccess') or data.get('isFailure')))
+
+      if status.finished:
+        # The status does not change any more, but is still served until idle
+        status.next_refresh = time.time() + self.idle_timeout
+      else:
+        status.next_refresh = time.time() + status.interval
+      status.refreshing = False
+      self._condition.notifyAll()
+    finally:
+      self._condition.release()
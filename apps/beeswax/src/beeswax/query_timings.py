@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Where the time of a query went, recorded with its QueryHistory
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+import logging
+import time
+
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _t
+
+from beeswax.models import QueryHistory
+
+
+LOG = logging.getLogger(__name__)
+
+# Durations in seconds. 'first_state_change', 'finished' and 'first_row' are counted from the
+# submission of the query, as seen by the status polls and the fetches.
+PHASES = (
+  ('queued', _t('Admission queue')),                # Waiting for the query server in Hue
+  ('submit', _t('Submit')),                         # In the submit calls, e.g. ExecuteStatement
+  ('first_state_change', _t('Server queue')),       # Until the server started to run the query
+  ('finished', _t('Finished')),                     # Until the last statement finished
+  ('first_row', _t('First row')),                   # Until the first rows were fetched
+  ('fetch', _t('Fetch')),                           # In the fetch calls, e.g. FetchResults
+  ('render', _t('Render')),                         # Last rendering of a page of results
+)
+COUNTERS = (
+  ('rows', _t('Rows fetched')),
+  ('bytes', _t('Bytes fetched')),
+)
+PERCENTILES = (50, 90, 99)
+
+
+class FetchStats(object):
+  """What the fetches of a Dbms read from the server since the last reset()"""
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    self.time = 0.0
+    self.rows = 0
+    self.bytes = 0
+    self.first_row = None               # Time of the first fetch returning rows
+
+  def add(self, data_table):
+    self.time += getattr(data_table, 'fetch_time', 0)
+    self.rows += getattr(data_table, 'row_count', 0)
+    self.bytes += getattr(data_table, 'byte_count', 0)
+    if self.first_row is None and getattr(data_table, 'row_count', 0):
+      self.first_row = time.time()
+
+
+def get(query_history):
+  """get(query_history) -> {phase or counter: value}"""
+  try:
+    return json.loads(query_history.timings or '{}')
+  except ValueError:
+    return {}
+
+
+def record(query_history, added=None, first=None, last=None):
+  """
+  Adds the ``added`` values to the timings of the query, sets the ``first`` ones which
+  are not set yet and the ``last`` ones. The timings are read again from the database
+  as other processes record the phases they see.
+  """
+  added = added or {}
+  first = first or {}
+  last = last or {}
+  timings = get(query_history)
+  if not added and not last and not [name for name in first if name not in timings]:
+    return timings
+
+  try:
+    transaction.commit_unless_managed()
+    saved = QueryHistory.objects.filter(id=query_history.id).values_list('timings', flat=True)
+    if saved:
+      query_history.timings = saved[0]
+      timings = get(query_history)
+
+    for name, value in added.iteritems():
+      timings[name] = timings.get(name, 0) + value
+    for name, value in first.iteritems():
+      timings.setdefault(name, value)
+    timings.update(last)
+    for name, value in timings.iteritems():
+      if isinstance(value, float):
+        timings[name] = round(value, 3)
+
+    # Only this field, the other ones could be saved by someone else
+    query_history.timings = json.dumps(timings)
+    QueryHistory.objects.filter(id=query_history.id).update(timings=query_history.timings)
+  except Exception, e:
+    LOG.warn('Could not record the timings of query %s: %s' % (query_history.id, e))
+  return timings
+
+
+def record_submit(query_history, handle, start, queued=None):
+  """The statement of the query was submitted at ``start``"""
+  submit_time = getattr(handle, 'submit_time', None)
+  if submit_time is None:
+    submit_time = time.time() - start
+  first = {'start': start}
+  if queued is not None:
+    first['queued'] = queued
+  record(query_history, added={'submit': submit_time}, first=first)
+
+
+def record_state(query_history, server_state, state):
+  """
+  The status poll found the statement in ``server_state``, and the query in ``state``,
+  which stays running until the last statement finished.
+  """
+  start = get(query_history).get('start')
+  if start is None:
+    return
+
+  first = {}
+  if server_state != QueryHistory.STATE.submitted:
+    first['first_state_change'] = time.time() - start
+  if state not in (QueryHistory.STATE.submitted, QueryHistory.STATE.running):
+    first['finished'] = time.time() - start
+  record(query_history, first=first)
+
+
+def record_fetch(query_history, stats):
+  """The rows fetched by a Dbms"""
+  if not stats.time:
+    return
+
+  first = {}
+  start = get(query_history).get('start')
+  if stats.first_row is not None and start is not None:
+    first['first_row'] = stats.first_row - start
+  record(query_history, added={'fetch': stats.time, 'rows': stats.rows, 'bytes': stats.bytes}, first=first)
+  stats.reset()
+
+
+def get_percentiles(query_histories, percentiles=PERCENTILES):
+  """
+  get_percentiles(query_histories) -> [(phase or counter, label, count, [value at each percentile])]
+
+  Nearest rank percentiles of each phase over the queries where it was recorded.
+  """
+  values = {}
+  for query_history in query_histories:
+    for name, value in get(query_history).iteritems():
+      values.setdefault(name, []).append(value)
+
+  stats = []
+  for name, label in PHASES + COUNTERS:
+    recorded = sorted(values.get(name, []))
+    if recorded:
+      stats.append((name, label, len(recorded),
+                    [recorded[max(int(round(percentile / 100.0 * len(recorded))) - 1, 0)] for percentile in percentiles]))
+  return stats
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Cache of the results of the SELECT queries, kept in the result spool directory
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+try:
+  from hashlib import sha1
+except ImportError:
+  from sha import new as sha1
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from beeswax import conf, result_spool
+
+
+LOG = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = 'cache'                # Under the result spool directory
+ENTRY_NAME_RE = re.compile(r'^[0-9a-f]{40}$')
+
+# Literals, quoted identifiers, comments, blanks and the rest
+TOKEN_RE = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|(`[^`]*`)|(--[^\n]*)|(\s+)|((?:[^'"`\s-]|-(?!-))+|.)""", re.DOTALL)
+# Tables read by a query: FROM a, FROM a x, b y, JOIN db.a
+TABLE_RE = re.compile(r'\b(?:from|join) ((?:[\w.`]+(?: (?:as )?\w+)? ?, ?)*[\w.`]+)')
+# Functions which do not return the same result at each run
+NON_DETERMINISTIC_RE = re.compile(r'\b(?:rand|unix_timestamp|current_date|current_timestamp|current_user|uuid|'
+                                  r'reflect|java_method|in_file) ?\(')
+
+
+def normalize(hql):
+  """
+  normalize(hql) -> (normalized hql, normalized hql without its literals)
+
+  Removes the comments, collapses the blanks and lowercases everything but the string literals.
+  """
+  text = []
+  skeleton = []
+  for literal, identifier, comment, blank, other in TOKEN_RE.findall(hql):
+    if literal:
+      text.append(literal)
+      skeleton.append("''")
+    elif comment or blank:
+      if text and text[-1] != ' ':
+        text.append(' ')
+        skeleton.append(' ')
+    else:
+      token = (identifier or other).lower()
+      text.append(token)
+      skeleton.append(token)
+
+  return ''.join(text).strip().rstrip(';').strip(), ''.join(skeleton).strip().rstrip(';').strip()
+
+
+def get_table_names(skeleton, database='default'):
+  """List of the (database, table) read by the normalized query without literals"""
+  tables = []
+  for match in TABLE_RE.findall(skeleton):
+    for reference in match.split(','):
+      name = reference.strip().split(' ')[0].replace('`', '')
+      if '.' in name:
+        table = tuple(name.split('.', 1))
+      else:
+        table = (database, name)
+      if table not in tables:
+        tables.append(table)
+  return tables
+
+
+def get_key(db, query):
+  """
+  get_key(db, query) -> key or None
+
+  The key of the results of an HQLdesign, or None when they can't be cached: the cache is
+  disabled, or the query is not a single SELECT, calls functions returning a different
+  result at each run, or reads a view, a partitioned table or a table of unknown version.
+
+  The key includes the server, the user, the normalized statement, the database, the settings
+  and the 'transient_lastDdlTime' of the tables read, which changes when they are altered,
+  loaded or overwritten.
+  """
+  if not result_cache.is_enabled():
+    return None
+
+  if query.file_resources or query.functions:
+    return None
+
+  hql, skeleton = normalize(query.hql_query)
+  if not skeleton.startswith('select ') or ';' in skeleton or NON_DETERMINISTIC_RE.search(skeleton):
+    return None
+
+  database = query.query.get('database') or 'default'
+  table_names = get_table_names(skeleton, database)
+  if not table_names:
+    return None
+
+  versions = []
+  for table_database, table_name in table_names:
+    try:
+      # Not from the metadata cache: the table could have been changed outside of Hue
+      table = db.get_table(table_database, table_name, use_cache=False)
+    except Exception, e:
+      LOG.debug('Not caching the results of a query reading %s.%s: %s' % (table_database, table_name, e))
+      return None
+
+    version = table.parameters.get('transient_lastDdlTime')
+    if table.is_view or table.partition_keys or not version:
+      return None
+    versions.append([table_database, table_name, version])
+
+  settings = [[setting['key'], setting['value']] for setting in query.settings]
+  key = [list(db._get_server_key()), db.client.user.username, hql, database, settings, versions]
+  return sha1(json.dumps(key)).hexdigest()
+
+
+def _link_files(source, target):
+  """Hard links the files of the source directory into the target one, or copies them"""
+  for name in os.listdir(source):
+    try:
+      os.link(os.path.join(source, name), os.path.join(target, name))
+    except (AttributeError, OSError):
+      shutil.copy2(os.path.join(source, name), os.path.join(target, name))
+
+
+class ResultCache(object):
+  """
+  Complete result spools of previous queries, by the key of their query.
+
+  An entry is a directory holding a copy of a spool and the handle of the query which produced
+  it. Entries expire ``ttl`` seconds after being stored, and the least recently used are deleted
+  when they take more than ``total_size`` bytes. The copies are hard links when possible, the
+  files of a complete spool never change.
+  """
+  def __init__(self, root=None, ttl=None, total_size=None):
+    self._root = root
+    self._ttl = ttl
+    self._total_size = total_size
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.stores = 0
+    self.rows_served = 0
+
+  @property
+  def root(self):
+    if self._root is None:
+      spool_dir = conf.RESULT_SPOOL_DIR.get()
+      return spool_dir and os.path.join(spool_dir, CACHE_DIR_NAME)
+    return self._root
+
+  @property
+  def ttl(self):
+    if self._ttl is None:
+      return conf.RESULT_CACHE_TTL.get()
+    return self._ttl
+
+  @property
+  def total_size(self):
+    if self._total_size is None:
+      return conf.RESULT_CACHE_TOTAL_SIZE.get()
+    return self._total_size
+
+  def is_enabled(self):
+    return bool(self.root) and self.ttl > 0
+
+  def _get_path(self, key):
+    return os.path.join(self.root, key)
+
+  def get(self, key):
+    """
+    get(key) -> (query handle fields, ResultSpool) or None
+
+    The spool of the entry must be copied with copy_to() before being read.
+    """
+    path = self._get_path(key)
+    try:
+      age = time.time() - os.path.getmtime(os.path.join(path, 'query'))
+      query_file = file(os.path.join(path, 'query'))
+      try:
+        query = json.loads(query_file.read())
+      finally:
+        query_file.close()
+    except (IOError, OSError, ValueError):
+      self._count('misses')
+      return None
+
+    if age > self.ttl:
+      shutil.rmtree(path, ignore_errors=True)
+      self._count('misses')
+      return None
+
+    try:
+      os.utime(path, None)
+    except OSError:
+      pass
+
+    spool = result_spool.ResultSpool(path)
+    self._count('hits')
+    self._count('rows_served', spool.row_count())
+    LOG.info('Result cache hit: %s rows of query %s, %s bytes' % (spool.row_count(), query['id'], spool.size()))
+    return query, spool
+
+  def put(self, key, spool, query_history):
+    """
+    Adds the complete spool of the query to the cache. Returns False when there was
+    nothing to add or the spool is too big.
+    """
+    if not self.is_enabled() or not spool.is_complete() or spool.size() > self.total_size:
+      return False
+
+    path = self._get_path(key)
+    if os.path.exists(path):
+      return False
+
+    if not os.path.isdir(self.root):
+      result_spool.make_private_dirs(self.root)
+    tmp_path = tempfile.mkdtemp(dir=self.root)
+    try:
+      _link_files(spool.path, tmp_path)
+
+      query_file = result_spool.open_private_file(os.path.join(tmp_path, 'query'), 'w')
+      try:
+        query_file.write(json.dumps({
+          'id': query_history.id,
+          'server_id': query_history.server_id,
+          'server_guid': query_history.server_guid,
+          'operation_type': query_history.operation_type,
+          'has_results': query_history.has_results,
+          'modified_row_count': query_history.modified_row_count,
+          'log_context': query_history.log_context,
+        }))
+      finally:
+        query_file.close()
+
+      os.rename(tmp_path, path)
+    except OSError, e:
+      # Stored at the same time by another request
+      LOG.debug('Could not cache the results of query %s: %s' % (query_history.id, e))
+      shutil.rmtree(tmp_path, ignore_errors=True)
+      return False
+
+    self._count('stores')
+    self.cleanup()
+    return True
+
+  def copy_to(self, spool, target):
+    """Copies the cached ``spool`` to the ``target`` spool, which must not exist"""
+    result_spool.make_private_dirs(target.path)
+    _link_files(spool.path, target.path)
+    os.remove(os.path.join(target.path, 'query'))
+
+  def cleanup(self):
+    """Deletes the expired entries, then the least recently used until under the total size"""
+    root = self.root
+    if not root or not os.path.isdir(root):
+      return
+
+    entries = []
+    for name in os.listdir(root):
+      path = os.path.join(root, name)
+      try:
+        if ENTRY_NAME_RE.match(name):
+          entries.append((os.path.getmtime(path), os.path.getmtime(os.path.join(path, 'query')),
+                          result_spool.ResultSpool(path).size(), path))
+        elif time.time() - os.path.getmtime(path) > result_spool.CLEANUP_INTERVAL:
+          # Left over by a failed put()
+          shutil.rmtree(path, ignore_errors=True)
+      except OSError:
+        pass
+
+    entries.sort()
+    used = sum([size for last_used, stored, size, path in entries])
+    now = time.time()
+
+    for last_used, stored, size, path in entries:
+      if now - stored > self.ttl or used > self.total_size:
+        LOG.debug('Deleting cached result %s' % path)
+        shutil.rmtree(path, ignore_errors=True)
+        used -= size
+
+  def get_stats(self):
+    """Activity of the cache in this process"""
+    self._lock.acquire()
+    try:
+      return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'rows_served': self.rows_served}
+    finally:
+      self._lock.release()
+
+  def _count(self, name, value=1):
+    self._lock.acquire()
+    try:
+      setattr(self, name, getattr(self, name) + value)
+    finally:
+      self._lock.release()
+
+
+result_cache = ResultCache()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Local spool of the query results
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+import logging
+import marshal
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+
+from beeswax import conf
+
+
+LOG = logging.getLogger(__name__)
+
+# One entry per chunk: first row, number of rows, offset and size in the data file
+INDEX_ENTRY_FORMAT = '>QIQI'
+INDEX_ENTRY_SIZE = struct.calcsize(INDEX_ENTRY_FORMAT)
+CLEANUP_INTERVAL = 600                  # Age in seconds of an unfinished copy considered left over
+SPOOL_NAME_RE = re.compile(r'^\d+_\d+$')  # <query history id>_<statement number>
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get(query_history):
+  """
+  get(query_history) -> ResultSpool or None
+
+  Returns the spool of the current statement of the query, or None when spooling is disabled.
+  The expired spools are deleted by the beeswax_result_spool_cleanup command.
+  """
+  root = conf.RESULT_SPOOL_DIR.get()
+  if not root:
+    return None
+
+  name = '%s_%s' % (query_history.id, query_history.statement_number)
+  return ResultSpool(os.path.join(root, name), conf.RESULT_SPOOL_MAX_SIZE.get())
+
+
+def make_private_dirs(path):
+  """The spooled rows are only readable by Hue"""
+  os.makedirs(path, 0700)
+
+
+def open_private_file(path, mode):
+  """Opens ``path`` for writing in ``mode``, creating it readable only by Hue"""
+  flags = os.O_WRONLY | os.O_CREAT
+  if 'a' in mode:
+    flags |= os.O_APPEND
+  else:
+    flags |= os.O_TRUNC
+  return os.fdopen(os.open(path, flags, 0600), mode)
+
+
+def cleanup(root, ttl=None, total_size=None):
+  """
+  Deletes the spools not used for ``ttl`` seconds, then the least recently used ones
+  until the spools take less than ``total_size`` bytes.
+  """
+  if ttl is None:
+    ttl = conf.RESULT_SPOOL_TTL.get()
+  if total_size is None:
+    total_size = conf.RESULT_SPOOL_TOTAL_SIZE.get()
+
+  if not os.path.isdir(root):
+    return
+
+  spools = []
+  for name in os.listdir(root):
+    if not SPOOL_NAME_RE.match(name):
+      continue
+    spool = ResultSpool(os.path.join(root, name))
+    try:
+      spools.append((spool.last_used(), spool.size(), spool))
+    except OSError:
+      pass
+
+  spools.sort()
+  used = sum([size for last_used, size, spool in spools])
+  now = time.time()
+
+  for last_used, size, spool in spools:
+    if now - last_used > ttl or used > total_size:
+      LOG.debug('Deleting result spool %s' % spool.path)
+      spool.delete()
+      used -= size
+
+
+class ResultSpool(object):
+  """
+  On-disk copy of the rows of a query result, filled while they are fetched from the server.
+
+  The rows are appended in chunks of marshalled lists to a data file. An index file holds one
+  fixed-size entry per chunk, so that any offset can be read without scanning the data.
+  A chunk is only visible once its index entry is written.
+  """
+  def __init__(self, path, max_size=None):
+    self.path = path
+    self.max_size = max_size
+
+  @property
+  def data_path(self):
+    return os.path.join(self.path, 'data')
+
+  @property
+  def index_path(self):
+    return os.path.join(self.path, 'index')
+
+  @property
+  def meta_path(self):
+    return os.path.join(self.path, 'meta')
+
+  def get_lock(self):
+    """Serializes the readers of the same result in this process"""
+    _locks_lock.acquire()
+    try:
+      if self.path not in _locks:
+        _locks[self.path] = threading.Lock()
+      return _locks[self.path]
+    finally:
+      _locks_lock.release()
+
+  def _read_meta(self):
+    try:
+      meta_file = file(self.meta_path)
+      try:
+        return json.loads(meta_file.read())
+      finally:
+        meta_file.close()
+    except (IOError, ValueError):
+      return {'columns': [], 'complete': False, 'disabled': False}
+
+  def _write_meta(self, meta):
+    tmp_path = self.meta_path + '.tmp'
+    meta_file = open_private_file(tmp_path, 'w')
+    try:
+      meta_file.write(json.dumps(meta))
+    finally:
+      meta_file.close()
+    os.rename(tmp_path, self.meta_path)
+
+  def _read_index(self):
+    try:
+      index_file = file(self.index_path, 'rb')
+      try:
+        index = index_file.read()
+      finally:
+        index_file.close()
+    except IOError:
+      return []
+
+    entries = len(index) / INDEX_ENTRY_SIZE
+    return [struct.unpack(INDEX_ENTRY_FORMAT, index[i * INDEX_ENTRY_SIZE:(i + 1) * INDEX_ENTRY_SIZE]) for i in xrange(entries)]
+
+  def exists(self):
+    return os.path.exists(self.meta_path)
+
+  def is_complete(self):
+    return self._read_meta()['complete']
+
+  def is_disabled(self):
+    return self._read_meta()['disabled']
+
+  def columns(self):
+    return self._read_meta()['columns']
+
+  def row_count(self):
+    index = self._read_index()
+    if index:
+      first_row, rows, offset, size = index[-1]
+      return first_row + rows
+    return 0
+
+  def size(self):
+    try:
+      return os.path.getsize(self.data_path)
+    except OSError:
+      return 0
+
+  def last_used(self):
+    return os.path.getmtime(self.path)
+
+  def append(self, columns, rows, complete=False):
+    """
+    Adds the rows at the end of the spool. Returns False without writing anything when
+    the spool would grow over its maximum size.
+    """
+    if not os.path.exists(self.path):
+      make_private_dirs(self.path)
+
+    chunk = marshal.dumps(rows)
+    offset = self.size()
+    if self.max_size and offset + len(chunk) > self.max_size:
+      return False
+
+    if rows:
+      data_file = open_private_file(self.data_path, 'ab')
+      try:
+        data_file.write(chunk)
+      finally:
+        data_file.close()
+
+      entry = struct.pack(INDEX_ENTRY_FORMAT, self.row_count(), len(rows), offset, len(chunk))
+      index_file = open_private_file(self.index_path, 'ab')
+      try:
+        index_file.write(entry)
+      finally:
+        index_file.close()
+
+    self._write_meta({'columns': list(columns), 'complete': complete, 'disabled': False})
+    return True
+
+  def read(self, first_row, max_rows):
+    """List of at most ``max_rows`` rows starting at ``first_row``"""
+    rows = []
+    last_row = first_row + max_rows
+
+    data_file = None
+    try:
+      for chunk_first_row, chunk_rows, offset, size in self._read_index():
+        if chunk_first_row + chunk_rows <= first_row:
+          continue
+        if chunk_first_row >= last_row:
+          break
+        if data_file is None:
+          data_file = file(self.data_path, 'rb')
+        data_file.seek(offset)
+        chunk = marshal.loads(data_file.read(size))
+        rows.extend(chunk[max(first_row - chunk_first_row, 0):last_row - chunk_first_row])
+    finally:
+      if data_file is not None:
+        data_file.close()
+
+    try:
+      os.utime(self.path, None)
+    except OSError:
+      pass
+    return rows
+
+  def disable(self):
+    """The spool can't follow the server any more: keep a marker but drop the rows"""
+    self.delete()
+    make_private_dirs(self.path)
+    self._write_meta({'columns': [], 'complete': False, 'disabled': True})
+
+  def delete(self):
+    shutil.rmtree(self.path, ignore_errors=True)
+
+
+class SpooledResult(object):
+  """Same API as the results returned by Dbms.fetch()"""
+  ready = True
+
+  def __init__(self, data, columns, start_row, has_more):
+    self.data = data
+    self.columns = columns
+    self.start_row = start_row
+    self.has_more = has_more
+
+  def rows(self):
+    return iter(self.data)
+
+  def cols(self):
+    return self.columns
+
+
+def fetch(db, handle, spool, first_row=0, rows=100):
+  """
+  fetch(db, handle, spool, first_row, rows) -> result
+
+  Returns at most ``rows`` rows starting at ``first_row``. The spooled rows are read from the
+  local disk, the missing ones are fetched from the server and appended to the spool.
+
+  Without a usable spool, this fetches directly from the server, restarting the read when
+  ``first_row`` is 0.
+  """
+  if spool is None or spool.is_disabled():
+    return db.fetch(handle, start_over=first_row == 0, rows=rows)
+
+  lock = spool.get_lock()
+  lock.acquire()
+  try:
+    row_count = spool.row_count()
+
+    if first_row > row_count:
+      # Rows would be skipped on the server: the spool can't be filled in order any more
+      LOG.warn('Disabling result spool %s: row %s requested after %s rows' % (spool.path, first_row, row_count))
+      spool.disable()
+      return db.fetch(handle, start_over=False, rows=rows)
+
+    while not spool.is_complete() and row_count < first_row + rows:
+      results = db.fetch(handle, start_over=row_count == 0, rows=max(rows, first_row + rows - row_count))
+      if results is None or not results.ready:
+        return results
+
+      data = list(results.rows())
+      if not spool.append(results.cols(), data, complete=not results.has_more or not data):
+        LOG.info('Result spool %s is over %s bytes, disabling it' % (spool.path, spool.max_size))
+        spooled = spool.read(first_row, rows)
+        spool.disable()
+        # Rows already fetched from the server can't be fetched again
+        return SpooledResult(spooled + data, results.cols(), first_row, results.has_more)
+      row_count += len(data)
+
+    data = spool.read(first_row, rows)
+    has_more = not spool.is_complete() or first_row + len(data) < row_count
+    return SpooledResult(data, spool.columns(), first_row, has_more)
+  finally:
+    lock.release()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Background execution of the queries made of several statements
+
+import logging
+import threading
+import time
+
+from django.db import connection, transaction
+
+from beeswax import query_timings
+from beeswax.models import QueryHistory
+
+
+LOG = logging.getLogger(__name__)
+
+MIN_INTERVAL = 0.5                      # Seconds between two checks of a statement which just started
+MAX_INTERVAL = 5.0                      # Seconds between two checks of a long statement
+COMMIT_TIMEOUT = 60                     # Maximum wait for the request which submitted the query to commit it
+
+
+def has_next_statement(query_history):
+  return query_history.design is not None and \
+      query_history.statement_number + 1 < query_history.design.get_design().statement_count
+
+
+class ScriptRunner(object):
+  """
+  Runs the statements of the queries one after the other, each one being submitted
+  as soon as the previous one finished, without waiting for the browser. The results of
+  the intermediate statements are dropped, only the ones of the last statement are kept.
+
+  The progress is in the QueryHistory: the current statement_number and its state.
+  Several threads or processes can run the same query, Dbms.execute_next_statement()
+  only lets one of them submit each statement.
+  """
+  def __init__(self, get_dbms=None, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+    self.get_dbms = get_dbms
+    self.min_interval = min_interval
+    self.max_interval = max_interval
+    self._threads = {}
+    self._lock = threading.Lock()
+
+  def start(self, query_id):
+    """Runs the rest of the query in a background thread, unless one already does"""
+    self._lock.acquire()
+    try:
+      thread = self._threads.get(query_id)
+      if thread is None or not thread.isAlive():
+        thread = threading.Thread(target=self._run, args=(query_id,), name='ScriptRunner-%s' % query_id)
+        thread.setDaemon(True)
+        self._threads[query_id] = thread
+        thread.start()
+      return thread
+    finally:
+      self._lock.release()
+
+  def _get_dbms(self, query_history):
+    if self.get_dbms is not None:
+      return self.get_dbms(query_history)
+    from beeswax.server import dbms
+    return dbms.get(query_history.owner, query_history.get_query_server_config())
+
+  def _run(self, query_id):
+    try:
+      try:
+        while self.run_step(query_id):
+          pass
+      except Exception, e:
+        LOG.exception('Failed to run the statements of query %s' % query_id)
+        try:
+          QueryHistory.objects.filter(id=query_id).update(last_state=QueryHistory.STATE.failed.index)
+        except Exception:
+          LOG.exception('Failed to save the state of query %s' % query_id)
+    finally:
+      # The thread ends, its database connection would stay open
+      connection.close()
+      self._lock.acquire()
+      try:
+        if self._threads.get(query_id) is threading.currentThread():
+          del self._threads[query_id]
+      finally:
+        self._lock.release()
+
+  def run_step(self, query_id):
+    """
+    Waits for the current statement of the query and submits the next one.
+    Returns False when there is nothing left to do.
+    """
+    interval = self.min_interval
+    start = time.time()
+
+    while True:
+      # Read what the other processes committed
+      transaction.commit_unless_managed()
+      try:
+        query_history = QueryHistory.get(id=query_id)
+      except QueryHistory.DoesNotExist:
+        # The runner can start before the end of the request which submitted the query
+        if time.time() - start > COMMIT_TIMEOUT:
+          raise
+        time.sleep(interval)
+        continue
+      if query_history.is_queued() or query_history.is_failure() or \
+          (not query_history.is_running() and not has_next_statement(query_history)):
+        return False
+
+      db = self._get_dbms(query_history)
+      handle = query_history.get_handle()
+      state = db.get_state(handle)
+      query_timings.record_state(query_history, state, has_next_statement(query_history) and QueryHistory.STATE.running or state)
+
+      if state in (QueryHistory.STATE.running, QueryHistory.STATE.submitted):
+        time.sleep(interval)
+        interval = min(interval * 1.5, self.max_interval)
+      elif state == QueryHistory.STATE.available and has_next_statement(query_history):
+        if query_history.has_results:
+          try:
+            db.close(handle)
+          except Exception, e:
+            LOG.warn('Failed to close statement %s of query %s: %s' % (query_history.statement_number, query_id, e))
+        LOG.debug('Query %s: statement %s finished' % (query_id, query_history.statement_number))
+        db.execute_next_statement(query_history)
+        return True
+      else:
+        db.invalidate_cache_for_finished(query_history, state)
+        query_history.save_state(state)
+        return False
+
+
+script_runner = ScriptRunner()
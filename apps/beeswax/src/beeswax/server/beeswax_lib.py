@@ -18,6 +18,7 @@
 import logging
 import re
 import thrift
+import time
 
 from django.utils.encoding import smart_str, force_unicode
 from django.utils.translation import ugettext as _
@@ -74,11 +75,14 @@ class BeeswaxTable(Table):
 
 
 class BeeswaxDataTable(DataTable):
-  def __init__(self, results):
+  def __init__(self, results, fetch_time=0):
     self.results = results
     self.has_more = results.has_more
     self.startRowOffset = results.start_row
     self.columns = results.columns
+    self.fetch_time = fetch_time
+    self.row_count = len(results.data)
+    self.byte_count = sum([len(row) + 1 for row in results.data])
 
   @property
   def ready(self):
@@ -139,12 +143,20 @@ class BeeswaxClient:
     return BeeswaxTable(table)
 
 
+  def get_columns(self, database, table_name):
+    # Contrary to get_fields(), includes the partition keys
+    return [field.name for field in self.meta_client.get_schema(database, table_name)]
+
+
   def query(self, query, statement=0):
     thrift_query = self.make_query(query, statement)
+    start = time.time()
     handle = self.db_client.query(thrift_query)
     # Fake has_result_set
     has_result_set = not BeeswaxClient.NO_RESULT_SET_RE.match(thrift_query.query) is not None
-    return BeeswaxQueryHandle(secret=handle.id, has_result_set=has_result_set, log_context=handle.log_context)
+    query_handle = BeeswaxQueryHandle(secret=handle.id, has_result_set=has_result_set, log_context=handle.log_context)
+    query_handle.submit_time = time.time() - start
+    return query_handle
 
 
   def fetch(self, handle, start_over=True, rows=-1):
@@ -152,13 +164,14 @@ class BeeswaxClient:
       rows = -1
 
     rpc_handle = handle.get_rpc_handle()
+    start = time.time()
     results = self.db_client.fetch(rpc_handle, start_over, rows)
 
     if results.ready:
       # Impala does not return the name of the columns, need to fetch separately
       if self.query_server['server_name'] == 'impala':
         results.columns = [column.name for column in self.get_results_metadata(handle).schema.fieldSchemas]
-      return BeeswaxDataTable(results)
+      return BeeswaxDataTable(results, time.time() - start)
 
 
   def cancel_operation(self, handle):
@@ -191,6 +204,21 @@ class BeeswaxClient:
     return self.meta_client.get_partitions(db_name, tbl_name, max_parts)
 
 
+  def get_partition_names(self, db_name, table, partition_spec=None, max_parts=None):
+    if max_parts is None:
+      max_parts = -1
+    if partition_spec:
+      # Empty values match any value
+      values = [partition_spec.get(key.name, '') for key in table.partition_keys]
+      return self.meta_client.get_partition_names_ps(db_name, table.name, values, max_parts)
+    else:
+      return self.meta_client.get_partition_names(db_name, table.name, max_parts)
+
+
+  def get_partition_by_name(self, db_name, table, partition_name):
+    return self.meta_client.get_partition_by_name(db_name, table.name, partition_name)
+
+
   def explain(self, statement):
     thrift_query = self.make_query(statement)
     return self.db_client.explain(thrift_query)
@@ -306,7 +334,8 @@ class BeeswaxClient:
                                     service_name=query_server['server_name'],
                                     kerberos_principal=kerberos_principal_short_name,
                                     use_sasl=use_sasl,
-                                    timeout_seconds=conf.BEESWAX_SERVER_CONN_TIMEOUT.get())
+                                    timeout_seconds=conf.BEESWAX_SERVER_CONN_TIMEOUT.get(),
+                                    pool_size=query_server.get('pool_size'))
     return UnicodeBeeswaxClient(client)
 
 
@@ -387,6 +416,10 @@ class BeeswaxClient:
         part = self._client.get_partition(*args, **kwargs)
         return self._decode_partition(part)
 
+      def get_partition_by_name(self, *args, **kwargs):
+        part = self._client.get_partition_by_name(*args, **kwargs)
+        return self._decode_partition(part)
+
       def get_partitions(self, *args, **kwargs):
         part_list = self._client.get_partitions(*args, **kwargs)
         for part in part_list:
@@ -15,10 +15,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import logging
+import Queue
+import re
 import thrift
+import threading
 import time
+import urllib
 
+from django.db import connection
 from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext as _
 
@@ -26,15 +32,33 @@ from beeswaxd.ttypes import BeeswaxException
 from desktop.conf import KERBEROS
 from filebrowser.views import location_to_url
 
-from beeswax import hive_site
+from beeswax import admission, hive_site, query_timings, result_cache, result_spool, script_runner
 from beeswax.conf import BEESWAX_SERVER_HOST, BEESWAX_SERVER_PORT,\
-  BROWSE_PARTITIONED_TABLE_LIMIT, SERVER_INTERFACE
+  BROWSE_PARTITIONED_TABLE_LIMIT, SERVER_INTERFACE, METADATA_CACHE_TTL, METADATA_CACHE_SIZE,\
+  MAX_CONCURRENT_QUERIES, MAX_CONCURRENT_QUERIES_PER_USER, SERVER_CONN_POOL_SIZE
 from beeswax.design import hql_query
 from beeswax.models import QueryHistory, HIVE_SERVER2
 
 
 LOG = logging.getLogger(__name__)
 
+SCHEMA_FETCH_THREADS = 5               # Concurrent calls reading the columns of a database
+PARTITION_PAGE_SIZE = 100               # Partitions of a page when browsing a table
+MAX_PARTITION_NAMES = 32767             # Largest max_parts of the metastore API, an i16
+
+# Statements which can change the metadata
+DDL_RE = re.compile(r'(?:^|;)\s*(?:CREATE|DROP|ALTER|LOAD|IMPORT|MSCK)\s', re.IGNORECASE | re.MULTILINE)
+# The database or table changed by a DDL statement
+DDL_TARGET_RE = re.compile(r"""(?:^|;)\s*(?:
+    (?:CREATE|DROP|ALTER)\s+(?:TEMPORARY\s+|EXTERNAL\s+)*(?P<kind>TABLE|VIEW|DATABASE|SCHEMA)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?
+  | LOAD\s+DATA\s+(?:LOCAL\s+)?INPATH\s+(?:'[^']*'|"[^"]*")\s+(?:OVERWRITE\s+)?INTO\s+TABLE\s+
+  | MSCK\s+REPAIR\s+TABLE\s+
+  | IMPORT\s+(?:EXTERNAL\s+)?TABLE\s+
+  )(?P<name>[`\w.]+)""", re.IGNORECASE | re.MULTILINE | re.VERBOSE)
+RENAME_RE = re.compile(r'\sRENAME\s+TO\s', re.IGNORECASE)
+# The tables written by an INSERT, which can follow a FROM clause
+INSERT_TARGET_RE = re.compile(r'\bINSERT\s+(?:OVERWRITE\s+TABLE\s+|INTO\s+(?:TABLE\s+)?)(?P<name>[`\w.]+)', re.IGNORECASE)
+
 
 def get(user, query_server=None):
   # Avoid circular dependency
@@ -53,7 +77,10 @@ def get(user, query_server=None):
 
 def get_query_server_config(name='beeswax'):
   if name == 'impala':
-    from impala.conf import SERVER_HOST, SERVER_PORT, IMPALA_PRINCIPAL, SERVER_INTERFACE as IMPALA_SERVER_INTERFACE
+    from impala.conf import SERVER_HOST, SERVER_PORT, IMPALA_PRINCIPAL, SERVER_INTERFACE as IMPALA_SERVER_INTERFACE,\
+                            SERVER_CONN_POOL_SIZE as IMPALA_SERVER_CONN_POOL_SIZE,\
+                            MAX_CONCURRENT_QUERIES as IMPALA_MAX_CONCURRENT_QUERIES,\
+                            MAX_CONCURRENT_QUERIES_PER_USER as IMPALA_MAX_CONCURRENT_QUERIES_PER_USER
     # Backward compatibility until Hue 3.0
     # If no interface specified and port is beeswax, switch port to HS2 default as we want to use HS2 from now on
     if IMPALA_SERVER_INTERFACE.get() == 'hiveserver2' and SERVER_PORT.get() == 21000:
@@ -66,6 +93,9 @@ def get_query_server_config(name='beeswax'):
         'server_port': port,
         'server_interface': IMPALA_SERVER_INTERFACE.get(),
         'principal': IMPALA_PRINCIPAL.get(),
+        'max_concurrent_queries': IMPALA_MAX_CONCURRENT_QUERIES.get(),
+        'max_concurrent_queries_per_user': IMPALA_MAX_CONCURRENT_QUERIES_PER_USER.get(),
+        'pool_size': IMPALA_SERVER_CONN_POOL_SIZE.get(),
     }
   else:
     if SERVER_INTERFACE.get() == 'hiveserver2':
@@ -79,7 +109,10 @@ def get_query_server_config(name='beeswax'):
         'server_host': BEESWAX_SERVER_HOST.get(),
         'server_port': BEESWAX_SERVER_PORT.get(),
         'server_interface': SERVER_INTERFACE.get(),
-        'principal': kerberos_principal
+        'principal': kerberos_principal,
+        'max_concurrent_queries': MAX_CONCURRENT_QUERIES.get(),
+        'max_concurrent_queries_per_user': MAX_CONCURRENT_QUERIES_PER_USER.get(),
+        'pool_size': SERVER_CONN_POOL_SIZE.get(),
     }
     LOG.debug("Query Server:\n\tName: %(server_name)s\n\tHost: %(server_host)s\n\tPort: %(server_port)s\n\tInterface: %(server_interface)s\n\tKerberos Principal: %(principal)s" % query_server)
 
@@ -96,27 +129,279 @@ class QueryServerException(Exception):
 class NoSuchObjectException: pass
 
 
+def is_ddl(hql):
+  return DDL_RE.search(hql) is not None
+
+
+def get_ddl_targets(hql, database=None):
+  """
+  get_ddl_targets(hql, database) -> list of (database, table name or None) or None
+
+  The databases and tables changed by the DDL statements or written by the INSERTs of the query,
+  the tables without database being in ``database``. None when they are not all known, e.g. for
+  CREATE FUNCTION or a table renamed.
+  """
+  statements = len(DDL_RE.findall(hql))
+  targets = []
+  for match in DDL_TARGET_RE.finditer(hql):
+    names = [name for name in match.group('name').replace('`', '').split('.') if name]
+    kind = (match.group('kind') or 'TABLE').upper()
+    if kind in ('DATABASE', 'SCHEMA') and len(names) == 1:
+      targets.append((names[0], None))
+    elif kind in ('TABLE', 'VIEW') and len(names) == 2:
+      targets.append((names[0], names[1]))
+    elif kind in ('TABLE', 'VIEW') and len(names) == 1 and database:
+      targets.append((database, names[0]))
+    else:
+      return None
+
+  if len(targets) != statements or RENAME_RE.search(hql):
+    return None
+
+  for match in INSERT_TARGET_RE.finditer(hql):
+    names = [name for name in match.group('name').replace('`', '').split('.') if name]
+    if len(names) == 2:
+      targets.append((names[0], names[1]))
+    elif len(names) == 1 and database:
+      targets.append((database, names[0]))
+    else:
+      return None
+  return targets
+
+
+def parse_partition_name(partition_name):
+  """'year=2013/month=01' -> [('year', '2013'), ('month', '01')], with the values unescaped"""
+  spec = []
+  for part in partition_name.split('/'):
+    key, value = part.split('=', 1)
+    spec.append((urllib.unquote(key), urllib.unquote(value)))
+  return spec
+
+
+def quote_partition_spec(spec, separator=', '):
+  """[('year', '2013'), ('month', '01')] -> `year`='2013', `month`='01'"""
+  return separator.join(["`%s`='%s'" % (key, value.replace('\\', '\\\\').replace("'", "\\'")) for key, value in spec])
+
+
+class MetadataCache(object):
+  """
+  Databases, table names and tables read from the query servers.
+
+  Keys are (server, user name, database, kind, name), with kind one of 'databases', 'tables',
+  'table' or 'schema': the users can be authorized to see different objects. Entries expire
+  after ``ttl`` seconds, and the least recently used ones are evicted when there are more
+  than ``size``.
+  """
+  def __init__(self, ttl=None, size=None):
+    self._ttl = ttl
+    self._size = size
+    self._entries = {}                  # key -> [time stored, last use, value]
+    self._lock = threading.Lock()
+    self._uses = 0
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def ttl(self):
+    if self._ttl is None:
+      return METADATA_CACHE_TTL.get()
+    return self._ttl
+
+  @property
+  def size(self):
+    if self._size is None:
+      return METADATA_CACHE_SIZE.get()
+    return self._size
+
+  def get(self, key):
+    """get(key) -> (found, value)"""
+    self._lock.acquire()
+    try:
+      entry = self._entries.get(key)
+      if entry is not None and time.time() - entry[0] < self.ttl:
+        self._uses += 1
+        entry[1] = self._uses
+        self.hits += 1
+        return True, entry[2]
+      self.misses += 1
+      return False, None
+    finally:
+      self._lock.release()
+
+  def put(self, key, value):
+    if self.ttl <= 0:
+      return
+
+    self._lock.acquire()
+    try:
+      self._uses += 1
+      self._entries[key] = [time.time(), self._uses, value]
+      if len(self._entries) > self.size:
+        # Evict a tenth at once to not sort on every insert
+        by_use = [(entry[1], key) for key, entry in self._entries.iteritems()]
+        by_use.sort()
+        for last_use, old_key in by_use[:len(by_use) - self.size * 9 / 10]:
+          del self._entries[old_key]
+    finally:
+      self._lock.release()
+
+  def invalidate(self, server, database=None, table=None):
+    """
+    Forgets everything about the server, or a database (and the list of databases),
+    or a table (and the lists of tables of its database), for all the users.
+    """
+    self._lock.acquire()
+    try:
+      for key in self._entries.keys():
+        key_server, key_user, key_database, kind, name = key
+        if key_server != server:
+          continue
+        if database is None or \
+            (table is None and key_database in (database, None)) or \
+            (key_database == database and (kind in ('tables', 'schema') or name == table)):
+          del self._entries[key]
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._entries.clear()
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+metadata_cache = MetadataCache()
+
+
 class Dbms:
   """SQL"""
 
   def __init__(self, client, server_type):
     self.client = client
     self.server_type = server_type
+    self.fetch_stats = query_timings.FetchStats()
+
+
+  def _get_server_key(self):
+    query_server = self.client.query_server
+    return (query_server['server_name'], query_server['server_host'], query_server['server_port'])
+
+
+  def _get_cache_key(self, database, kind, name):
+    return (self._get_server_key(), self.client.user.username, database, kind, name)
 
 
-  def get_table(self, database, table_name):
-    # DB name not supported in SHOW PARTITIONS required in Table
-    self.use(database)
+  def invalidate_cache(self, database=None, table=None):
+    """Next reads of the metadata of the server, database or table go to the server"""
+    metadata_cache.invalidate(self._get_server_key(), database, table)
 
-    return self.client.get_table(database, table_name)
+
+  def invalidate_cache_for(self, hql, database=None):
+    """Forgets the databases and tables changed by the query, or the whole server when they are not known"""
+    if not is_ddl(hql) and not INSERT_TARGET_RE.search(hql):
+      return
+
+    targets = get_ddl_targets(hql, database)
+    if targets is None:
+      self.invalidate_cache()
+    else:
+      for target_database, table in targets:
+        self.invalidate_cache(target_database, table)
+
+
+  def get_table(self, database, table_name, use_cache=True):
+    key = self._get_cache_key(database, 'table', table_name)
+    found, table = use_cache and metadata_cache.get(key) or (False, None)
+    if not found:
+      # DB name not supported in SHOW PARTITIONS required in Table
+      self.use(database)
+
+      table = self.client.get_table(database, table_name)
+      metadata_cache.put(key, table)
+    return table
 
 
   def get_tables(self, database='default', table_names='.*'):
-    return self.client.get_tables(database, table_names)
+    key = self._get_cache_key(database, 'tables', table_names)
+    found, tables = metadata_cache.get(key)
+    if not found:
+      tables = self.client.get_tables(database, table_names)
+      metadata_cache.put(key, tables)
+    return tables
+
+
+  def get_schema(self, database):
+    """
+    get_schema(database) -> DatabaseSchema
+
+    Names of the columns of all the tables of the database, read with concurrent calls.
+    A schema missing the tables whose columns could not be read is not cached.
+    """
+    key = self._get_cache_key(database, 'schema', None)
+    found, schema = metadata_cache.get(key)
+    if not found:
+      table_names = self.get_tables(database)
+      schema = DatabaseSchema(self._get_columns(database, table_names))
+      if len(schema.table_names) == len(table_names):
+        metadata_cache.put(key, schema)
+    return schema
+
+
+  def _get_columns(self, database, table_names):
+    """
+    Columns of each table, the tables being split across SCHEMA_FETCH_THREADS threads.
+    The tables whose columns can't be read are left out.
+    """
+    columns = {}
+    if not table_names:
+      return columns
+
+    def get_columns(table_name):
+      try:
+        columns[table_name] = self.client.get_columns(database, table_name)
+      except Exception, e:
+        LOG.warn('Could not read the columns of %s.%s: %s' % (database, table_name, e))
+
+    # The first call opens the session if needed, instead of each thread opening one
+    get_columns(table_names[0])
+
+    queue = Queue.Queue()
+    for table_name in table_names[1:]:
+      queue.put(table_name)
+
+    def fetch():
+      try:
+        while True:
+          try:
+            table_name = queue.get_nowait()
+          except Queue.Empty:
+            return
+          get_columns(table_name)
+      finally:
+        # The HS2 session is read through the ORM
+        connection.close()
+
+    threads = [threading.Thread(target=fetch, name='GetColumns') for i in range(min(SCHEMA_FETCH_THREADS, queue.qsize()))]
+    for thread in threads:
+      thread.setDaemon(True)
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    return columns
 
 
   def get_databases(self):
-    return self.client.get_databases()
+    key = self._get_cache_key(None, 'databases', None)
+    found, databases = metadata_cache.get(key)
+    if not found:
+      databases = self.client.get_databases()
+      metadata_cache.put(key, databases)
+    return databases
 
 
   def execute_query(self, query, design):
@@ -140,7 +425,10 @@ class Dbms:
     if no_start_over_support:
       start_over = False
 
-    return self.client.fetch(query_handle, start_over, rows)
+    results = self.client.fetch(query_handle, start_over, rows)
+    if results is not None:
+      self.fetch_stats.add(results)
+    return results
 
 
   def cancel_operation(self, query_handle):
@@ -236,6 +524,16 @@ class Dbms:
     return self.client.get_state(handle)
 
 
+  def invalidate_cache_for_finished(self, query_history, state):
+    """
+    Forgets the metadata changed by the DDL of the query when it goes from submitted or
+    running to ``state``, a final state: it could have been read and cached meanwhile.
+    """
+    if query_history.is_running() and state not in (QueryHistory.STATE.running, QueryHistory.STATE.submitted):
+      database = query_history.design is not None and query_history.design.get_design().query.get('database') or None
+      self.invalidate_cache_for(query_history.query, database)
+
+
   def execute_and_wait(self, query, timeout_sec=30.0):
     """
     Run query and check status until it finishes or timeouts.
@@ -256,9 +554,18 @@ class Dbms:
 
 
   def execute_next_statement(self, query_history):
-    query_history.statement_number += 1
+    """
+    Submits the statement after the current one, unless another thread or process
+    already moved to it. Returns None in that case.
+    """
+    next_statement = query_history.statement_number + 1
+    moved = QueryHistory.objects.filter(id=query_history.id, statement_number=query_history.statement_number)\
+                                .update(statement_number=next_statement, last_state=QueryHistory.STATE.submitted.index)
+    if not moved:
+      return None
+
+    query_history.statement_number = next_statement
     query_history.last_state = QueryHistory.STATE.submitted.index
-    query_history.save()
     query = query_history.design.get_design()
     return self.execute_and_watch(query, query_history=query_history)
 
@@ -266,9 +573,19 @@ class Dbms:
   def execute_and_watch(self, query, design=None, query_history=None):
     """
     Run query and return a QueryHistory object in order to see its progress on a Web page.
+
+    The metadata cached for the tables changed by the DDL of the query is forgotten, which
+    covers drop_table(), drop_database(), load_data() and the table creations. It is
+    forgotten again when the query finishes (see invalidate_cache_for_finished()).
+
+    A query found in the result cache is not sent to the server, its results are copied
+    from the cache and it is directly available. A new query waits in the admission queue
+    when its user or the server run too many queries, it is then submitted by submit_queued().
     """
     hql_query = query.hql_query
+    self.invalidate_cache_for(hql_query, query.query.get('database'))
     if query_history is None:
+      cache_key = result_cache.get_key(self, query)
       query_history = QueryHistory.build(
           owner=self.client.user,
           query=hql_query,
@@ -280,12 +597,48 @@ class Dbms:
           design=design,
           notify=query.query.get('email_notify', False),
           query_type=query.query['type'],
-          statement_number=0
+          statement_number=0,
+          cache_key=cache_key
       )
       query_history.save()
 
       LOG.debug("Made new QueryHistory id %s user %s query: %s..." % (query_history.id, self.client.user, query_history.query[:25]))
 
+      if cache_key is not None and self._get_cached_results(query_history):
+        return query_history
+
+      if admission.admission_queue.admit(query_history, self.client.query_server):
+        LOG.debug("Queued QueryHistory id %s user %s" % (query_history.id, self.client.user))
+        return query_history
+
+      try:
+        return self._submit(query, query_history)
+      finally:
+        admission.admission_queue.started(query_history.id)
+
+    return self._submit(query, query_history)
+
+
+  def submit_queued(self, query_history):
+    """
+    Submits the queued query if it is its turn. Returns False while it waits.
+    """
+    if admission.admission_queue.admit(query_history, self.client.query_server):
+      return False
+
+    try:
+      if query_history.design is not None:
+        query = query_history.design.get_design()
+      else:
+        query = hql_query(query_history.query)
+      self._submit(query, query_history, queued=time.time() - time.mktime(query_history.submission_date.timetuple()))
+    finally:
+      admission.admission_queue.started(query_history.id)
+    return True
+
+
+  def _submit(self, query, query_history, queued=None):
+    start = time.time()
     try:
       handle = self.client.query(query, query_history.statement_number)
       if not handle.is_valid():
@@ -309,13 +662,45 @@ class Dbms:
     query_history.log_context = handle.log_context
     query_history.query_type = query.query['type']
     query_history.set_to_running()
+    query_timings.record_submit(query_history, handle, start, queued)
     query_history.save()
 
     LOG.debug("Updated QueryHistory id %s user %s statement_number: %s" % (query_history.id, self.client.user, query_history.statement_number))
 
+    if query_history.statement_number == 0 and query_history.design is not None and query.statement_count > 1:
+      script_runner.script_runner.start(query_history.id)
+
     return query_history
 
 
+  def _get_cached_results(self, query_history):
+    """Makes the query available with the results from the result cache, if they are there"""
+    cached = result_cache.result_cache.get(query_history.cache_key)
+    if cached is None:
+      return False
+
+    query, spool = cached
+    try:
+      result_cache.result_cache.copy_to(spool, result_spool.get(query_history))
+    except (IOError, OSError), e:
+      # Expired in the meantime
+      LOG.warn('Could not copy the cached results of query %s: %s' % (query['id'], e))
+      return False
+
+    query_history.server_id = query['server_id']
+    query_history.server_guid = query['server_guid']
+    query_history.operation_type = query['operation_type']
+    query_history.has_results = query['has_results']
+    query_history.modified_row_count = query['modified_row_count']
+    query_history.log_context = query['log_context']
+    query_history.cache_hit = True
+    query_history.set_to_available()
+    query_history.save()
+
+    LOG.debug("Served QueryHistory id %s from the results of query %s" % (query_history.id, query['id']))
+    return True
+
+
   def get_results_metadata(self, handle):
     return self.client.get_results_metadata(handle)
 
@@ -333,18 +718,50 @@ class Dbms:
 
     return self.client.get_partitions(db_name, table.name, max_parts)
 
-  def get_partition(self, db_name, table_name, partition_id):
-    table = self.get_table(db_name, table_name)
-    partitions = self.get_partitions(db_name, table, max_parts=None)
+  def get_partition_names(self, db_name, table, partition_spec=None, max_parts=None):
+    """
+    Sorted names of the partitions of the table, e.g. 'year=2013/month=01', all of them
+    without ``max_parts``. Only the partitions matching the ``partition_spec``
+    {key: value} when given, the filtering is done by the server.
+    """
+    if max_parts is not None and max_parts > MAX_PARTITION_NAMES:
+      max_parts = None
+
+    # DB name not supported in SHOW PARTITIONS
+    self.use(db_name)
+
+    names = self.client.get_partition_names(db_name, table, partition_spec, max_parts)
+    names.sort()
+    return names
 
-    partition_query = ""
-    for idx, key in enumerate(partitions[partition_id].values):
-      partition_query += (idx > 0 and " AND " or "") + table.partition_keys[idx].name + "=" + key
+  def get_partitions_page(self, db_name, table, partition_spec=None, first=0, count=PARTITION_PAGE_SIZE, reverse=False):
+    """
+    get_partitions_page(db_name, table, partition_spec, first, count, reverse) -> ([(name, partition)], has more)
+
+    The partitions sorted by name from ``first``, in descending order when ``reverse``.
+    Only the partitions of the page are read, and in ascending order only the names
+    before them. The servers do not return the names in descending order.
+    """
+    if reverse:
+      names = self.get_partition_names(db_name, table, partition_spec)
+      names.reverse()
+    else:
+      names = self.get_partition_names(db_name, table, partition_spec, max_parts=first + count + 1)
 
-    hql = "SELECT * FROM `%s.%s` WHERE %s" % (db_name, table_name, partition_query)
+    partitions = [(name, self.client.get_partition_by_name(db_name, table, name)) for name in names[first:first + count]]
+    return partitions, len(names) > first + count
 
+  def read_partition(self, db_name, table, partition_name):
+    """Query reading the partition of the table"""
+    hql = "SELECT * FROM `%s.%s` WHERE %s" % (db_name, table.name, quote_partition_spec(parse_partition_name(partition_name), ' AND '))
     return self.execute_statement(hql)
 
+  def get_partition(self, db_name, table_name, partition_id):
+    """Query reading the partition at the ``partition_id`` position in the sorted partitions"""
+    table = self.get_table(db_name, table_name)
+    names = self.get_partition_names(db_name, table, max_parts=partition_id + 1)
+    return self.read_partition(db_name, table, names[partition_id])
+
 
   def explain(self, statement):
     return self.client.explain(statement)
@@ -380,13 +797,36 @@ class Table:
     return location_to_url(self.path_location)
 
 
+class DatabaseSchema(object):
+  """
+  Columns of the tables of a database, with the table names sorted for the lookups by prefix.
+  """
+  def __init__(self, columns):
+    self.columns = columns
+    self.table_names = sorted(columns.keys())
+
+  def get_table_names(self, prefix=''):
+    names = []
+    for name in self.table_names[bisect.bisect_left(self.table_names, prefix):]:
+      if not name.startswith(prefix):
+        break
+      names.append(name)
+    return names
+
+  def get_columns(self, prefix=''):
+    """get_columns(prefix) -> {table name: list of column names} of the tables starting with prefix"""
+    return dict([(name, self.columns[name]) for name in self.get_table_names(prefix)])
+
+
 class DataTable:
   """
   Represents the data of a Hive Table.
 
   If the dataset has more rows, a new fetch should be done in order to return a new data table with the next rows.
   """
-  pass
+  fetch_time = 0                        # Seconds taken by the fetch call
+  row_count = 0
+  byte_count = 0                        # Size of the fetched rows
 
 
 # TODO decorator?
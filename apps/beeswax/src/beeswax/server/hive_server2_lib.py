@@ -15,9 +15,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import logging
+import marshal
+import operator
 import re
 import thrift
+import threading
+import time
+import urllib
+
+from collections import deque
+from itertools import izip
 
 from desktop.lib import thrift_util
 
@@ -25,17 +34,22 @@ from TCLIService import TCLIService
 from TCLIService.ttypes import TOpenSessionReq, TGetTablesReq, TFetchResultsReq,\
   TStatusCode, TGetResultSetMetadataReq, TGetColumnsReq, TType,\
   TExecuteStatementReq, TGetOperationStatusReq, TFetchOrientation,\
-  TCloseSessionReq, TGetSchemasReq, TGetLogReq, TCancelOperationReq
+  TCloseSessionReq, TGetSchemasReq, TGetLogReq, TCancelOperationReq, TTypeId,\
+  TCloseOperationReq
 
 from beeswax import conf
 from beeswax.models import Session, HiveServerQueryHandle, HiveServerQueryHistory
 from beeswax.server.dbms import Table, NoSuchObjectException, DataTable,\
-  QueryServerException
+  QueryServerException, quote_partition_spec
 from beeswax.server.beeswax_lib import BeeswaxClient
 
 
 LOG = logging.getLogger(__name__)
 
+RESULT_SET_SCHEMA_CACHE_SIZE = 1000
+PARTITION_FETCH_ROWS = 1000             # Partition names read by each fetch
+MAX_COLUMNS = 10000                     # Columns read by GetColumns
+
 
 class HiveServerTable(Table):
   """
@@ -112,6 +126,7 @@ class HiveServerTRowSet:
     self.rows = row_set.rows
     self.schema = schema
     self.startRowOffset = row_set.startRowOffset
+    self._position = 0
 
   def is_empty(self):
     return len(self.rows) == 0
@@ -130,19 +145,87 @@ class HiveServerTRowSet:
     return self
 
   def next(self):
-    if self.rows:
-      return HiveServerTRow(self.rows.pop(0), self.schema)
+    if self._position < len(self.rows):
+      row = self.rows[self._position]
+      self._position += 1
+      return HiveServerTRow(row, self.schema)
     else:
       raise StopIteration
 
 
+class HiveServerTRowSetDecoder:
+  """
+  Converts a whole TRowSet into Python values in a single pass.
+
+  The TColumnValue field holding the data of each column is looked up once from the
+  result set schema, instead of probing all the optional fields of every cell.
+  """
+  VALUE_FIELDS = {
+    TTypeId.BOOLEAN_TYPE: 'boolVal',
+    TTypeId.TINYINT_TYPE: 'byteVal',
+    TTypeId.SMALLINT_TYPE: 'i16Val',
+    TTypeId.INT_TYPE: 'i32Val',
+    TTypeId.BIGINT_TYPE: 'i64Val',
+    TTypeId.FLOAT_TYPE: 'doubleVal',
+    TTypeId.DOUBLE_TYPE: 'doubleVal',
+  }
+
+  def __init__(self, schema):
+    self.extractors = [self._get_extractor(column) for column in schema.columns]
+
+  @classmethod
+  def _get_extractor(cls, column):
+    field = 'stringVal'
+    if column.typeDesc.types:
+      primitive = column.typeDesc.types[0].primitiveEntry
+      if primitive is not None:
+        field = cls.VALUE_FIELDS.get(primitive.type, 'stringVal')
+    get_value = operator.attrgetter(field)
+
+    def extract(column_value):
+      value = get_value(column_value)
+      if value is None:
+        # The server did not use the field matching the declared type
+        return HiveServerTColumnValue(column_value).val
+      return value.value
+
+    return extract
+
+  def to_rows(self, row_set):
+    """List of rows, each row being a list of values"""
+    extractors = self.extractors
+    return [[extract(value) for extract, value in izip(extractors, row.colVals)] for row in row_set.rows]
+
+  def to_columns(self, row_set):
+    """List of columns, each column being the list of its values"""
+    rows = row_set.rows
+    return [[extract(row.colVals[position]) for row in rows] for position, extract in enumerate(self.extractors)]
+
+
 
 class HiveServerDataTable(DataTable):
-  def __init__(self, results, schema):
+  SAMPLE_ROWS = 100                     # Rows decoded for estimating the size of the rows
+
+  def __init__(self, results, schema, fetch_time=0):
     self.schema = schema and schema.schema
     self.row_set = HiveServerTRowSet(results.results, schema)
     self.has_more = not self.row_set.is_empty()    # Should be results.hasMoreRows but always True in HS2
     self.startRowOffset = self.row_set.startRowOffset    # Always 0 in HS2
+    self.fetch_time = fetch_time
+    self.row_count = len(self.row_set.rows)
+    self.byte_count = self._estimate_size()
+
+  def _estimate_size(self):
+    """Size of the values of the rows, extrapolated from the first ones"""
+    if self.schema is None or not self.row_count:
+      return 0
+    sample = self.row_set.rows[:self.SAMPLE_ROWS]
+    decoder = HiveServerTRowSetDecoder(self.schema)
+    try:
+      size = len(marshal.dumps([[extract(value) for extract, value in izip(decoder.extractors, row.colVals)] for row in sample]))
+    except ValueError:
+      return 0 # Not a marshallable type
+    return size * self.row_count / len(sample)
 
   @property
   def ready(self):
@@ -155,8 +238,11 @@ class HiveServerDataTable(DataTable):
       return []
 
   def rows(self):
-    for row in self.row_set:
-      yield row.fields()
+    if self.schema is not None:
+      decoder = HiveServerTRowSetDecoder(self.schema)
+      return iter(decoder.to_rows(self.row_set.row_set))
+    else:
+      return (row.fields() for row in self.row_set)
 
 
 
@@ -248,6 +334,121 @@ class HiveServerTColumnDesc:
         return ttype.userDefinedTypeEntry
 
 
+class ResultSetSchemaCache(object):
+  """
+  Bounded cache of GetResultSetMetadata responses, keyed by operation handle guid.
+
+  The schema of an operation never changes, so it only needs to be fetched once.
+  Only the user queries fetched page by page are cached. The least recently used
+  entries are evicted first when the cache is full.
+  """
+  def __init__(self, size=RESULT_SET_SCHEMA_CACHE_SIZE):
+    self.size = size
+    self._schemas = {}
+    self._guids = deque()               # Least recently used first
+    self._lock = threading.Lock()
+
+  def get(self, operation_handle):
+    guid = operation_handle.operationId.guid
+    self._lock.acquire()
+    try:
+      schema = self._schemas.get(guid)
+      if schema is not None and self._guids[-1] != guid:
+        self._guids.remove(guid)
+        self._guids.append(guid)
+      return schema
+    finally:
+      self._lock.release()
+
+  def put(self, operation_handle, schema):
+    guid = operation_handle.operationId.guid
+    self._lock.acquire()
+    try:
+      if guid not in self._schemas:
+        self._guids.append(guid)
+        while len(self._guids) > self.size:
+          self._schemas.pop(self._guids.popleft(), None)
+      self._schemas[guid] = schema
+    finally:
+      self._lock.release()
+
+  def evict(self, operation_handle):
+    self._lock.acquire()
+    try:
+      guid = operation_handle.operationId.guid
+      if self._schemas.pop(guid, None) is not None:
+        self._guids.remove(guid)
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._schemas)
+
+
+_result_set_schema_cache = ResultSetSchemaCache()
+
+
+class SessionRegistry(object):
+  """
+  Process-local registry of the HS2 session of each (user, server name).
+
+  Avoids querying the Session table before every RPC: the DB is only read on a miss.
+  The last_used date of the sessions is written back in batches, at most every
+  FLUSH_INTERVAL seconds.
+  """
+  FLUSH_INTERVAL = 60
+
+  def __init__(self):
+    self._sessions = {}            # (user id, server name) -> (session id, TSessionHandle)
+    self._used_session_ids = set()
+    self._last_flush = time.time()
+    self._lock = threading.Lock()
+
+  def get(self, user, application):
+    """Returns the TSessionHandle of the latest session or None"""
+    entry = self._sessions.get((user.id, application))
+
+    if entry is None:
+      session = Session.objects.get_session(user, application)
+      if session is None:
+        return None
+      entry = self.put(user, application, session)
+
+    session_id, handle = entry
+    self._touch(session_id)
+    return handle
+
+  def put(self, user, application, session):
+    entry = (session.id, session.get_handle())
+    self._sessions[(user.id, application)] = entry
+    return entry
+
+  def evict(self, user, application):
+    self._sessions.pop((user.id, application), None)
+
+  def _touch(self, session_id):
+    self._lock.acquire()
+    try:
+      self._used_session_ids.add(session_id)
+      if time.time() - self._last_flush < self.FLUSH_INTERVAL:
+        return
+      session_ids, self._used_session_ids = self._used_session_ids, set()
+      self._last_flush = time.time()
+    finally:
+      self._lock.release()
+
+    self.flush(session_ids)
+
+  def flush(self, session_ids):
+    try:
+      Session.objects.filter(id__in=list(session_ids)).update(last_used=datetime.datetime.now())
+    except Exception, e:
+      LOG.warn('Could not update the last use of sessions %s: %s' % (session_ids, e))
+
+
+_session_registry = SessionRegistry()
+
+
 class HiveServerClient:
 
   def __init__(self, query_server, user):
@@ -262,7 +463,8 @@ class HiveServerClient:
                                           service_name=query_server['server_name'],
                                           kerberos_principal=kerberos_principal_short_name,
                                           use_sasl=use_sasl,
-                                          timeout_seconds=conf.BEESWAX_SERVER_CONN_TIMEOUT.get())
+                                          timeout_seconds=conf.BEESWAX_SERVER_CONN_TIMEOUT.get(),
+                                          pool_size=query_server.get('pool_size'))
 
 
   def open_session(self, user):
@@ -274,22 +476,25 @@ class HiveServerClient:
 
     encoded_status, encoded_guid = HiveServerQueryHandle(secret=sessionId.secret, guid=sessionId.guid).get()
 
-    return Session.objects.create(owner=user,
-                                  application=self.query_server['server_name'],
-                                  status_code=res.status.statusCode,
-                                  secret=encoded_status,
-                                  guid=encoded_guid,
-                                  server_protocol_version=res.serverProtocolVersion)
+    session = Session.objects.create(owner=user,
+                                     application=self.query_server['server_name'],
+                                     status_code=res.status.statusCode,
+                                     secret=encoded_status,
+                                     guid=encoded_guid,
+                                     server_protocol_version=res.serverProtocolVersion)
+    _session_registry.put(user, self.query_server['server_name'], session)
+
+    return session
 
 
   def call(self, fn, req, status=TStatusCode.SUCCESS_STATUS):
-    session = Session.objects.get_session(self.user, self.query_server['server_name'])
+    session_handle = _session_registry.get(self.user, self.query_server['server_name'])
 
-    if session is None:
-      session = self.open_session(self.user)
+    if session_handle is None:
+      session_handle = self.open_session(self.user).get_handle()
 
     if hasattr(req, 'sessionHandle') and req.sessionHandle is None:
-      req.sessionHandle = session.get_handle()
+      req.sessionHandle = session_handle
 
     res = fn(req)
 
@@ -298,8 +503,12 @@ class HiveServerClient:
         re.search('Invalid SessionHandle|Invalid session', res.status.errorMessage or '', re.I):
       LOG.info('Retrying with a new session because of %s' % res)
 
-      session = self.open_session(self.user)
-      req.sessionHandle = session.get_handle()
+      # Another process might have already opened a new session
+      _session_registry.evict(self.user, self.query_server['server_name'])
+      session_handle = _session_registry.get(self.user, self.query_server['server_name'])
+      if session_handle is None or session_handle == req.sessionHandle:
+        session_handle = self.open_session(self.user).get_handle()
+      req.sessionHandle = session_handle
 
       # Get back the name of the function to call
       res = getattr(self._client, fn.attr)(req)
@@ -312,7 +521,8 @@ class HiveServerClient:
 
 
   def close_session(self):
-    session = Session.objects.get_session(self.user, self.query_server['server_name']).get_handle()
+    session = _session_registry.get(self.user, self.query_server['server_name'])
+    _session_registry.evict(self.user, self.query_server['server_name'])
 
     req = TCloseSessionReq(sessionHandle=session)
     return self._client.CloseSession(req)
@@ -370,6 +580,8 @@ class HiveServerClient:
 
 
   def execute_async_query(self, query, statement=0):
+    start = time.time()
+
     # Set configuration manually until Hive Server 2 supports confOverlay
     # This will leak the config in the session
     if statement == 0:
@@ -385,7 +597,9 @@ class HiveServerClient:
     confOverlay.update(dict([(setting['key'], setting['value']) for setting in query.settings]))
 
     query_statement =  query.get_query_statement(statement)
-    return self.execute_async_statement(statement=query_statement, confOverlay=confOverlay)
+    handle = self.execute_async_statement(statement=query_statement, confOverlay=confOverlay)
+    handle.submit_time = time.time() - start
+    return handle
 
 
   def execute_statement(self, statement, max_rows=100):
@@ -409,35 +623,67 @@ class HiveServerClient:
 
   def fetch_data(self, operation_handle, orientation=TFetchOrientation.FETCH_NEXT, max_rows=100):
     # The client should check for hasMoreRows and fetch until the result is empty dues to a HS2 bug
-    results, schema = self.fetch_result(operation_handle, orientation, max_rows)
-    return HiveServerDataTable(results, schema)
+    start = time.time()
+    results, schema = self.fetch_result(operation_handle, orientation, max_rows, cache_schema=True)
+    return HiveServerDataTable(results, schema, time.time() - start)
 
 
   def cancel_operation(self, operation_handle):
+    _result_set_schema_cache.evict(operation_handle)
     req = TCancelOperationReq(operationHandle=operation_handle)
     return self.call(self._client.CancelOperation, req)
 
 
-  def get_columns(self, database, table):
+  def close_operation(self, operation_handle):
+    _result_set_schema_cache.evict(operation_handle)
+    req = TCloseOperationReq(operationHandle=operation_handle)
+    return self.call(self._client.CloseOperation, req)
+
+
+  def get_columns(self, database, table, max_rows=100):
     req = TGetColumnsReq(schemaName=database, tableName=table)
     res = self.call(self._client.GetColumns, req)
 
-    return self.fetch_result(res.operationHandle)
+    try:
+      return self.fetch_result(res.operationHandle, max_rows=max_rows)
+    finally:
+      try:
+        self.close_operation(res.operationHandle)
+      except Exception, e:
+        LOG.warn('Failed to close the GetColumns operation of %s.%s: %s' % (database, table, e))
 
 
-  def fetch_result(self, operation_handle, orientation=TFetchOrientation.FETCH_NEXT, max_rows=100):
+  def fetch_result(self, operation_handle, orientation=TFetchOrientation.FETCH_NEXT, max_rows=100, cache_schema=False):
     fetch_req = TFetchResultsReq(operationHandle=operation_handle, orientation=orientation, maxRows=max_rows)
     res = self.call(self._client.FetchResults, fetch_req)
 
     if operation_handle.hasResultSet:
-      meta_req = TGetResultSetMetadataReq(operationHandle=operation_handle)
-      schema = self.call(self._client.GetResultSetMetadata, meta_req)
+      schema = self.get_result_set_metadata(operation_handle, cache_schema)
     else:
       schema = None
 
     return res, schema
 
 
+  def get_result_set_metadata(self, operation_handle, cache_schema=False):
+    """
+    The schemas of the one-shot operations (metadata calls, blocking statements) are not
+    cached as they would evict the ones of the queries paged through fetch_data().
+    """
+    if cache_schema:
+      schema = _result_set_schema_cache.get(operation_handle)
+    else:
+      schema = None
+
+    if schema is None:
+      meta_req = TGetResultSetMetadataReq(operationHandle=operation_handle)
+      schema = self.call(self._client.GetResultSetMetadata, meta_req)
+      if cache_schema:
+        _result_set_schema_cache.put(operation_handle, schema)
+
+    return schema
+
+
   def get_operation_status(self, operation_handle):
     req = TGetOperationStatusReq(operationHandle=operation_handle)
     return self.call(self._client.GetOperationStatus, req)
@@ -465,6 +711,31 @@ class HiveServerClient:
     return [PartitionValueCompatible(partition, table) for partition in partitionTable.rows()][-max_parts:]
 
 
+  def get_partition_names(self, database, table, partition_spec=None, max_parts=None):
+    """The names are read until ``max_parts`` of them, the whole list is not fetched"""
+    if self.query_server['server_name'] == 'beeswax':
+      self.execute_statement(statement='SET hive.server2.blocking.query=true')
+
+    statement = 'SHOW PARTITIONS `%s`' % table.name # DB prefix not supported
+    if partition_spec:
+      statement += ' PARTITION (%s)' % quote_partition_spec(partition_spec.items())
+    req = TExecuteStatementReq(statement=statement, confOverlay={})
+    res = self.call(self._client.ExecuteStatement, req)
+
+    names = []
+    try:
+      while max_parts is None or len(names) < max_parts:
+        results, schema = self.fetch_result(res.operationHandle, max_rows=PARTITION_FETCH_ROWS)
+        fetched = [row[0] for row in HiveServerDataTable(results, schema).rows()]
+        if not fetched:
+          break
+        names.extend(fetched)
+    finally:
+      self.close_operation(res.operationHandle)
+
+    return names[:max_parts]
+
+
 class HiveServerTableCompatible(HiveServerTable):
   """Same API as Beeswax"""
 
@@ -489,6 +760,9 @@ class ResultCompatible:
     self.has_more = data_table.has_more
     self.start_row = data_table.startRowOffset
     self.ready = True
+    self.fetch_time = data_table.fetch_time
+    self.row_count = data_table.row_count
+    self.byte_count = data_table.byte_count
 
   @property
   def columns(self):
@@ -512,7 +786,7 @@ class PartitionValueCompatible:
 
   def __init__(self, partition, table):
     # Parses: ['datehour=2013022516']
-    self.values = [part.split('=')[1] for part in partition]
+    self.values = [urllib.unquote(part.split('=', 1)[1]) for part in partition]
     self.sd = type('Sd', (object,), {'location': '%s/%s' % (table.path_location, ','.join(partition)),})
 
 
@@ -571,6 +845,11 @@ class HiveServerClientCompatible:
     return self._client.cancel_operation(operationHandle)
 
 
+  def close(self, handle):
+    operationHandle = handle.get_rpc_handle()
+    return self._client.close_operation(operationHandle)
+
+
   def dump_config(self):
     return 'Does not exist in HS2'
 
@@ -601,6 +880,11 @@ class HiveServerClientCompatible:
     return HiveServerTableCompatible(table)
 
 
+  def get_columns(self, database, table_name):
+    results, schema = self._client.get_columns(database, table_name, max_rows=MAX_COLUMNS)
+    return [column['COLUMN_NAME'] for column in HiveServerTRowSet(results.results, schema.schema).cols(('COLUMN_NAME',))]
+
+
   def get_default_configuration(self, *args, **kwargs):
     return {}
 
@@ -624,4 +908,13 @@ class HiveServerClientCompatible:
     return self._client.get_partitions(database, table_name, max_parts)
 
 
+  def get_partition_names(self, database, table, partition_spec=None, max_parts=None):
+    return self._client.get_partition_names(database, table, partition_spec, max_parts)
+
+
+  def get_partition_by_name(self, database, table, partition_name):
+    # SHOW PARTITIONS only returns the names
+    return PartitionValueCompatible(partition_name.split('/'), table)
+
+
   def alter_partition(self, db_name, tbl_name, new_part): raise NotImplementedError()
@@ -597,6 +597,7 @@ ${layout.menubar(section='query')}
       }
 
       var AUTOCOMPLETE_BASE_URL = "${ autocomplete_base_url | n,unicode }";
+      var AUTOCOMPLETE_SCHEMA_BASE_URL = "${ autocomplete_schema_base_url | n,unicode }";
 
       function autocomplete(options) {
         if (options.database == null) {
@@ -644,19 +645,8 @@ ${layout.menubar(section='query')}
         }
 
         if ($.totalStorage('columns_' + $("#id_query-database").val() + '_' + tableName) != null) {
+          // Refreshed with all the other tables by getTables()
           callback($.totalStorage('columns_' + $("#id_query-database").val() + '_' + tableName));
-          autocomplete({
-            database: $("#id_query-database").val(),
-            table: tableName,
-            onDataReceived: function (data) {
-              if (data.error) {
-                $.jHueNotify.error(data.error);
-              }
-              else {
-                $.totalStorage('columns_' + $("#id_query-database").val() + '_' + tableName, (data.columns ? data.columns.join(" ") : ""));
-              }
-            }
-          });
         }
         else {
           autocomplete({
@@ -685,33 +675,39 @@ ${layout.menubar(section='query')}
         return false;
       }
 
-      function getTables(callback) {
-        if ($.totalStorage('tables_' + $("#id_query-database").val()) != null) {
-          callback($.totalStorage('tables_' + $("#id_query-database").val()));
-          autocomplete({
-            database: $("#id_query-database").val(),
-            onDataReceived: function (data) {
-              if (data.error) {
-                $.jHueNotify.error(data.error);
-              }
-              else {
-                $.totalStorage('tables_' + $("#id_query-database").val(), data.tables.join(" "));
-              }
+      // Databases whose schema was requested since the page was loaded
+      var schemaLoaded = {};
+
+      function getSchema(database, onDataReceived) {
+        // All the tables and columns of the database in one call
+        schemaLoaded[database] = true;
+        $.getJSON(AUTOCOMPLETE_SCHEMA_BASE_URL + database, function (data) {
+          if (data.error) {
+            delete schemaLoaded[database];
+            $.jHueNotify.error(data.error);
+          }
+          else {
+            for (var table in data.columns) {
+              $.totalStorage('columns_' + database + '_' + table, data.columns[table].join(" "));
             }
-          });
+            $.totalStorage('tables_' + database, data.tables.join(" "));
+            onDataReceived();
+          }
+        });
+      }
+
+      function getTables(callback) {
+        var _database = $("#id_query-database").val();
+        if ($.totalStorage('tables_' + _database) != null) {
+          callback($.totalStorage('tables_' + _database));
+          if (!schemaLoaded[_database]) {
+            // Refreshed once per page load
+            getSchema(_database, function () {});
+          }
         }
         else {
-          autocomplete({
-            database: $("#id_query-database").val(),
-            onDataReceived: function (data) {
-              if (data.error) {
-                $.jHueNotify.error(data.error);
-              }
-              else {
-                $.totalStorage('tables_' + $("#id_query-database").val(), data.tables.join(" "));
-                callback($.totalStorage('tables_' + $("#id_query-database").val()));
-              }
-            }
+          getSchema(_database, function () {
+            callback($.totalStorage('tables_' + _database));
           });
         }
       }
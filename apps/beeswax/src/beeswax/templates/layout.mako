@@ -36,6 +36,9 @@ def is_selected(section, matcher):
 			<li class="${is_selected(section, 'saved queries')}"><a href="${ url(app_name + ':list_designs') }">${_('Saved Queries')}</a></li>
 			<li class="${is_selected(section, 'history')}"><a href="${ url(app_name + ':list_query_history') }">${_('History')}</a></li>
 			<li class="${is_selected(section, 'configuration')}"><a href="${ url(app_name + ':configuration') }">${_('Settings')}</a></li>
+			% if user.is_superuser:
+			<li class="${is_selected(section, 'query timings')}"><a href="${ url(app_name + ':query_timings') }">${_('Timings')}</a></li>
+			% endif
 		</ul>
 	</div>
 </div>
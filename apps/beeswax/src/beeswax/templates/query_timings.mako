@@ -0,0 +1,83 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+<%!
+from desktop.views import commonheader, commonfooter
+from django.utils.translation import ugettext as _
+%>
+
+<%namespace name="layout" file="layout.mako" />
+
+${ commonheader(_('Query Timings'), app_name, user, '100px') | n,unicode }
+${layout.menubar(section='query timings')}
+
+<div class="container-fluid">
+  <h1>${_('Query Timings')}</h1>
+  <p>${_('Where the time of the last %(count)s queries went, in seconds.') % {'count': query_count}}</p>
+  <table class="table table-striped table-condensed">
+    <thead>
+      <tr>
+        <th>${_('Phase')}</th>
+        <th>${_('Queries')}</th>
+        % for percentile in percentiles:
+        <th>${_('%(percentile)sth percentile') % {'percentile': percentile}}</th>
+        % endfor
+      </tr>
+    </thead>
+    <tbody>
+      % for name, label, count, values in stats:
+      <tr>
+        <td>${ label }</td>
+        <td>${ count }</td>
+        % for value in values:
+          % if name in counters:
+          <td>${ value }</td>
+          % else:
+          <td>${ '%.3f' % value }</td>
+          % endif
+        % endfor
+      </tr>
+      % endfor
+    </tbody>
+  </table>
+  % if not stats:
+    <div class="alert">${_('No query timings recorded yet.')}</div>
+  % endif
+
+  % if result_cache_enabled:
+  <h2>${_('Result Cache')}</h2>
+  <p>${_('Activity of the result cache in this Hue process since it started.')}</p>
+  <table class="table table-striped table-condensed">
+    <thead>
+      <tr>
+        <th>${_('Hits')}</th>
+        <th>${_('Misses')}</th>
+        <th>${_('Stored results')}</th>
+        <th>${_('Rows served')}</th>
+      </tr>
+    </thead>
+    <tbody>
+      <tr>
+        <td>${ result_cache_stats['hits'] }</td>
+        <td>${ result_cache_stats['misses'] }</td>
+        <td>${ result_cache_stats['stores'] }</td>
+        <td>${ result_cache_stats['rows_served'] }</td>
+      </tr>
+    </tbody>
+  </table>
+  % endif
+</div>
+
+${ commonfooter(messages) | n,unicode }
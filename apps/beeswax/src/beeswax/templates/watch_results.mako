@@ -74,7 +74,9 @@ ${layout.menubar(section='query')}
                     % if download_urls:
                     <li class="nav-header">${_('Downloads')}</li>
                     <li><a target="_blank" href="${download_urls["csv"]}">${_('Download as CSV')}</a></li>
+                    <li><a target="_blank" href="${download_urls["csv"]}?compress=gz">${_('Download as compressed CSV')}</a></li>
                     <li><a target="_blank" href="${download_urls["xls"]}">${_('Download as XLS')}</a></li>
+                    <li><a target="_blank" href="${download_urls["xlsx"]}">${_('Download as XLSX')}</a></li>
                     % endif
                     %if can_save:
                     <li><a data-toggle="modal" href="#saveAs">${_('Save')}</a></li>
@@ -97,19 +99,6 @@ ${layout.menubar(section='query')}
                 </ul>
             </div>
 
-          % if not query.is_finished():
-            <div id="multiStatementsQuery" class="alert">
-              <button type="button" class="close" data-dismiss="alert">&times;</button>
-              <strong>${_('Multi-statement query')}</strong></br>
-              ${_('Hue stopped as one of your query contains some results.') }
-              ${_('Click on') }
-              <form action="${ url(app_name + ':watch_query', query.id) }?context=${ query.design.get_query_context() }" method="POST">
-                <input type="submit" value="${ _("next") }"/ class="btn btn-primary">
-              </form>
-              ${_('for continuing the execution of the remaining statements.') }
-            </div>
-          % endif
-
           <div id="jumpToColumnAlert" class="alert hide">
             <button type="button" class="close" data-dismiss="alert">&times;</button>
             <strong>${_('Did you know?')}</strong>
@@ -129,6 +118,7 @@ ${layout.menubar(section='query')}
         </a></li>
         <li><a href="#query" data-toggle="tab">${_('Query')}</a></li>
         <li><a href="#log" data-toggle="tab">${_('Log')}</a></li>
+        <li><a href="#timings" data-toggle="tab">${_('Timings')}</a></li>
         % if not error:
         <li><a href="#columns" data-toggle="tab">${_('Columns')}</a></li>
         % endif
@@ -151,6 +141,9 @@ ${layout.menubar(section='query')}
             % if expected_first_row != start_row:
                 <div class="alert"><strong>${_('Warning:')}</strong> ${_('Page offset may have incremented since last view.')}</div>
             % endif
+            % if query.cache_hit:
+                <div class="alert alert-info">${_('These results come from a previous run of the same query: the tables it reads did not change since.')}</div>
+            % endif
             <table class="table table-striped table-condensed resultTable" cellpadding="0" cellspacing="0" data-tablescroller-min-height-disable="true" data-tablescroller-enforce-height="true">
             <thead>
             <tr>
@@ -190,6 +183,26 @@ ${layout.menubar(section='query')}
           <pre>${ log }</pre>
         </div>
 
+        <div class="tab-pane" id="timings">
+          <table class="table table-striped table-condensed" cellpadding="0" cellspacing="0">
+            <tbody>
+              % for name, label in timing_phases:
+                % if name in timings:
+                <tr><td>${ label }</td><td>${ '%.3f' % timings[name] } ${_('s')}</td></tr>
+                % endif
+              % endfor
+              % for name, label in timing_counters:
+                % if name in timings:
+                <tr><td>${ label }</td><td>${ timings[name] }</td></tr>
+                % endif
+              % endfor
+            </tbody>
+          </table>
+          % if not timings:
+            <div class="alert">${_('No timings were recorded for this query.')}</div>
+          % endif
+        </div>
+
         % if not error:
         <div class="tab-pane" id="columns">
           <table class="table table-striped table-condensed" cellpadding="0" cellspacing="0">
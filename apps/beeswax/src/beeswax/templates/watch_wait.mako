@@ -63,6 +63,13 @@ ${layout.menubar(section='query')}
             </div>
         </div>
         <div class="span9">
+            <div id="queuePosition" class="alert alert-info
+                % if not queue_position:
+                  hide
+                % endif
+            ">
+                ${ _('Too many queries are running, this query waits for its turn. Position in the queue:') } <strong>${ queue_position }</strong>
+            </div>
             <ul class="nav nav-tabs">
                 <li class="active"><a href="#log" data-toggle="tab">${_('Log')}</a></li>
                 <li><a href="#query" data-toggle="tab">${_('Query')}</a></li>
@@ -89,14 +96,28 @@ ${layout.menubar(section='query')}
     }
 
     resizeLogs();
-    refreshView();
     var logsAtEnd = true;
+    var statusVersion = null;
+    refreshView();
 
     function refreshView() {
-      $.getJSON("${url(app_name + ':watch_query_refresh_json', query.id)}", function (data) {
+      // The server answers when the status is newer than statusVersion, or after a timeout
+      $.getJSON("${url(app_name + ':watch_query_refresh_json', query.id)}", statusVersion == null ? {} : {version: statusVersion}, function (data) {
+        var changed = data.version != statusVersion;
+        statusVersion = data.version;
+        if (data.error) {
+          // The status could not be read this time, e.g. while the server restarts
+          window.setTimeout(refreshView, 1000);
+          return;
+        }
         if (data.isSuccess || data.isFailure) {
           location.href = fwdUrl;
         }
+        if (data.queuePosition) {
+          $("#queuePosition").removeClass("hide").find("strong").text(data.queuePosition);
+        } else {
+          $("#queuePosition").addClass("hide");
+        }
         if (data.jobs && data.jobs.length > 0) {
           $(".jobLink").remove();
           $("#jobsHeader").text((data.jobs.length > 1 ? labels.MRJOBS : labels.MRJOB) + " (" + data.jobs.length + ")");
@@ -115,7 +136,7 @@ ${layout.menubar(section='query')}
         if (logsAtEnd) {
           _logsEl.scrollTop(_logsEl[0].scrollHeight - _logsEl.height());
         }
-        window.setTimeout(refreshView, 1000);
+        window.setTimeout(refreshView, changed ? 0 : 1000);
       });
     }
 
@@ -21,6 +21,7 @@ try:
 except ImportError:
   import simplejson as json
 import cStringIO
+import datetime
 import gzip
 import logging
 import os
@@ -29,8 +30,11 @@ import shutil
 import socket
 import tempfile
 import threading
+import time
+import zipfile
 
 from nose.tools import assert_true, assert_equal, assert_false
+from nose.plugins.attrib import attr
 from nose.plugins.skip import SkipTest
 
 from django.utils.encoding import smart_str
@@ -40,13 +44,26 @@ from django.core.urlresolvers import reverse
 from desktop.lib.django_test_util import make_logged_in_client, assert_equal_mod_whitespace
 from desktop.lib.django_test_util import assert_similar_pages
 from desktop.lib.test_utils import grant_access
+from desktop.lib.export_csvxls import CSVformatter, buffered
+from desktop.lib.exceptions_renderable import PopupException
+from desktop.lib import thrift_util
 
 from beeswaxd import ttypes
+from TCLIService.ttypes import TRowSet, TRow, TColumnValue, TStringValue, TI32Value, TDoubleValue,\
+  TTableSchema, TColumnDesc, TTypeDesc, TTypeEntry, TPrimitiveTypeEntry, TTypeId, TOperationHandle,\
+  THandleIdentifier, TOperationType, TFetchResultsResp, TStatus, TStatusCode
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol, TBinaryProtocolAccelerated
 
+import beeswax.admission
 import beeswax.create_table
 import beeswax.forms
 import beeswax.hive_site
 import beeswax.models
+import beeswax.query_poller
+import beeswax.query_timings
+import beeswax.result_cache
+import beeswax.result_spool
+import beeswax.script_runner
 import beeswax.views
 
 from beeswax import conf
@@ -54,10 +71,14 @@ from beeswax.views import collapse_whitespace
 from beeswax.test_base import make_query, wait_for_query_to_finish, verify_history, get_query_server_config,\
   BEESWAXD_TEST_PORT
 from beeswax.design import hql_query, _strip_trailing_semicolon
-from beeswax.data_export import download
-from beeswax.models import SavedQuery, QueryHistory, HQL
+from beeswax.data_export import download, data_generator, ResultPrefetcher
+from beeswax.models import SavedQuery, QueryHistory, HQL, Session, HiveServerQueryHandle
 from beeswax.server import dbms
+from beeswax.query_poller import QueryPoller
+from beeswax.result_spool import ResultSpool, SpooledResult
 from beeswax.server.beeswax_lib import BeeswaxDataTable, BeeswaxClient
+from beeswax.server.hive_server2_lib import HiveServerTRowSet, HiveServerTRowSetDecoder, HiveServerDataTable,\
+  HiveServerClient, ResultSetSchemaCache, SessionRegistry
 from beeswax.test_base import BeeswaxSampleProvider
 import hadoop
 
@@ -230,9 +251,24 @@ for x in sys.stdin:
     assert_equal(0, len(response.context["hadoop_jobs"]), "SELECT * shouldn't have started jobs.")
 
     # Download the data
-    response = self.client.get(response.context["download_urls"]["csv"])
+    download_url = response.context["download_urls"]["csv"]
+    response = self.client.get(download_url)
     # Header line plus data lines...
     assert_equal(257, response.content.count("\n"))
+    csv = response.content
+
+    # Compressed
+    response = self.client.get(download_url, {'compress': 'gz'})
+    assert_equal('attachment; filename=query_result.csv.gz', response['Content-Disposition'])
+    assert_equal(csv, gzip.GzipFile(fileobj=cStringIO.StringIO(response.content)).read())
+
+    response = self.client.get(download_url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+    assert_false(response.has_header('Content-Encoding'))
+    assert_equal(csv, response.content)
+
+    response = self.client.get(download_url, {'compress': 'gzip'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+    assert_equal('gzip', response['Content-Encoding'])
+    assert_equal(csv, gzip.GzipFile(fileobj=cStringIO.StringIO(response.content)).read())
 
   def test_query_with_udf(self):
     """
@@ -467,16 +503,14 @@ for x in sys.stdin:
     """
 
     resp = _make_query(self.client, hql)
-    query = hql_query(hql)
+    resp = wait_for_query_to_finish(self.client, resp, max=60.0)
 
-    handle = self.db.execute_and_wait(query)
-    resp = wait_for_query_to_finish(self.client, resp, max=30.0)
-
-    assert_true('multiStatementsQuery' in resp.content, resp.content)
-
-    resp = self.client.post(reverse('beeswax:watch_query', args=[resp.context['query'].id]))
-    assert_true('Waiting for query' in resp.content, resp.content)
-    assert_true('SELECT count(*) FROM test' in resp.content, resp.content)
+    # The statements run without stopping, the results are the ones of the last statement
+    query_history = resp.context['query']
+    assert_equal(1, query_history.statement_number)
+    assert_true(query_history.is_finished())
+    assert_equal(['_c0'], [col.name for col in resp.context['columns']])
+    assert_false('multiStatementsQuery' in resp.content, resp.content)
 
   def test_multiple_statements_various_queries(self):
     hql = """
@@ -532,6 +566,17 @@ for x in sys.stdin:
     csv_resp = download(handle, 'csv', self.db)
     assert_equal(len(csv_resp.content.strip().split('\n')), limit + 1)
 
+  def test_autocomplete_schema(self):
+    resp = self.client.get('/beeswax/autocomplete_schema/default')
+    content = json.loads(resp.content)
+    assert_true('test' in content['tables'], content)
+    assert_equal(['foo', 'bar'], content['columns']['test'])
+
+    resp = self.client.get('/beeswax/autocomplete_schema/default', {'prefix': 'tes'})
+    content = json.loads(resp.content)
+    assert_true('test' in content['tables'], content)
+    assert_false([table for table in content['tables'] if not table.startswith('tes')], content)
+
   def test_query_done_cb(self):
     hql = 'SELECT * FROM test'
     query = hql_query(hql)
@@ -569,6 +614,14 @@ for x in sys.stdin:
     csv_resp = download(handle, 'csv', self.db)
     assert_equal(csv_resp.content, translated_csv)
 
+    # Get the result in xlsx.
+    query = hql_query(hql)
+    handle = self.db.execute_and_wait(query)
+    xlsx_resp = download(handle, 'xlsx', self.db)
+    archive = zipfile.ZipFile(cStringIO.StringIO(xlsx_resp.content))
+    sheet = archive.read('xl/worksheets/sheet1.xml')
+    assert_equal(sheet.count('<row>'), 257)
+
   def test_designs(self):
     """Test design view and interaction"""
     cli = self.client
@@ -1196,12 +1249,1265 @@ def test_import_gzip_reader():
     beeswax.create_table.IMPORT_PEEK_SIZE = old_peek_size
 
 
+def _readfields_by_split(lines, delimiters):
+  """The wizard's former sniffer: splits all the lines with each delimiter"""
+  max_score, res = -1, (None, None)
+  for delim in delimiters:
+    fields_list = [ line.split(delim.decode('string_escape')) for line in lines if line ]
+    len_list = [ len(fields) for fields in fields_list ]
+    if min(len_list) == 1:
+      score = 0
+    else:
+      avg_n_fields = sum(len_list) / len(len_list)
+      var = sum([ l * l for l in len_list ]) / len(len_list) - avg_n_fields * avg_n_fields
+      score = (1000.0 / (var + 1)) + avg_n_fields
+    if score > max_score:
+      max_score, res = score, (delim, fields_list)
+  return res
+
+
+def _make_import_lines(n_cols, n_lines, delim):
+  lines = []
+  for i in xrange(n_lines):
+    lines.append(delim.join([ str(i), '%d.5' % i, '2013-05-0%d 10:00:00' % (i % 9 + 1), 'name %d' % i ] * (n_cols / 4)))
+  return lines
+
+
+def test_import_readfields():
+  delimiters = beeswax.create_table.DELIMITERS
+  for delim in (',', '\t', '\001', ' '):
+    lines = _make_import_lines(8, 10, delim) + ['']
+    assert_equal(_readfields_by_split(lines, delimiters), beeswax.create_table._readfields(lines, delimiters))
+
+  lines = ['a|b|c', 'd|e|f', 'g|h']
+  assert_equal(('|', [['a', 'b', 'c'], ['d', 'e', 'f'], ['g', 'h']]), beeswax.create_table._readfields(lines, ['|']))
+  assert_equal(_readfields_by_split(lines, delimiters), beeswax.create_table._readfields(lines, delimiters))
+
+  try:
+    beeswax.create_table._readfields(['', ''], delimiters)
+    assert_true(False, 'An empty sample has no columns')
+  except PopupException:
+    pass
+
+
+def test_infer_column_types():
+  fields_list = [
+    ['1', '2147483648', '1.5', '2013-05-01 10:00:00', 'a', '', '1', '1'],
+    ['-2', '3', '2', '2013-05-01 10:00:00.123', '2', '\\N', '1.', '2013-05-01'],
+    ['+3', '-4', '1e10', '', '3'],
+  ]
+  assert_equal(['int', 'bigint', 'double', 'timestamp', 'string', 'string', 'double', 'string'],
+               beeswax.create_table._infer_column_types(fields_list))
+  assert_equal(['double'], beeswax.create_table._infer_column_types([['9223372036854775808']]))
+  assert_equal([], beeswax.create_table._infer_column_types([]))
+
+
+class MockImportFs:
+  def __init__(self, data):
+    self.data = data
+    self.mtime = 1
+    self.opens = 0
+    self.user = 'test'
+
+  def stats(self, path):
+    return {'mtime': self.mtime, 'size': len(self.data)}
+
+  def open(self, path):
+    self.opens += 1
+    return cStringIO.StringIO(self.data)
+
+
+def test_import_sample_cache():
+  sample_cache = beeswax.create_table.sample_cache
+  sample_cache.clear()
+  fs = MockImportFs('a,b\nc,d')
+
+  # Not gzipped: tried as gzip, then as text
+  assert_equal(('text', [u'a,b', u'c,d']), beeswax.create_table._read_sample(fs, '/tmp/f', 'utf-8', ['gzip', 'text']))
+  assert_equal(1, fs.opens)
+  assert_equal(2, len(sample_cache))
+  assert_equal(('text', [u'a,b', u'c,d']), beeswax.create_table._read_sample(fs, '/tmp/f', 'utf-8', ['gzip', 'text']))
+  assert_equal(('text', [u'a,b', u'c,d']), beeswax.create_table._read_sample(fs, '/tmp/f', 'utf-8', ['text']))
+  assert_equal(1, fs.opens)
+
+  # New version of the file
+  fs.data = 'e,f'
+  fs.mtime = 2
+  assert_equal(('text', [u'e,f']), beeswax.create_table._read_sample(fs, '/tmp/f', 'utf-8', ['text']))
+  assert_equal(2, fs.opens)
+
+  # Another user reads the file with their own permissions
+  fs.user = 'other'
+  assert_equal(('text', [u'e,f']), beeswax.create_table._read_sample(fs, '/tmp/f', 'utf-8', ['text']))
+  assert_equal(3, fs.opens)
+
+  # LRU
+  cache = beeswax.create_table.SampleCache(size=2)
+  cache.put('a', ['a'])
+  cache.put('b', ['b'])
+  cache.get('a')
+  cache.put('c', ['c'])
+  assert_equal((True, ['a']), cache.get('a'))
+  assert_equal((False, None), cache.get('b'))
+  sample_cache.clear()
+
+
+@attr('benchmark')
+def test_import_readfields_benchmark():
+  delimiters = beeswax.create_table.DELIMITERS
+  lines = _make_import_lines(600, beeswax.create_table.IMPORT_PEEK_NLINES, '\t')
+  repeat = 20
+
+  start = time.time()
+  for i in xrange(repeat):
+    old_res = _readfields_by_split(lines, delimiters)
+  old_duration = time.time() - start
+
+  start = time.time()
+  for i in xrange(repeat):
+    new_res = beeswax.create_table._readfields(lines, delimiters)
+  new_duration = time.time() - start
+
+  start = time.time()
+  column_types = beeswax.create_table._infer_column_types(new_res[1])
+  types_duration = time.time() - start
+
+  assert_equal(old_res, new_res)
+  assert_equal(['int', 'double', 'timestamp', 'string'] * 150, column_types)
+  LOG.info('Sniffed %d lines of 600 columns: split by delimiter %.2fms, one pass %.2fms, types %.2fms' %
+           (len(lines), old_duration * 1000 / repeat, new_duration * 1000 / repeat, types_duration * 1000))
+
+
 def test_parse_results():
   data = ["foo\tbar", "baz\tboom"]
   results = type('Result', (object,), {'has_more': False, 'start_row': False, 'columns': False, 'data': data})
   assert_equal([["foo", "bar"], ["baz", "boom"]], [ x for x in list(BeeswaxDataTable(results).rows()) ])
 
 
+def _make_hive_server2_results(row_count):
+  """Synthetic HS2 fetch of (int, string, double) rows with some NULLs"""
+  def column(name, type_id):
+    type_desc = TTypeDesc(types=[TTypeEntry(primitiveEntry=TPrimitiveTypeEntry(type=type_id))])
+    return TColumnDesc(columnName=name, typeDesc=type_desc, position=0)
+
+  schema = TTableSchema(columns=[column('id', TTypeId.INT_TYPE),
+                                 column('name', TTypeId.STRING_TYPE),
+                                 column('price', TTypeId.DOUBLE_TYPE)])
+  rows = []
+  for i in xrange(row_count):
+    rows.append(TRow(colVals=[TColumnValue(i32Val=TI32Value(value=i)),
+                              TColumnValue(stringVal=TStringValue(value=(i % 10 and 'name%d' % i or None))),
+                              TColumnValue(doubleVal=TDoubleValue(value=i / 2.0))]))
+  return TRowSet(startRowOffset=0, rows=rows), schema
+
+
+def test_hiveserver2_row_set_decoder():
+  row_set, schema = _make_hive_server2_results(20)
+  decoder = HiveServerTRowSetDecoder(schema)
+
+  expected = [row.fields() for row in HiveServerTRowSet(row_set, schema)]
+  assert_equal(expected, decoder.to_rows(row_set))
+  assert_equal([[0, None, 0.0], [1, 'name1', 0.5]], decoder.to_rows(row_set)[:2])
+  assert_equal(zip(*expected), [tuple(col) for col in decoder.to_columns(row_set)])
+
+  # Mismatch between the declared type and the populated field
+  row_set.rows[0].colVals[0] = TColumnValue(stringVal=TStringValue(value='0'))
+  assert_equal('0', decoder.to_rows(row_set)[0][0])
+
+  results = type('Results', (object,), {'results': row_set})
+  metadata = type('Metadata', (object,), {'schema': schema})
+  data_table = HiveServerDataTable(results, metadata)
+  assert_equal(decoder.to_rows(row_set), list(data_table.rows()))
+
+
+@attr('benchmark')
+def test_hiveserver2_row_set_decoder_benchmark():
+  row_count = 100000
+  row_set, schema = _make_hive_server2_results(row_count)
+
+  start = time.time()
+  old_rows = [row.fields() for row in HiveServerTRowSet(row_set, schema)]
+  old_duration = time.time() - start
+
+  start = time.time()
+  new_rows = HiveServerTRowSetDecoder(schema).to_rows(row_set)
+  new_duration = time.time() - start
+
+  assert_equal(old_rows, new_rows)
+  LOG.info('Decoded %d rows: per cell probing %.2fs, schema based decoder %.2fs' % (row_count, old_duration, new_duration))
+
+
+def test_hiveserver2_accelerated_protocol():
+  row_set, schema = _make_hive_server2_results(20)
+  resp = TFetchResultsResp(status=TStatus(statusCode=TStatusCode.SUCCESS_STATUS), hasMoreRows=True, results=row_set)
+  data = thrift_util.to_bytes(resp, TBinaryProtocol)
+
+  for protocol_class in (TBinaryProtocol, TBinaryProtocolAccelerated):
+    assert_equal(resp, thrift_util.from_bytes(TFetchResultsResp, data, protocol_class))
+    assert_equal(data, thrift_util.to_bytes(resp, protocol_class))
+
+
+@attr('benchmark')
+def test_hiveserver2_accelerated_protocol_benchmark():
+  row_set, schema = _make_hive_server2_results(100000)
+  resp = TFetchResultsResp(status=TStatus(statusCode=TStatusCode.SUCCESS_STATUS), hasMoreRows=True, results=row_set)
+  data = thrift_util.to_bytes(resp, TBinaryProtocol)
+
+  durations = []
+  for protocol_class in (TBinaryProtocol, TBinaryProtocolAccelerated):
+    start = time.time()
+    decoded = thrift_util.from_bytes(TFetchResultsResp, data, protocol_class)
+    durations.append(time.time() - start)
+    assert_equal(resp, decoded)
+
+  LOG.info('Decoded a FetchResults of %d rows (%d bytes): binary protocol %.2fs, accelerated %.2fs (fastbinary %s)' %
+           (len(row_set.rows), len(data), durations[0], durations[1], thrift_util.fastbinary and 'loaded' or 'missing'))
+
+
+class MockTCLIServiceClient:
+  """Records the RPCs instead of calling HS2"""
+
+  def __init__(self):
+    self.calls = []
+
+  def __getattr__(self, name):
+    def call(req):
+      self.calls.append(name)
+      return type('Resp', (object,), {'results': None, 'schema': name, 'operationHandle': _make_operation_handle(name)})
+    return call
+
+
+class MockHiveServerClient(HiveServerClient):
+
+  def __init__(self):
+    self.query_server = {'server_name': 'beeswax'}
+    self.user = None
+    self._client = MockTCLIServiceClient()
+
+  def call(self, fn, req, status=None):
+    return fn(req)
+
+
+def _make_operation_handle(guid):
+  return TOperationHandle(operationId=THandleIdentifier(guid=guid, secret='secret'),
+                          operationType=TOperationType.EXECUTE_STATEMENT,
+                          hasResultSet=True)
+
+
+def test_result_set_schema_cache():
+  client = MockHiveServerClient()
+  handle = _make_operation_handle('test_result_set_schema_cache')
+
+  client.fetch_result(handle, cache_schema=True)
+  client.fetch_result(handle, cache_schema=True)
+  assert_equal(['FetchResults', 'GetResultSetMetadata', 'FetchResults'], client._client.calls)
+
+  client.close_operation(handle)
+  client.fetch_result(handle, cache_schema=True)
+  assert_equal(['FetchResults', 'GetResultSetMetadata', 'FetchResults', 'CloseOperation',
+                'FetchResults', 'GetResultSetMetadata'], client._client.calls)
+
+  client.cancel_operation(handle)
+  client.fetch_result(handle, cache_schema=True)
+  assert_equal(['CancelOperation', 'FetchResults', 'GetResultSetMetadata'], client._client.calls[-3:])
+
+  # One-shot operations are not cached
+  metadata_handle = _make_operation_handle('test_result_set_schema_cache_metadata')
+  client.fetch_result(metadata_handle)
+  client.fetch_result(metadata_handle)
+  assert_equal(['FetchResults', 'GetResultSetMetadata', 'FetchResults', 'GetResultSetMetadata'], client._client.calls[-4:])
+  client.cancel_operation(handle)
+
+  # The GetColumns operations are closed
+  client.get_columns('default', 't1')
+  assert_equal(['GetColumns', 'FetchResults', 'GetResultSetMetadata', 'CloseOperation'], client._client.calls[-4:])
+
+  # Bounded
+  cache = ResultSetSchemaCache(size=2)
+  for guid in ('a', 'b', 'c'):
+    cache.put(_make_operation_handle(guid), guid)
+  assert_equal(2, len(cache))
+  assert_equal(None, cache.get(_make_operation_handle('a')))
+
+  # Least recently used evicted first
+  assert_equal('b', cache.get(_make_operation_handle('b')))
+  cache.put(_make_operation_handle('d'), 'd')
+  assert_equal('b', cache.get(_make_operation_handle('b')))
+  assert_equal(None, cache.get(_make_operation_handle('c')))
+  assert_equal('d', cache.get(_make_operation_handle('d')))
+  cache.evict(_make_operation_handle('d'))
+  assert_equal(None, cache.get(_make_operation_handle('d')))
+  assert_equal(1, len(cache))
+
+
+def test_session_registry():
+  make_logged_in_client()
+  user = User.objects.get(username='test')
+  registry = SessionRegistry()
+
+  Session.objects.filter(owner=user, application='test_session_registry').delete()
+  assert_equal(None, registry.get(user, 'test_session_registry'))
+
+  secret, guid = HiveServerQueryHandle(secret='secret', guid='guid').get()
+  session = Session.objects.create(owner=user, application='test_session_registry', status_code=0, secret=secret, guid=guid)
+  last_used = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(days=1)
+  Session.objects.filter(id=session.id).update(last_used=last_used)
+  try:
+    assert_equal(session.get_handle(), registry.get(user, 'test_session_registry'))
+
+    # Served from memory
+    Session.objects.filter(id=session.id).update(secret='')
+    assert_equal(session.get_handle(), registry.get(user, 'test_session_registry'))
+
+    # Lazy write of the last use
+    registry.get(user, 'test_session_registry')
+    assert_equal(last_used, Session.objects.get(id=session.id).last_used)
+
+    registry.FLUSH_INTERVAL = 0
+    registry.get(user, 'test_session_registry')
+    assert_true(Session.objects.get(id=session.id).last_used > last_used)
+
+    # Back to the DB after an eviction
+    registry.evict(user, 'test_session_registry')
+    Session.objects.filter(id=session.id).delete()
+    assert_equal(None, registry.get(user, 'test_session_registry'))
+  finally:
+    Session.objects.filter(owner=user, application='test_session_registry').delete()
+
+
+class MockFetchDbms:
+  """Serves rows like HS2: FETCH_NEXT moves a cursor, has_more is True until an empty fetch"""
+
+  def __init__(self, rows):
+    self.data = rows
+    self.position = 0
+    self.fetches = 0
+    self.fetch_sizes = []
+
+  def fetch(self, handle, start_over=False, rows=None):
+    self.fetches += 1
+    self.fetch_sizes.append(rows)
+    if start_over:
+      self.position = 0
+    data = self.data[self.position:self.position + rows]
+    self.position += len(data)
+    return SpooledResult(data, ['id', 'name'], 0, bool(data))
+
+
+def test_result_spool():
+  root = tempfile.mkdtemp()
+  try:
+    rows = [[i, 'name%d' % i] for i in xrange(25)]
+    db = MockFetchDbms(rows)
+    spool = ResultSpool(os.path.join(root, '1_0'))
+
+    results = beeswax.result_spool.fetch(db, None, spool, 0, 10)
+    assert_equal(rows[:10], list(results.rows()))
+    assert_equal(['id', 'name'], results.columns)
+    assert_true(results.has_more)
+    assert_equal(1, db.fetches)
+
+    # Only readable by Hue
+    assert_equal(0700, os.stat(spool.path).st_mode & 0777)
+    for path in (spool.data_path, spool.index_path, spool.meta_path):
+      assert_equal(0600, os.stat(path).st_mode & 0777)
+
+    # Paging back does not restart the read on the server
+    results = beeswax.result_spool.fetch(db, None, spool, 0, 10)
+    assert_equal(rows[:10], list(results.rows()))
+    assert_equal(1, db.fetches)
+
+    results = beeswax.result_spool.fetch(db, None, spool, 5, 10)
+    assert_equal(rows[5:15], list(results.rows()))
+    assert_equal(2, db.fetches)
+
+    # The download continues after the spooled rows
+    formatter = type('Formatter', (object,), {'init_doc': lambda self: '', 'fini_doc': lambda self: '',
+                                              'format_header': lambda self, header: header,
+                                              'format_rows': lambda self, rows: rows})()
+    output = list(data_generator(None, formatter, db, spool))
+    assert_equal(['', ['id', 'name']], output[:2])
+    assert_equal(rows, sum(output[2:-1], []))
+    assert_equal('', output[-1])
+    assert_true(spool.is_complete())
+    fetches = db.fetches
+
+    results = beeswax.result_spool.fetch(db, None, spool, 20, 10)
+    assert_equal(rows[20:], list(results.rows()))
+    assert_false(results.has_more)
+    assert_equal(list(data_generator(None, formatter, db, spool)), list(data_generator(None, formatter, db, spool)))
+    assert_equal(fetches, db.fetches)
+  finally:
+    shutil.rmtree(root)
+
+
+def test_result_spool_limits():
+  root = tempfile.mkdtemp()
+  try:
+    rows = [[i, 'name%d' % i] for i in xrange(25)]
+    db = MockFetchDbms(rows)
+    spool = ResultSpool(os.path.join(root, '1_0'), max_size=200)
+
+    # Over the size limit: falls back to the server
+    fetched = []
+    next_row = 0
+    while next_row < len(rows):
+      results = beeswax.result_spool.fetch(db, None, spool, next_row, 10)
+      fetched.extend(results.rows())
+      next_row += len(results.data)
+    assert_equal(rows, fetched)
+    assert_true(spool.is_disabled())
+    assert_equal(0, spool.row_count())
+
+    # Expired spools are deleted
+    spool = ResultSpool(os.path.join(root, '2_0'))
+    spool.append(['id', 'name'], rows, complete=True)
+    beeswax.result_spool.cleanup(root, ttl=3600, total_size=1024 * 1024)
+    assert_true(spool.exists())
+    beeswax.result_spool.cleanup(root, ttl=-1, total_size=1024 * 1024)
+    assert_false(spool.exists())
+  finally:
+    shutil.rmtree(root)
+
+
+def test_result_prefetcher():
+  rows = [[i, 'name%d' % i] for i in xrange(20000)]
+
+  db = MockFetchDbms(rows)
+  batches = list(ResultPrefetcher(db, None, memory_limit=64 * 1024 * 1024, max_rows=8000))
+  assert_equal(rows, sum([batch.data for batch in batches], []))
+  assert_equal([1000, 2000, 4000, 8000, 8000, 8000], db.fetch_sizes)
+  assert_equal(['id', 'name'], batches[0].cols())
+
+  # Narrow memory limit
+  db = MockFetchDbms(rows)
+  batches = list(ResultPrefetcher(db, None, memory_limit=64 * 1024, max_rows=8000))
+  assert_equal(rows, sum([batch.data for batch in batches], []))
+  assert_true(max(db.fetch_sizes[1:]) < 2000, db.fetch_sizes)
+
+  # Errors are raised in the consumer
+  db = MockFetchDbms(None)
+  try:
+    list(ResultPrefetcher(db, None, memory_limit=64 * 1024))
+    assert_false(True)
+  except TypeError:
+    pass
+
+  # Closing the consumer stops the fetches
+  db = MockFetchDbms(rows)
+  prefetcher = iter(ResultPrefetcher(db, None, max_rows=1000))
+  prefetcher.next()
+  prefetcher.close()
+  start = time.time()
+  while [thread for thread in threading.enumerate() if thread.getName() == 'ResultPrefetcher'] and time.time() - start < 10:
+    time.sleep(0.1)
+  assert_false([thread for thread in threading.enumerate() if thread.getName() == 'ResultPrefetcher'])
+  assert_true(db.fetches < 5, db.fetches)
+
+
+def _format_rows_one_by_one(rows):
+  formatter = CSVformatter()
+  chunks = [formatter.format_header(['id', 'name'])]
+  for row in rows:
+    chunks.append(formatter.format_row(row))
+  return chunks
+
+
+def test_data_generator():
+  rows = [[i, 'name%d' % i] for i in xrange(2500)]
+
+  chunks = _format_rows_one_by_one(rows)
+  buffers = list(buffered(data_generator(None, CSVformatter(), MockFetchDbms(rows))))
+  assert_equal(''.join(chunks), ''.join(buffers))
+  assert_true(len(buffers) < len(chunks) / 100, len(buffers))
+
+
+@attr('benchmark')
+def test_data_generator_benchmark():
+  rows = [[i, 'name%d' % i] for i in xrange(100000)]
+
+  start = time.time()
+  chunks = _format_rows_one_by_one(rows)
+  row_time = time.time() - start
+
+  start = time.time()
+  buffers = list(buffered(data_generator(None, CSVformatter(), MockFetchDbms(rows))))
+  batch_time = time.time() - start
+
+  assert_equal(''.join(chunks), ''.join(buffers))
+  LOG.info('data_generator: %d rows/s row by row (%d chunks), %d rows/s in batches (%d chunks)' %
+           (len(rows) / max(row_time, 0.001), len(chunks), len(rows) / max(batch_time, 0.001), len(buffers)))
+
+
+class MockMetadataClient:
+  query_server = {'server_name': 'beeswax', 'server_host': 'localhost', 'server_port': 10000}
+
+  def __init__(self, user=None):
+    self.calls = []
+    self.user = user or User(username='test_metadata')
+
+  def query(self, query, statement=0):
+    pass
+
+  def get_databases(self):
+    self.calls.append('get_databases')
+    return ['default', 'other']
+
+  def get_tables(self, database, table_names):
+    self.calls.append('get_tables')
+    return ['t1', 't2']
+
+  def get_table(self, database, table_name):
+    self.calls.append('get_table')
+    return table_name
+
+  def get_columns(self, database, table_name):
+    self.calls.append('get_columns')
+    return ['%s_id' % table_name, '%s_name' % table_name]
+
+
+def test_metadata_cache():
+  cache = dbms.MetadataCache(ttl=3600, size=10)
+  server = ('beeswax', 'localhost', 10000)
+
+  cache.put((server, 'test', None, 'databases', None), ['default'])
+  cache.put((server, 'test', 'default', 'tables', '.*'), ['t1', 't2'])
+  cache.put((server, 'test', 'default', 'table', 't1'), 't1')
+  cache.put((server, 'test', 'default', 'table', 't2'), 't2')
+  cache.put((server, 'test', 'other', 'table', 't1'), 't1')
+  assert_equal((True, ['default']), cache.get((server, 'test', None, 'databases', None)))
+  assert_equal((False, None), cache.get((server, 'test', 'default', 'table', 't3')))
+
+  # Table: the table and the table lists of its database
+  cache.invalidate(server, 'default', 't1')
+  assert_false(cache.get((server, 'test', 'default', 'table', 't1'))[0])
+  assert_false(cache.get((server, 'test', 'default', 'tables', '.*'))[0])
+  assert_true(cache.get((server, 'test', 'default', 'table', 't2'))[0])
+  assert_true(cache.get((server, 'test', 'other', 'table', 't1'))[0])
+  assert_true(cache.get((server, 'test', None, 'databases', None))[0])
+
+  # Database: its entries and the list of databases
+  cache.invalidate(server, 'default')
+  assert_false(cache.get((server, 'test', 'default', 'table', 't2'))[0])
+  assert_false(cache.get((server, 'test', None, 'databases', None))[0])
+  assert_true(cache.get((server, 'test', 'other', 'table', 't1'))[0])
+
+  # Per user
+  cache.put((server, 'other_user', 'other', 'table', 't1'), 't1')
+  assert_false(cache.get((server, 'another_user', 'other', 'table', 't1'))[0])
+  cache.invalidate(server, 'other', 't1')
+  assert_false(cache.get((server, 'test', 'other', 'table', 't1'))[0])
+  assert_false(cache.get((server, 'other_user', 'other', 'table', 't1'))[0])
+  cache.put((server, 'test', 'other', 'table', 't1'), 't1')
+
+  # Other servers are not impacted
+  cache.invalidate(('impala', 'localhost', 21050))
+  assert_true(cache.get((server, 'test', 'other', 'table', 't1'))[0])
+  cache.invalidate(server)
+  assert_equal(0, len(cache))
+
+  # LRU
+  for i in range(10):
+    cache.put((server, 'test', 'default', 'table', 't%d' % i), i)
+  cache.get((server, 'test', 'default', 'table', 't0'))
+  cache.put((server, 'test', 'default', 'table', 't10'), 10)
+  assert_equal(9, len(cache))
+  assert_true(cache.get((server, 'test', 'default', 'table', 't0'))[0])
+  assert_false(cache.get((server, 'test', 'default', 'table', 't1'))[0])
+  assert_false(cache.get((server, 'test', 'default', 'table', 't2'))[0])
+
+  # TTL
+  cache = dbms.MetadataCache(ttl=0, size=10)
+  cache.put((server, 'test', None, 'databases', None), ['default'])
+  assert_false(cache.get((server, 'test', None, 'databases', None))[0])
+
+
+def test_dbms_metadata_cache():
+  dbms.metadata_cache.clear()
+  client = MockMetadataClient()
+  db = dbms.Dbms(client, QueryHistory.SERVER_TYPE[1][0])
+
+  for i in range(3):
+    assert_equal(['default', 'other'], db.get_databases())
+    assert_equal(['t1', 't2'], db.get_tables('default'))
+    assert_equal('t1', db.get_table('default', 't1'))
+  assert_equal(['get_databases', 'get_tables', 'get_table'], client.calls)
+
+  db.invalidate_cache('default', 't1')
+  db.get_databases()
+  db.get_tables('default')
+  db.get_table('default', 't1')
+  assert_equal(['get_databases', 'get_tables', 'get_table', 'get_tables', 'get_table'], client.calls)
+
+  # Users do not share their metadata
+  other_client = MockMetadataClient(User(username='test_metadata_other'))
+  other_db = dbms.Dbms(other_client, QueryHistory.SERVER_TYPE[1][0])
+  other_db.get_databases()
+  other_db.get_table('default', 't1')
+  assert_equal(['get_databases', 'get_table'], other_client.calls)
+
+  # DDL only forgets the tables it changes, for all the users
+  calls = len(client.calls)
+  db.invalidate_cache_for('DROP TABLE `default.t1`', 'other')
+  db.get_databases()
+  db.get_table('default', 't1')
+  db.get_table('default', 't2')
+  other_db.get_table('default', 't1')
+  assert_equal(['get_table', 'get_table'], client.calls[calls:])
+  assert_equal(['get_databases', 'get_table', 'get_table'], other_client.calls)
+
+  assert_true(dbms.is_ddl('DROP TABLE `default.t1`'))
+  assert_true(dbms.is_ddl('SELECT 1;\ncreate table t3 (a int)'))
+  assert_true(dbms.is_ddl("LOAD DATA INPATH '/tmp/data' INTO TABLE `default.t1`"))
+  assert_false(dbms.is_ddl('SELECT * FROM created'))
+
+  assert_equal([('default', 't1')], dbms.get_ddl_targets('DROP TABLE `default.t1`'))
+  assert_equal([('db', 't3'), ('db', 't1')], dbms.get_ddl_targets('SELECT 1;\ncreate table IF NOT EXISTS t3 (a int);'
+                                                                 "LOAD DATA LOCAL INPATH '/tmp/data' OVERWRITE INTO TABLE `t1`", 'db'))
+  assert_equal([('other', None), ('default', 'v1')], dbms.get_ddl_targets('DROP DATABASE other;\n'
+                                                                          'CREATE VIEW `default`.`v1` AS SELECT 1', 'db'))
+  assert_equal(None, dbms.get_ddl_targets('DROP TABLE t1'))
+  assert_equal(None, dbms.get_ddl_targets("CREATE FUNCTION f AS 'F'", 'default'))
+  assert_equal(None, dbms.get_ddl_targets('ALTER TABLE t1 RENAME TO other.t1', 'default'))
+  assert_equal([('db', 't1'), ('other', 't2')], dbms.get_ddl_targets('FROM src INSERT OVERWRITE TABLE t1 SELECT a '
+                                                                     'INSERT INTO TABLE other.t2 SELECT b', 'db'))
+  assert_equal([], dbms.get_ddl_targets("INSERT OVERWRITE LOCAL DIRECTORY '/tmp/t1' SELECT * FROM t1", 'db'))
+  dbms.metadata_cache.clear()
+
+
+def test_dbms_schema():
+  dbms.metadata_cache.clear()
+  client = MockMetadataClient()
+  client.get_tables = lambda database, table_names: ['sample_%d' % i for i in range(20)] + ['other']
+  db = dbms.Dbms(client, QueryHistory.SERVER_TYPE[1][0])
+
+  schema = db.get_schema('default')
+  assert_equal(21, len(schema.columns))
+  assert_equal(['other_id', 'other_name'], schema.columns['other'])
+  assert_equal(21, client.calls.count('get_columns'))
+
+  assert_equal(['sample_1', 'sample_10', 'sample_11', 'sample_12', 'sample_13', 'sample_14', 'sample_15',
+                'sample_16', 'sample_17', 'sample_18', 'sample_19'], schema.get_table_names('sample_1'))
+  assert_equal({'other': ['other_id', 'other_name']}, schema.get_columns('o'))
+  assert_equal([], schema.get_table_names('x'))
+  assert_equal(21, len(schema.get_table_names()))
+
+  # Cached until a table of the database changes
+  db.get_schema('default')
+  assert_equal(21, client.calls.count('get_columns'))
+  db.invalidate_cache('default', 'other')
+  db.get_schema('default')
+  assert_equal(42, client.calls.count('get_columns'))
+
+  # A table whose columns can't be read is skipped, the schema is read again next time
+  get_columns = client.get_columns
+  def failing_get_columns(database, table_name):
+    if table_name == 'sample_3':
+      raise Exception('Table not found')
+    return get_columns(database, table_name)
+  client.get_columns = failing_get_columns
+  db.invalidate_cache('default')
+  schema = db.get_schema('default')
+  assert_equal(20, len(schema.columns))
+  assert_false('sample_3' in schema.columns)
+  db.get_schema('default')
+  assert_equal(42 + 2 * 20, client.calls.count('get_columns'))
+  dbms.metadata_cache.clear()
+
+
+class MockPartitionsClient:
+  """Client of a metastore with 1000 partitions"""
+  def __init__(self):
+    self.names = ['day=%03d/hour=%02d' % (day, hour) for day in range(40, 0, -1) for hour in range(25)]
+    self.read = []
+
+  def query(self, query, statement=0):
+    pass
+
+  def get_partition_names(self, db_name, table, partition_spec=None, max_parts=None):
+    names = sorted([name for name in self.names
+                    if not partition_spec or name.startswith('day=%(day)s/' % partition_spec)])
+    return names[:max_parts]
+
+  def get_partition_by_name(self, db_name, table, partition_name):
+    self.read.append(partition_name)
+    return type('Partition', (object,), {'values': [value for key, value in dbms.parse_partition_name(partition_name)]})
+
+
+def test_dbms_partitions_page():
+  client = MockPartitionsClient()
+  db = dbms.Dbms(client, QueryHistory.SERVER_TYPE[0][0])
+  table = type('Table', (object,), {'name': 'logs', 'partition_keys': []})
+
+  partitions, has_more = db.get_partitions_page('default', table, first=0, count=3)
+  assert_equal(['day=001/hour=00', 'day=001/hour=01', 'day=001/hour=02'], [name for name, partition in partitions])
+  assert_equal([['001', '00'], ['001', '01'], ['001', '02']], [partition.values for name, partition in partitions])
+  assert_true(has_more)
+
+  # Only the partitions of the page are read
+  partitions, has_more = db.get_partitions_page('default', table, first=990, count=20)
+  assert_equal(10, len(partitions))
+  assert_false(has_more)
+  assert_equal(13, len(client.read))
+
+  partitions, has_more = db.get_partitions_page('default', table, first=0, count=2, reverse=True)
+  assert_equal(['day=040/hour=24', 'day=040/hour=23'], [name for name, partition in partitions])
+
+  partitions, has_more = db.get_partitions_page('default', table, partition_spec={'day': '007'}, first=20, count=10)
+  assert_equal(['day=007/hour=20', 'day=007/hour=21', 'day=007/hour=22', 'day=007/hour=23', 'day=007/hour=24'],
+               [name for name, partition in partitions])
+  assert_false(has_more)
+
+  assert_equal([('day', '2013-01-01'), ('path', 'a/b=c')], dbms.parse_partition_name('day=2013-01-01/path=a%2Fb%3Dc'))
+  assert_equal("`day`='2013' AND `name`='it\\'s'", dbms.quote_partition_spec([('day', '2013'), ('name', "it's")], ' AND '))
+
+
+def test_query_poller():
+  states = {'log': '', 'isSuccess': False, 'isFailure': False}
+  refreshed = []
+
+  def refresh(query_id):
+    refreshed.append(query_id)
+    return dict(states)
+
+  poller = QueryPoller(refresh, min_interval=0.05, max_interval=0.2, idle_timeout=5)
+
+  status = poller.get_status(1)
+  assert_equal(1, status.version)
+  assert_equal('', status.data['log'])
+
+  # Requests don't trigger refreshes
+  for i in range(20):
+    poller.get_status(1)
+  assert_true(len(refreshed) < 5, refreshed)
+
+  # Unchanged status: the long poll times out
+  start = time.time()
+  status = poller.get_status(1, version=1, timeout=0.5)
+  assert_equal(1, status.version)
+  assert_true(time.time() - start >= 0.5)
+
+  # The long poll returns as soon as the status changes
+  states['log'] = 'Stage-1 map = 0%'
+  status = poller.get_status(1, version=1, timeout=10)
+  assert_equal(2, status.version)
+  assert_equal('Stage-1 map = 0%', status.data['log'])
+
+  # Finished queries are not refreshed any more
+  states['isSuccess'] = True
+  status = poller.get_status(1, version=2, timeout=10)
+  assert_true(status.finished)
+  count = len(refreshed)
+  time.sleep(0.5)
+  assert_equal(count, len(refreshed))
+  assert_equal(status.version, poller.get_status(1, version=status.version, timeout=10).version)
+
+  # Errors are returned to the requests and retried
+  def failing_refresh(query_id):
+    refreshed.append(query_id)
+    raise Exception('Could not connect')
+
+  poller = QueryPoller(failing_refresh, min_interval=0.05, max_interval=0.2, idle_timeout=5)
+  status = poller.get_status(2)
+  assert_equal('Could not connect', str(status.error))
+  count = len(refreshed)
+  time.sleep(0.5)
+  assert_true(len(refreshed) > count)
+
+  # Too many waiting requests: the first status is not waited for either
+  poller = QueryPoller(refresh, min_interval=0.05, max_interval=0.2, idle_timeout=5, max_waiting_requests=0)
+  status = poller.get_status(3)
+  assert_equal(None, status.data)
+  assert_equal(0, status.version)
+
+  # A slow refresh does not stall the other queries
+  release = threading.Event()
+  def slow_refresh(query_id):
+    if query_id == 4:
+      release.wait(10)
+    return dict(states)
+
+  poller = QueryPoller(slow_refresh, min_interval=0.05, max_interval=0.2, idle_timeout=5, refresh_timeout=0.1)
+  try:
+    poller._condition.acquire()
+    try:
+      poller._statuses[4] = beeswax.query_poller.QueryStatus(4)
+    finally:
+      poller._condition.release()
+    start = time.time()
+    status = poller.get_status(5)
+    assert_equal(1, status.version)
+    assert_true(time.time() - start < 5)
+  finally:
+    release.set()
+
+
+def test_watch_query_refresh_json_error():
+  client = make_logged_in_client(username='test_refresh_error', is_superuser=False, groupname='test')
+  grant_access('test_refresh_error', 'test', 'beeswax')
+  user = User.objects.get(username='test_refresh_error')
+  history = QueryHistory.build(owner=user, query='SELECT 1', server_type=beeswax.models.BEESWAX, server_name='beeswax',
+                               server_host='localhost', server_port=8002, last_state=QueryHistory.STATE.running.index,
+                               server_id='refresh_error')
+  history.save()
+
+  def failing_refresh(query_id):
+    raise Exception('Could not connect')
+
+  query_poller = beeswax.views._query_poller
+  beeswax.views._query_poller = QueryPoller(failing_refresh, min_interval=0.05, max_interval=0.2, idle_timeout=5)
+  try:
+    # The page gets the error and polls again
+    response = client.get('/beeswax/watch/json/%s' % history.id)
+    assert_equal(200, response.status_code)
+    result = json.loads(response.content)
+    assert_equal('Could not connect', result['error'])
+    assert_true(result['version'] > 0)
+  finally:
+    beeswax.views._query_poller = query_poller
+
+
+def test_update_query_states():
+  user = User.objects.get_or_create(username='test_query_states')[0]
+
+  def make_history(server_id, state):
+    history = QueryHistory.build(owner=user, query='SELECT 1', server_type=beeswax.models.BEESWAX, server_name='beeswax',
+                                 server_host='localhost', server_port=8002, last_state=state.index, server_id=server_id)
+    history.save()
+    return history
+
+  histories = [
+    make_history('done', QueryHistory.STATE.running),
+    make_history('error', QueryHistory.STATE.submitted),
+    make_history('slow', QueryHistory.STATE.running),
+    make_history('unknown', QueryHistory.STATE.running),
+    make_history('finished', QueryHistory.STATE.available),
+  ]
+
+  calls = []
+  class MockDbms:
+    def invalidate_cache_for_finished(self, query_history, state):
+      pass
+
+    def get_state(self, handle):
+      calls.append(handle.secret)
+      if handle.secret == 'done':
+        return QueryHistory.STATE.available
+      elif handle.secret == 'error':
+        raise Exception('Query not found')
+      elif handle.secret == 'slow':
+        time.sleep(2)
+        return QueryHistory.STATE.available
+
+  clients = []
+  def get(user, query_server=None):
+    clients.append(user)
+    return MockDbms()
+
+  get_dbms = dbms.get
+  dbms.get = get
+  try:
+    start = time.time()
+    beeswax.views._update_query_states(histories, timeout=1.0)
+    assert_true(time.time() - start < 2)
+  finally:
+    dbms.get = get_dbms
+
+  # Terminal queries are not refreshed, one client per owner and server
+  assert_equal(['done', 'error', 'slow', 'unknown'], sorted(calls))
+  assert_equal(1, len(clients))
+
+  expected = [QueryHistory.STATE.available, QueryHistory.STATE.failed, QueryHistory.STATE.running,
+              QueryHistory.STATE.running, QueryHistory.STATE.available]
+  assert_equal([state.index for state in expected], [history.last_state for history in histories])
+  assert_equal([state.index for state in expected],
+               [QueryHistory.objects.get(id=history.id).last_state for history in histories])
+
+  # Too many threads already reading states: the page does not wait
+  state_refresh_threads = beeswax.views._state_refresh_threads
+  beeswax.views._state_refresh_threads = threading.Semaphore(0)
+  dbms.get = get
+  try:
+    del calls[:]
+    start = time.time()
+    beeswax.views._update_query_states(histories, timeout=1.0)
+    assert_true(time.time() - start < 0.5)
+    assert_equal([], calls)
+  finally:
+    dbms.get = get_dbms
+    beeswax.views._state_refresh_threads = state_refresh_threads
+
+
+class MockCacheClient(MockMetadataClient):
+
+  def __init__(self, user):
+    MockMetadataClient.__init__(self, user)
+    self.versions = {'t1': '1370000000', 't2': '1370000000'}
+    self.queries = 0
+
+  def get_table(self, database, table_name):
+    self.calls.append('get_table')
+    if table_name not in self.versions:
+      raise dbms.NoSuchObjectException()
+    return type('Table', (object,), {'name': table_name, 'is_view': table_name == 'v1', 'partition_keys': [],
+                                     'parameters': {'transient_lastDdlTime': self.versions[table_name]}})()
+
+  def query(self, query, statement=0):
+    self.queries += 1
+    return beeswax.models.BeeswaxQueryHandle(secret='s%d' % self.queries, has_result_set=True, log_context='s%d' % self.queries)
+
+
+def test_result_cache_key():
+  assert_equal(("select a, 'A  b' from t1 where c = \"--\"", "select a, '' from t1 where c = ''"),
+               beeswax.result_cache.normalize("SELECT a,  'A  b'\n  -- Comment\nFROM t1 WHERE c = \"--\";"))
+  assert_equal([('default', 't1'), ('other', 't2'), ('default', 't3')],
+               beeswax.result_cache.get_table_names('select * from t1 a, other.t2 as b join `t3` on (a.id = t3.id) '
+                                                   'where a.id in (select id from t1)'))
+
+  root = tempfile.mkdtemp()
+  finish = [conf.RESULT_SPOOL_DIR.set_for_testing(root), conf.RESULT_CACHE_TTL.set_for_testing(3600)]
+  try:
+    user = User.objects.get_or_create(username='test_result_cache')[0]
+    client = MockCacheClient(user)
+    db = dbms.Dbms(client, QueryHistory.SERVER_TYPE[0][0])
+    get_key = beeswax.result_cache.get_key
+
+    key = get_key(db, hql_query('SELECT * FROM t1 JOIN t2 ON (t1.id = t2.id)'))
+    assert_true(key)
+    assert_equal(key, get_key(db, hql_query('select *\nfrom t1 join t2 on (t1.id = t2.id)  ;')))
+    assert_equal(key, get_key(db, hql_query('select * from t1 join t2 on (t1.id = t2.id)')))
+
+    # Tables changed, even outside of Hue while their metadata is cached
+    db.get_table('default', 't2')
+    client.versions['t2'] = '1370000001'
+    assert_false(key == get_key(db, hql_query('SELECT * FROM t1 JOIN t2 ON (t1.id = t2.id)')))
+    assert_false(get_key(db, hql_query('SELECT 1 FROM t1')) == get_key(db, hql_query('SELECT 1 FROM t1', 'other')))
+
+    # Not cacheable
+    assert_equal(None, get_key(db, hql_query('SELECT rand() FROM t1')))
+    assert_equal(None, get_key(db, hql_query('SELECT * FROM v1')))
+    assert_equal(None, get_key(db, hql_query('SELECT * FROM missing')))
+    assert_equal(None, get_key(db, hql_query('INSERT OVERWRITE TABLE t2 SELECT * FROM t1')))
+    assert_equal(None, get_key(db, hql_query('SELECT * FROM t1; SELECT * FROM t2')))
+    finish.append(conf.RESULT_CACHE_TTL.set_for_testing(0))
+    assert_equal(None, get_key(db, hql_query('SELECT * FROM t1')))
+  finally:
+    for f in reversed(finish):
+      f()
+    shutil.rmtree(root)
+
+
+def test_result_cache():
+  root = tempfile.mkdtemp()
+  finish = [conf.RESULT_SPOOL_DIR.set_for_testing(root), conf.RESULT_CACHE_TTL.set_for_testing(3600)]
+  try:
+    user = User.objects.get_or_create(username='test_result_cache')[0]
+    client = MockCacheClient(user)
+    db = dbms.Dbms(client, QueryHistory.SERVER_TYPE[0][0])
+    cache = beeswax.result_cache.result_cache
+    hits = cache.hits
+    rows = [[i, 'name%d' % i] for i in xrange(25)]
+
+    # Miss: sent to the server, its spool is cached once complete
+    first = db.execute_and_watch(hql_query('SELECT * FROM t1'))
+    assert_equal(1, client.queries)
+    assert_false(first.cache_hit)
+    spool = beeswax.result_spool.get(first)
+    spool.append(['id', 'name'], rows[:10])
+    assert_false(cache.put(first.cache_key, spool, first))
+    spool.append(['id', 'name'], rows[10:], complete=True)
+    assert_true(cache.put(first.cache_key, spool, first))
+    assert_false(cache.put(first.cache_key, spool, first))
+
+    # Hit: available right away with a copy of the spool
+    second = db.execute_and_watch(hql_query('select *  from t1'))
+    assert_equal(1, client.queries)
+    assert_true(second.cache_hit)
+    assert_true(QueryHistory.objects.get(id=second.id).is_success())
+    assert_equal(first.server_id, second.server_id)
+    assert_equal(hits + 1, cache.hits)
+    response = make_logged_in_client().get('/beeswax/query_timings', {'format': 'json'})
+    assert_equal(cache.get_stats(), json.loads(response.content)['result_cache'])
+    handle, state = beeswax.views._get_query_handle_and_state(second)
+    assert_equal(QueryHistory.STATE.available, state)
+    results = beeswax.result_spool.fetch(None, handle, beeswax.result_spool.get(second), 0, 100)
+    assert_equal(rows, list(results.rows()))
+
+    # Deleting the original spool does not impact the copies
+    spool.delete()
+    cache.cleanup()
+    assert_equal(rows, beeswax.result_spool.get(second).read(0, 100))
+
+    # Changed table
+    client.versions['t1'] = '1370000001'
+    third = db.execute_and_watch(hql_query('SELECT * FROM t1'))
+    assert_equal(2, client.queries)
+    assert_false(third.cache_hit)
+
+    # Evicted spool of a hit: the handle of the first query must not be read
+    beeswax.result_spool.get(second).delete()
+    handle, state = beeswax.views._get_query_handle_and_state(second)
+    assert_equal(QueryHistory.STATE.expired, state)
+
+    # Expired entries and spool cleanup
+    assert_equal(1, len(os.listdir(os.path.join(root, 'cache'))))
+    beeswax.result_spool.cleanup(root, ttl=-1)
+    assert_equal(1, len(os.listdir(os.path.join(root, 'cache'))))
+    finish.append(conf.RESULT_CACHE_TTL.set_for_testing(1))
+    time.sleep(1.1)
+    cache.cleanup()
+    assert_equal(0, len(os.listdir(os.path.join(root, 'cache'))))
+  finally:
+    for f in reversed(finish):
+      f()
+    shutil.rmtree(root)
+
+
+class MockAdmissionClient:
+  """Thrift client of a server whose queries run until the test finishes them"""
+  submitted = []
+  finished = []
+
+  def __init__(self, user, query_server):
+    self.user = user
+    self.query_server = query_server
+
+  def query(self, query, statement=0):
+    MockAdmissionClient.submitted.append(self.user.username)
+    secret = 'admission_%d' % len(MockAdmissionClient.submitted)
+    return beeswax.models.BeeswaxQueryHandle(secret=secret, has_result_set=True, log_context=secret)
+
+  def get_state(self, handle):
+    if handle.secret in MockAdmissionClient.finished:
+      return QueryHistory.STATE.available
+    return QueryHistory.STATE.running
+
+
+def test_admission_queue():
+  finish = [conf.MAX_CONCURRENT_QUERIES.set_for_testing(2), conf.MAX_CONCURRENT_QUERIES_PER_USER.set_for_testing(1)]
+  heavy = User.objects.get_or_create(username='test_admission_heavy')[0]
+  light = User.objects.get_or_create(username='test_admission_light')[0]
+  query_server = dbms.get_query_server_config()
+  query_server.update({'server_host': 'admission_test', 'server_port': 10000})
+
+  def get(user, query_server=query_server):
+    return dbms.Dbms(MockAdmissionClient(user, query_server), QueryHistory.SERVER_TYPE[0][0])
+
+  get_dbms = dbms.get
+  dbms.get = get
+  MockAdmissionClient.submitted = []
+  try:
+    # The heavy user sends 10 queries, then the light user 2
+    histories = [get(heavy).execute_statement('SELECT %d FROM t1' % i) for i in range(10)]
+    histories += [get(light).execute_statement('SELECT %d FROM t2' % i) for i in range(2)]
+    assert_equal(['test_admission_heavy', 'test_admission_light'], MockAdmissionClient.submitted)
+    running = [history for history in histories if not history.is_queued()]
+    queued = [history for history in histories if history.is_queued()]
+    assert_equal([histories[0], histories[10]], running)
+    assert_equal([1, 2, 9, 10], [beeswax.admission.admission_queue.get_position(history.id) for history in
+                                 (histories[1], histories[2], histories[9], histories[11])])
+
+    # Polling does not submit anything while the server is full
+    for history in queued:
+      handle, state = beeswax.views._get_query_handle_and_state(history)
+      assert_equal(None, handle)
+      assert_equal(QueryHistory.STATE.submitted, state)
+    assert_equal(2, len(MockAdmissionClient.submitted))
+
+    # Each time a query finishes, the queued ones are polled in order
+    while queued:
+      running.pop(0).save_state(QueryHistory.STATE.available)
+      for history in list(queued):
+        handle, state = beeswax.views._get_query_handle_and_state(history)
+        if handle is not None:
+          queued.remove(history)
+          running.append(history)
+      assert_true(len(running) <= 2)
+
+    # The light user did not wait for all the queries of the heavy user
+    assert_equal(['test_admission_heavy', 'test_admission_light', 'test_admission_heavy', 'test_admission_light'] +
+                 ['test_admission_heavy'] * 8, MockAdmissionClient.submitted)
+    assert_equal(0, beeswax.admission.admission_queue.get_position(histories[-1].id))
+  finally:
+    dbms.get = get_dbms
+    for f in reversed(finish):
+      f()
+
+
+def test_admission_queue_refresh():
+  user = User.objects.get_or_create(username='test_admission_refresh')[0]
+  query_server = dbms.get_query_server_config()
+  query_server.update({'server_host': 'admission_refresh_test', 'server_port': 10000,
+                       'max_concurrent_queries': 1, 'max_concurrent_queries_per_user': 0})
+
+  def get(user, query_server=query_server):
+    return dbms.Dbms(MockAdmissionClient(user, query_server), QueryHistory.SERVER_TYPE[0][0])
+
+  get_dbms = dbms.get
+  admission_queue = beeswax.admission.admission_queue
+  dbms.get = get
+  beeswax.admission.admission_queue = beeswax.admission.AdmissionQueue(abandon_timeout=0.5, refresh_interval=0)
+  MockAdmissionClient.submitted = []
+  try:
+    first = get(user).execute_statement('SELECT 1 FROM t1')
+    second = get(user).execute_statement('SELECT 2 FROM t1')
+    assert_false(first.is_queued())
+    assert_true(second.is_queued())
+
+    # The first query finished while nobody looked at it: it does not hold its slot
+    MockAdmissionClient.finished.append(first.server_id)
+    handle, state = beeswax.views._get_query_handle_and_state(second)
+    assert_true(handle is not None)
+    assert_true(QueryHistory.objects.get(id=first.id).is_success())
+
+    # A queued query which is not polled any more fails
+    third = get(user).execute_statement('SELECT 3 FROM t1')
+    fourth = get(user).execute_statement('SELECT 4 FROM t1')
+    time.sleep(0.6)
+    handle, state = beeswax.views._get_query_handle_and_state(fourth)
+    assert_equal(None, handle)
+    assert_true(QueryHistory.objects.get(id=third.id).is_failure())
+    assert_true(QueryHistory.objects.get(id=fourth.id).is_queued())
+    assert_equal(2, len(MockAdmissionClient.submitted))
+  finally:
+    dbms.get = get_dbms
+    beeswax.admission.admission_queue = admission_queue
+    MockAdmissionClient.finished = []
+
+
+class MockScriptClient:
+  """Thrift client of a server running the statements of a script"""
+  def __init__(self, user):
+    self.user = user
+    self.query_server = dbms.get_query_server_config()
+    self.submitted = []
+    self.closed = []
+    self.states = {}
+
+  def query(self, query, statement=0):
+    self.submitted.append(query.get_query_statement(statement))
+    secret = 'script_%d' % statement
+    self.states[secret] = QueryHistory.STATE.running
+    return beeswax.models.BeeswaxQueryHandle(secret=secret, has_result_set=True, log_context=secret)
+
+  def get_state(self, handle):
+    return self.states[handle.secret]
+
+  def close(self, handle):
+    self.closed.append(handle.secret)
+
+
+def test_script_runner():
+  user = User.objects.get_or_create(username='test_script_runner')[0]
+  query = hql_query('SELECT 1 FROM t1; SELECT 2 FROM t2; SELECT 3 FROM t3')
+  design = SavedQuery.objects.create(owner=user, type=HQL, data=query.dumps(), name='script', desc='')
+  client = MockScriptClient(user)
+  db = dbms.Dbms(client, QueryHistory.SERVER_TYPE[0][0])
+  runner = beeswax.script_runner.ScriptRunner(get_dbms=lambda query_history: db, min_interval=0, max_interval=0)
+
+  started = []
+  start = beeswax.script_runner.script_runner.start
+  beeswax.script_runner.script_runner.start = started.append
+  try:
+    query_history = db.execute_and_watch(query, design=design)
+    assert_equal([query_history.id], started)
+    assert_equal(['SELECT 1 FROM t1'], client.submitted)
+
+    # The first statement finishes, its results are dropped and the second one is submitted
+    client.states['script_0'] = QueryHistory.STATE.available
+    assert_true(runner.run_step(query_history.id))
+    assert_equal(['SELECT 1 FROM t1', 'SELECT 2 FROM t2'], client.submitted)
+    assert_equal(['script_0'], client.closed)
+    assert_equal(1, QueryHistory.objects.get(id=query_history.id).statement_number)
+
+    # Another runner which did not see the progress can't submit the statement again
+    assert_equal(None, db.execute_next_statement(query_history))
+    assert_equal(2, len(client.submitted))
+
+    client.states['script_1'] = QueryHistory.STATE.available
+    assert_true(runner.run_step(query_history.id))
+    client.states['script_2'] = QueryHistory.STATE.available
+    assert_false(runner.run_step(query_history.id))
+
+    # The results of the last statement are kept
+    query_history = QueryHistory.get(id=query_history.id)
+    assert_equal(2, query_history.statement_number)
+    assert_true(query_history.is_success())
+    assert_equal(['script_0', 'script_1'], client.closed)
+    assert_equal(['SELECT 1 FROM t1', 'SELECT 2 FROM t2', 'SELECT 3 FROM t3'], client.submitted)
+    assert_equal([query_history.id], started)
+
+    # A failed statement stops the script
+    query_history = db.execute_and_watch(query, design=design)
+    client.states['script_0'] = QueryHistory.STATE.failed
+    assert_false(runner.run_step(query_history.id))
+    assert_true(QueryHistory.get(id=query_history.id).is_failure())
+    assert_equal(4, len(client.submitted))
+  finally:
+    beeswax.script_runner.script_runner.start = start
+
+
+class MockTimingsClient(MockScriptClient):
+  """Thrift client of a server whose calls take some time"""
+  def query(self, query, statement=0):
+    handle = MockScriptClient.query(self, query, statement)
+    self.states[handle.secret] = QueryHistory.STATE.submitted
+    handle.submit_time = 0.5
+    return handle
+
+  def get_default_configuration(self, include_hadoop):
+    return []
+
+  def fetch(self, handle, start_over=False, rows=None):
+    results = type('Results', (object,), {'ready': True, 'has_more': False, 'start_row': 0,
+                                          'columns': ['a'], 'data': ['1', '22', '333']})
+    return BeeswaxDataTable(results, fetch_time=0.25)
+
+
+def test_query_timings():
+  user = User.objects.get_or_create(username='test_query_timings')[0]
+  client = MockTimingsClient(user)
+  db = dbms.Dbms(client, QueryHistory.SERVER_TYPE[0][0])
+
+  get_dbms = dbms.get
+  dbms.get = lambda user, query_server=None: db
+  try:
+    query_history = db.execute_statement('SELECT a FROM t1')
+    timings = beeswax.query_timings.get(query_history)
+    assert_equal(0.5, timings['submit'])
+    assert_false('first_state_change' in timings)
+
+    # The phases are recorded once, when the status polls see them
+    beeswax.views._get_query_handle_and_state(query_history)
+    assert_false('first_state_change' in beeswax.query_timings.get(query_history))
+    client.states['script_0'] = QueryHistory.STATE.running
+    beeswax.views._get_query_handle_and_state(query_history)
+    client.states['script_0'] = QueryHistory.STATE.available
+    beeswax.views._get_query_handle_and_state(query_history)
+    beeswax.views._get_query_handle_and_state(query_history)
+    timings = beeswax.query_timings.get(QueryHistory.objects.get(id=query_history.id))
+    assert_true(0 <= timings['first_state_change'] <= timings['finished'], timings)
+
+    # Each fetch is counted once
+    db.fetch(query_history.get_handle())
+    db.fetch(query_history.get_handle())
+    beeswax.query_timings.record_fetch(query_history, db.fetch_stats)
+    beeswax.query_timings.record_fetch(query_history, db.fetch_stats)
+    timings = beeswax.query_timings.get(QueryHistory.objects.get(id=query_history.id))
+    assert_equal(0.5, timings['fetch'])
+    assert_equal(6, timings['rows'])
+    assert_equal(18, timings['bytes'])
+    assert_true(timings['finished'] <= timings['first_row'], timings)
+  finally:
+    dbms.get = get_dbms
+
+  # Percentiles of the recorded values
+  queries = [QueryHistory(timings=json.dumps({'submit': value})) for value in range(1, 101)]
+  queries.append(QueryHistory(timings=None))
+  stats = beeswax.query_timings.get_percentiles(queries)
+  assert_equal([('submit', 100, [50, 90, 99])], [(name, count, values) for name, label, count, values in stats])
+
+
 def test_index_page():
   """Minimal test that index page renders."""
   c = make_logged_in_client()
@@ -34,6 +34,8 @@ urlpatterns = patterns('beeswax.views',
   url(r'^autocomplete/$', 'autocomplete', name='autocomplete'),
   url(r'^autocomplete/(?P<database>\w+)/$', 'autocomplete', name='autocomplete'),
   url(r'^autocomplete/(?P<database>\w+)/(?P<table>\w+)$', 'autocomplete', name='autocomplete'),
+  url(r'^autocomplete_schema/$', 'autocomplete_schema', name='autocomplete_schema'),
+  url(r'^autocomplete_schema/(?P<database>\w+)$', 'autocomplete_schema', name='autocomplete_schema'),
 
 
   url(r'^my_queries$', 'my_queries', name='my_queries'),
@@ -45,6 +47,7 @@ urlpatterns = patterns('beeswax.views',
   url(r'^query_history$', 'list_query_history', name='list_query_history'),
 
   url(r'^configuration$', 'configuration', name='configuration'),
+  url(r'^query_timings$', 'query_timings_stats', name='query_timings'),
   url(r'^install_examples$', 'install_examples', name='install_examples'),
   url(r'^query_cb/done/(?P<server_id>\S+)$', 'query_done_cb', name='query_done_cb'),
 )
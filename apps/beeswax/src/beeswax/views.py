@@ -20,10 +20,14 @@ try:
 except ImportError:
   import simplejson as json
 import logging
+import Queue
 import re
+import threading
+import time
 
 from django import forms
 from django.contrib import messages
+from django.db import connection, transaction
 from django.db.models import Q
 from django.http import HttpResponse, QueryDict
 from django.shortcuts import redirect
@@ -35,6 +39,7 @@ from desktop.lib.paginator import Paginator
 from desktop.lib.django_util import copy_query_dict, format_preserving_redirect, render
 from desktop.lib.django_util import login_notrequired, get_desktop_uri_prefix
 from desktop.lib.exceptions_renderable import PopupException
+from desktop.lib import export_csvxls
 
 from hadoop.fs.exceptions import WebHdfsException
 from jobsub.parameterization import find_variables, substitute_variables
@@ -43,7 +48,8 @@ import beeswax.forms
 import beeswax.design
 import beeswax.management.commands.beeswax_install_examples
 
-from beeswax import common, data_export, models, conf
+from beeswax import admission, common, data_export, models, conf, query_poller, query_timings, result_cache,\
+  result_spool, script_runner
 from beeswax.forms import QueryForm
 from beeswax.design import HQLdesign, hql_query
 from beeswax.models import SavedQuery, make_query_context, QueryHistory
@@ -53,7 +59,12 @@ from beeswax.server.dbms import expand_exception, get_query_server_config
 
 LOG = logging.getLogger(__name__)
 SAVE_RESULTS_CTAS_TIMEOUT = 300         # seconds
+STATE_REFRESH_THREADS = 10              # Concurrent get_state calls of a history page
+STATE_REFRESH_TIMEOUT = 5.0             # Seconds to wait for the states of a history page
+MAX_STATE_REFRESH_THREADS = 50          # get_state threads of all the pages, including the ones still in a call after their timeout
+TIMINGS_QUERIES = 1000                  # Last queries in the timing percentiles
 
+_state_refresh_threads = threading.Semaphore(MAX_STATE_REFRESH_THREADS)
 
 
 def index(request):
@@ -353,7 +364,12 @@ def download(request, id, format):
   db = dbms.get(request.user, query_history.get_query_server_config())
   LOG.debug('Download results for query %s: [ %s ]' % (query_history.server_id, query_history.query))
 
-  return data_export.download(query_history.get_handle(), format, db)
+  spool = result_spool.get(query_history)
+  if query_history.cache_hit and (spool is None or not spool.is_complete()):
+    raise PopupException(_('The results of this query have expired.'))
+
+  return data_export.download(query_history.get_handle(), format, db, spool,
+                              export_csvxls.get_compression(request), query_history)
 
 
 """
@@ -440,6 +456,7 @@ def execute_query(request, design_id=None):
     'form': form,
     'log': log,
     'autocomplete_base_url': reverse(get_app_name(request) + ':autocomplete', kwargs={}),
+    'autocomplete_schema_base_url': reverse(get_app_name(request) + ':autocomplete_schema', kwargs={}),
     'on_success_url': on_success_url,
     'can_edit_name': design and not design.is_auto and design.name,
   })
@@ -485,14 +502,7 @@ def watch_query(request, id):
   if not on_success_url:
     on_success_url = results_url
 
-  # Go to next statement if asked to continue or when a statement with no dataset finished.
-  if request.method == 'POST' or (not query_history.is_finished() and query_history.is_success() and not query_history.has_results):
-    try:
-      query_history = db.execute_next_statement(query_history)
-    except Exception, ex:
-      pass
-
-  # Check query state
+  # Check query state, the statements of the query are run by the script runner
   handle, state = _get_query_handle_and_state(query_history)
   query_history.save_state(state)
 
@@ -504,7 +514,10 @@ def watch_query(request, id):
     return format_preserving_redirect(request, on_success_url, request.GET)
 
   # Still running
-  log = db.get_log(handle)
+  if handle is None:
+    log = ''
+  else:
+    log = db.get_log(handle)
 
   # Keep waiting
   # - Translate context into something more meaningful (type, data)
@@ -516,39 +529,82 @@ def watch_query(request, id):
                 'log': log,
                 'hadoop_jobs': _parse_out_hadoop_jobs(log),
                 'query_context': query_context,
+                'queue_position': admission.admission_queue.get_position(query_history.id),
               })
 
 def watch_query_refresh_json(request, id):
+  """
+  Status and log of the query. With the ``version`` GET parameter of a previous response,
+  waits up to the long poll timeout for a newer status.
+  """
   query_history = authorized_get_history(request, id, must_exist=True)
-  db = dbms.get(request.user, query_history.get_query_server_config())
-  handle, state = _get_query_handle_and_state(query_history)
-  query_history.save_state(state)
 
   try:
-    if not query_history.is_finished() and query_history.is_success() and not query_history.has_results:
-      db.execute_next_statement(query_history)
-      handle, state = _get_query_handle_and_state(query_history)
-  except Exception, ex:
-    LOG.exception(ex)
-    handle, state = _get_query_handle_and_state(query_history)
+    version = int(request.GET['version'])
+  except (KeyError, ValueError):
+    version = None
+
+  status = _query_poller.get_status(query_history.id, version, conf.QUERY_STATUS_LONG_POLL_TIMEOUT.get())
+  if status.error is not None:
+    # e.g. the server restarts, the page polls again
+    result = {'error': unicode(status.error)}
+  elif status.data is None:
+    # Too many requests waiting for a status, the page polls again
+    result = {'log': '', 'jobs': [], 'jobUrls': {}, 'isSuccess': False, 'isFailure': False, 'queuePosition': 0}
+  else:
+    result = dict(status.data)
+  result['version'] = status.version
 
+  return HttpResponse(json.dumps(result), mimetype="application/json")
+
+
+def _refresh_query_status(query_id):
+  """
+  Status of a query for watch_query_refresh_json(). Called by the query poller, each
+  time in a new thread: its database connection is closed at the end.
+  """
   try:
-    log = db.get_log(handle)
+    return _get_query_status(query_id)
+  finally:
+    connection.close()
+
+
+def _get_query_status(query_id):
+  # Read what other processes committed
+  transaction.commit_unless_managed()
+
+  query_history = QueryHistory.get(id=query_id)
+  db = dbms.get(query_history.owner, query_history.get_query_server_config())
+  handle, state = _get_query_handle_and_state(query_history)
+  query_history.save_state(state)
+  if handle is None:
+    return {
+      'log': '',
+      'jobs': [],
+      'jobUrls': {},
+      'isSuccess': False,
+      'isFailure': False,
+      'queuePosition': admission.admission_queue.get_position(query_history.id)
+    }
+
+  try:
+    log = not query_history.cache_hit and db.get_log(handle) or ''
   except Exception, ex:
     log = str(ex)
 
   jobs = _parse_out_hadoop_jobs(log)
   job_urls = dict([(job, reverse('jobbrowser.views.single_job', kwargs=dict(job=job))) for job in jobs])
 
-  result = {
+  return {
     'log': log,
     'jobs': jobs,
     'jobUrls': job_urls,
     'isSuccess': query_history.is_finished() or (query_history.is_success() and query_history.has_results),
-    'isFailure': query_history.is_failure()
+    'isFailure': query_history.is_failure(),
+    'queuePosition': 0
   }
 
-  return HttpResponse(json.dumps(result), mimetype="application/json")
+_query_poller = query_poller.QueryPoller(_refresh_query_status)
 
 
 def cancel_operation(request, query_id):
@@ -559,9 +615,13 @@ def cancel_operation(request, query_id):
   else:
     try:
       query_history = authorized_get_history(request, query_id, must_exist=True)
-      db = dbms.get(request.user, query_history.get_query_server_config())
-      db.cancel_operation(query_history.get_handle())
-      _get_query_handle_and_state(query_history)
+      if query_history.is_queued():
+        admission.admission_queue.remove(query_history.id)
+        query_history.save_state(QueryHistory.STATE.failed)
+      else:
+        db = dbms.get(request.user, query_history.get_query_server_config())
+        db.cancel_operation(query_history.get_handle())
+        _get_query_handle_and_state(query_history)
       response = {'status': 0}
     except Exception, e:
       response = {'message': unicode(e)}
@@ -577,14 +637,14 @@ def view_results(request, id, first_row=0):
   To display query results, one should always go through the watch_query view.
   If the result set has has_result_set=False, display an empty result.
 
-  If ``first_row`` is 0, restarts (if necessary) the query read.  Otherwise, just
-  spits out a warning if first_row doesn't match the servers conception.
+  The rows already read are served from the result spool, at any ``first_row``.
+  Without a spool, if ``first_row`` is 0, restarts (if necessary) the query read.
+  Otherwise, just spits out a warning if first_row doesn't match the servers conception.
   Multiple readers will produce a confusing interaction here, and that's known.
 
   It understands the ``context`` GET parameter. (See watch_query().)
   """
   first_row = long(first_row)
-  start_over = (first_row == 0)
   results = type('Result', (object,), {
                 'rows': 0,
                 'columns': [],
@@ -601,36 +661,50 @@ def view_results(request, id, first_row=0):
   db = dbms.get(request.user, query_server)
 
   handle, state = _get_query_handle_and_state(query_history)
+  if handle is None:
+    # Still in the admission queue
+    return format_preserving_redirect(request, reverse(app_name + ':watch_query', kwargs={'id': id}), request.GET)
   context_param = request.GET.get('context', '')
   query_context = _parse_query_context(context_param)
+  spool = result_spool.get(query_history)
 
   # To remove in Hue 2.3
   download  = request.GET.get('download', '')
 
   # Update the status as expired should not be accessible
-  # Impala does not support startover for now
-  expired = state == models.QueryHistory.STATE.expired
-  if expired or app_name == 'impala':
-    state = models.QueryHistory.STATE.expired
+  expired = state == models.QueryHistory.STATE.expired and not (spool is not None and spool.is_complete())
+  if expired:
     query_history.save_state(state)
 
   # Retrieve query results or use empty result if no result set
   try:
     if query_server['server_name'] == 'impala' and not handle.has_result_set:
       downloadable = False
+    elif expired and query_history.cache_hit:
+      downloadable = False
     elif not download:
-      results = db.fetch(handle, start_over, 100)
+      results = result_spool.fetch(db, handle, spool, first_row, 100)
       data = list(results.rows()) # Materialize results
 
       # We display the "Download" button only when we know that there are results:
       downloadable = first_row > 0 or data
-      log = db.get_log(handle)
+      if query_history.cache_hit:
+        log = ''
+      else:
+        log = db.get_log(handle)
+        if query_history.cache_key and spool is not None and spool.is_complete():
+          result_cache.result_cache.put(query_history.cache_key, spool, query_history)
     else:
       downloadable = True
 
   except Exception, ex:
     fetch_error = True
     error_message, log = expand_exception(ex, db, handle)
+  query_timings.record_fetch(query_history, db.fetch_stats)
+
+  # Impala does not support startover, the results can only be read again from a complete spool
+  if app_name == 'impala' and not expired and not (spool is not None and spool.is_complete()):
+    query_history.save_state(models.QueryHistory.STATE.expired)
 
   # Handle errors
   error = fetch_error or results is None or expired
@@ -649,7 +723,10 @@ def view_results(request, id, first_row=0):
     'expired': expired,
     'app_name': app_name,
     'download': download,
-    'next_json_set': None
+    'next_json_set': None,
+    'timings': query_timings.get(query_history),
+    'timing_phases': query_timings.PHASES,
+    'timing_counters': query_timings.COUNTERS,
   }
 
   if not error:
@@ -670,7 +747,7 @@ def view_results(request, id, first_row=0):
       'columns': results.columns,
       'download_urls': download_urls,
       'save_form': save_form,
-      'can_save': query_history.owner == request.user and not download,
+      'can_save': query_history.owner == request.user and not download and not query_history.cache_hit,
       'next_json_set': reverse(get_app_name(request) + ':view_results', kwargs={
         'id': str(id),
         'first_row': results.start_row + len(data)
@@ -690,7 +767,10 @@ def view_results(request, id, first_row=0):
     }
     return HttpResponse(json.dumps(context), mimetype="application/json")
 
-  return render('watch_results.mako', request, context)
+  start = time.time()
+  response = render('watch_results.mako', request, context)
+  query_timings.record(query_history, last={'render': time.time() - start})
+  return response
 
 
 def save_results(request, id):
@@ -706,6 +786,8 @@ def save_results(request, id):
   if request.method == 'POST':
     # Make sure the result is available.
     # Note that we may still hit errors during the actual save
+    if query_history.cache_hit:
+      raise PopupException(_('The results of this query come from the result cache and can only be downloaded.'))
     if not query_history.is_success():
       if query_history.is_failure():
         msg = _('This query has %(state)s. Results unavailable.') % {'state': state}
@@ -858,6 +940,7 @@ def confirm_query(request, query, on_success_url=None):
     'on_success_url': on_success_url,
     'design': None,
     'autocomplete_base_url': reverse(get_app_name(request) + ':autocomplete', kwargs={}),
+    'autocomplete_schema_base_url': reverse(get_app_name(request) + ':autocomplete_schema', kwargs={}),
   })
 
 
@@ -879,6 +962,34 @@ def configuration(request):
   return render("configuration.mako", request, {'config_values': config_values})
 
 
+def query_timings_stats(request):
+  """Percentiles of the timings of the last queries of the app, for the administrators"""
+  if not request.user.is_superuser:
+    raise PopupException(_('Only superusers can see the query timings.'))
+
+  app_name = get_app_name(request)
+  query_type = app_name == 'impala' and models.IMPALA or models.HQL
+  queries = QueryHistory.objects.filter(query_type=query_type).exclude(timings=None).only('id', 'timings')
+  stats = query_timings.get_percentiles(queries[:TIMINGS_QUERIES])
+
+  if request.GET.get('format') == 'json':
+    response = {
+      'percentiles': query_timings.PERCENTILES,
+      'timings': [{'name': name, 'count': count, 'values': values} for name, label, count, values in stats],
+      'result_cache': result_cache.result_cache.get_stats(),
+    }
+    return HttpResponse(json.dumps(response), mimetype="application/json")
+
+  return render("query_timings.mako", request, {
+    'stats': stats,
+    'percentiles': query_timings.PERCENTILES,
+    'counters': [name for name, label in query_timings.COUNTERS],
+    'query_count': TIMINGS_QUERIES,
+    'result_cache_enabled': result_cache.result_cache.is_enabled(),
+    'result_cache_stats': result_cache.result_cache.get_stats(),
+  })
+
+
 """
 Other views
 """
@@ -954,6 +1065,9 @@ def autocomplete(request, database=None, table=None):
   db = dbms.get(request.user, query_server)
   response = {}
 
+  if request.GET.get('refresh'):
+    db.invalidate_cache(database, table)
+
   try:
     if database is None:
       response['databases'] = db.get_databases()
@@ -970,6 +1084,31 @@ def autocomplete(request, database=None, table=None):
   return HttpResponse(json.dumps(response), mimetype="application/json")
 
 
+def autocomplete_schema(request, database='default'):
+  """
+  All the tables of the database and their columns, optionally only the tables
+  starting with the ``prefix`` GET parameter.
+  """
+  app_name = get_app_name(request)
+  query_server = get_query_server_config(app_name)
+  db = dbms.get(request.user, query_server)
+  prefix = request.GET.get('prefix', '')
+  response = {}
+
+  if request.GET.get('refresh'):
+    db.invalidate_cache(database)
+
+  try:
+    schema = db.get_schema(database)
+    response['tables'] = schema.get_table_names(prefix)
+    response['columns'] = schema.get_columns(prefix)
+  except Exception, e:
+    LOG.warn('Autocomplete schema fetching error %s: %s' % (database, e))
+    response['error'] = e.message
+
+  return HttpResponse(json.dumps(response), mimetype="application/json")
+
+
 """
 Utils
 """
@@ -1104,6 +1243,7 @@ def _run_parameterized_query(request, design_id, explain):
         'form': query_form,
         'log': log,
         'autocomplete_base_url': reverse(get_app_name(request) + ':autocomplete', kwargs={}),
+        'autocomplete_schema_base_url': reverse(get_app_name(request) + ':autocomplete_schema', kwargs={}),
       })
   else:
     return render("parameterization.mako", request, dict(form=parameterization_form, design=design, explain=explain))
@@ -1244,21 +1384,52 @@ def _list_designs(querydict, page_size, prefix="", is_trashed=False):
 def _get_query_handle_and_state(query_history):
   """
   Front-end wrapper to handle exceptions. Expects the query to be submitted.
+
+  A query in the admission queue is submitted when it is its turn, the handle
+  is None while it waits.
   """
+  if query_history.is_queued():
+    db = dbms.get(query_history.owner, query_history.get_query_server_config())
+    try:
+      if not db.submit_queued(query_history):
+        return (None, QueryHistory.STATE.submitted)
+    except Exception, ex:
+      LOG.exception(ex)
+      raise PopupException(_("Failed to submit the query to the Query Server."), detail=ex)
+
   handle = query_history.get_handle()
 
   if handle is None:
     raise PopupException(_("Failed to retrieve query state from the Query Server."))
 
+  if query_history.cache_hit:
+    # The results are in the result spool, the server does not know about this query
+    spool = result_spool.get(query_history)
+    if spool is None or not spool.is_complete():
+      # The spool was deleted, the handle is the one of the query which filled the cache
+      return (handle, QueryHistory.STATE.expired)
+    return (handle, QueryHistory.STATE.available)
+
   query_server = query_history.get_query_server_config()
 
+  db = dbms.get(query_history.owner, query_server)
+
   if query_server['server_name'] == 'impala' and not handle.has_result_set:
     state = QueryHistory.STATE.available
   else:
-    state = dbms.get(query_history.owner, query_history.get_query_server_config()).get_state(handle)
+    state = db.get_state(handle)
 
   if state is None:
     raise PopupException(_("Failed to contact Server to check query status."))
+
+  server_state = state
+  if state not in (QueryHistory.STATE.failed, QueryHistory.STATE.expired) and script_runner.has_next_statement(query_history):
+    # Not the last statement: the query goes on, in case of restart of Hue the runner is started again
+    script_runner.script_runner.start(query_history.id)
+    state = QueryHistory.STATE.running
+  query_timings.record_state(query_history, server_state, state)
+  db.invalidate_cache_for_finished(query_history, state)
+
   return (handle, state)
 
 
@@ -1392,8 +1563,7 @@ def _list_query_history(user, querydict, page_size, prefix=""):
 
   # We do slicing ourselves, rather than letting the Paginator handle it, in order to
   # update the last_state on the running queries
-  for history in page.object_list:
-    _update_query_state(history.get_full_object())
+  _update_query_states(page.object_list)
 
   # We need to pass the parameters back to the template to generate links
   keys_to_copy = [ prefix + key for key in ('user', 'type', 'sort', 'design_id', 'auto_query') ]
@@ -1401,26 +1571,95 @@ def _list_query_history(user, querydict, page_size, prefix=""):
 
   return page, filter_params
 
-def _update_query_state(query_history):
+def _update_query_states(query_histories, timeout=STATE_REFRESH_TIMEOUT):
   """
-  Update the last_state for a QueryHistory object. Returns success as True/False.
+  Update the last_state of the QueryHistory objects.
 
   This only occurs iff the current last_state is submitted or running, since the other
   states are stable, more-or-less.
   Note that there is a transition from available/failed to expired. That occurs lazily
   when the user attempts to view results that have expired.
+
+  The states are read concurrently, with one client per owner and query server. The
+  ``timeout`` in seconds is for the whole page: the states not read by then are left as
+  they are. The threads still in a call finish it without starting another one, and at
+  most MAX_STATE_REFRESH_THREADS run in the process: the pages refreshed beyond wait
+  for none. The new states are saved with one update per state.
   """
-  if query_history.last_state <= models.QueryHistory.STATE.running.index:
+  running = [history for history in query_histories
+             if history.last_state <= models.QueryHistory.STATE.running.index and not history.is_queued()]
+  if not running:
+    return
+
+  clients = {}
+  history_clients = {}
+  calls = Queue.Queue()
+  for history in running:
+    history = history.get_full_object()
+    query_server = history.get_query_server_config()
+    key = (history.owner.id, query_server['server_name'], query_server['server_host'], query_server['server_port'])
+    if key not in clients:
+      clients[key] = dbms.get(history.owner, query_server)
+    history_clients[history.id] = clients[key]
+    calls.put((history.id, clients[key], history.get_handle()))
+
+  results = Queue.Queue()
+  timed_out = threading.Event()
+  slots = _state_refresh_threads
+
+  def get_states():
     try:
-      state_enum = dbms.get(query_history.owner, query_history.get_query_server_config()).get_state(query_history.get_handle())
-      if state_enum is None:
-        # Error was logged at the source
-        return False
-    except Exception, e:
-      LOG.error(e)
-      state_enum = models.QueryHistory.STATE.failed
-    query_history.save_state(state_enum)
-  return True
+      while not timed_out.isSet():
+        try:
+          history_id, db, handle = calls.get_nowait()
+        except Queue.Empty:
+          return
+        try:
+          state_enum = db.get_state(handle)
+        except Exception, e:
+          LOG.error(e)
+          state_enum = models.QueryHistory.STATE.failed
+        results.put((history_id, state_enum))
+    finally:
+      # The sessions are read through the ORM
+      connection.close()
+      slots.release()
+
+  started = 0
+  for i in range(min(STATE_REFRESH_THREADS, len(running))):
+    if not slots.acquire(False):
+      LOG.warn('%d threads already read query states' % MAX_STATE_REFRESH_THREADS)
+      break
+    thread = threading.Thread(target=get_states, name='QueryStateRefresh')
+    thread.setDaemon(True)
+    thread.start()
+    started += 1
+  if not started:
+    return
+
+  new_states = {}
+  received = 0
+  end = time.time() + timeout
+  try:
+    while received < len(running):
+      history_id, state_enum = results.get(timeout=max(end - time.time(), 0))
+      received += 1
+      # None: error was logged at the source
+      if state_enum is not None:
+        new_states[history_id] = state_enum.index
+  except Queue.Empty:
+    timed_out.set()
+    LOG.warn('Timed out reading the state of %d queries' % (len(running) - received,))
+
+  updates = {}
+  for history in running:
+    index = new_states.get(history.id)
+    if index is not None and index > history.last_state:
+      history_clients[history.id].invalidate_cache_for_finished(history, models.QueryHistory.STATE[index])
+      history.last_state = index
+      updates.setdefault(index, []).append(history.id)
+  for index, ids in updates.iteritems():
+    models.QueryHistory.objects.filter(id__in=ids).update(last_state=index)
 
 WHITESPACE = re.compile("\s+", re.MULTILINE)
 def collapse_whitespace(s):
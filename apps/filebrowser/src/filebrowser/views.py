@@ -72,6 +72,10 @@ from django.utils.translation import ugettext as _
 DEFAULT_CHUNK_SIZE_BYTES = 1024 * 4 # 4KB
 MAX_CHUNK_SIZE_BYTES = 1024 * 1024 # 1MB
 DOWNLOAD_CHUNK_SIZE = 64 * 1024 * 1024 # 64MB
+# Chunks of the downloads read with a single request, e.g. from WebHdfs
+DOWNLOAD_STREAM_CHUNK_SIZE = 1024 * 1024 # 1MB
+
+RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.IGNORECASE)
 
 # Defaults for "xxd"-style output.
 # Sentences refer to groups of bytes printed together, within a line.
@@ -92,14 +96,70 @@ def index(request):
   return view(request, path)
 
 
-def _file_reader(fh):
-    """Generator that reads a file, chunk-by-chunk."""
-    while True:
-        chunk = fh.read(DOWNLOAD_CHUNK_SIZE)
+def _file_reader(fh, length=None):
+    """Generator that reads a file, chunk-by-chunk, up to ``length`` bytes."""
+    while length is None or length > 0:
+        if length is None:
+            chunk = fh.read(DOWNLOAD_CHUNK_SIZE)
+        else:
+            chunk = fh.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            length -= len(chunk)
         if chunk == '':
-            fh.close()
             break
         yield chunk
+    fh.close()
+
+
+def _get_etag(stats):
+    """Strong validator of a file, changed by any write"""
+    try:
+        mtime = stats['modificationTime']
+    except KeyError:
+        # Filesystems which only give the mtime in seconds
+        mtime = int(stats['mtime'] * 1000)
+    return '"%x-%x"' % (mtime, stats['size'])
+
+
+def _etag_matches(header, etag):
+    """Whether the If-None-Match ``header`` lists ``etag``"""
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def _get_range(request, etag, last_modified, size):
+    """
+    _get_range(request, ...) -> (first byte, last byte) of the requested range, or None
+
+    Only a single range is served. The others, the invalid ones and the ranges of a file
+    which changed since If-Range are ignored, and the whole file is sent. Raises
+    ValueError if the range starts after the end of the file.
+    """
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', ''))
+    if match is None:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range is not None and if_range.strip() not in (etag, last_modified):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix, e.g. 'bytes=-500' are the last 500 bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError(request.META['HTTP_RANGE'])
+        return max(size - int(last), 0), size - 1
+
+    first = int(first)
+    if last:
+        last = int(last)
+        if last < first:
+            return None
+    else:
+        last = size - 1
+    if first >= size:
+        raise ValueError(request.META['HTTP_RANGE'])
+    return first, min(last, size - 1)
 
 
 def download(request, path):
@@ -108,24 +168,65 @@ def download(request, path):
 
     This is inspired by django.views.static.serve.
     """
-    if not request.fs.exists(path):
+    try:
+        stats = request.fs.stats(path)
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
         raise Http404(_("File not found: %(path)s") % {'path': escape(path)})
-    if not request.fs.isfile(path):
+    if stats.isDir:
         raise PopupException(_("'%(path)s' is not a file") % {'path': path})
 
     mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
-    stats = request.fs.stats(path)
     mtime = stats['mtime']
     size = stats['size']
-    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime, size):
-        return HttpResponseNotModified()
-        # TODO(philip): Ideally a with statement would protect from leaks,
-    # but tricky to do here.
-    fh = request.fs.open(path)
+    etag = _get_etag(stats)
+    last_modified = http_date(mtime)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        not_modified = _etag_matches(if_none_match, etag)
+    else:
+        not_modified = not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime, size)
+    if not_modified:
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        response["Last-Modified"] = last_modified
+        return response
+
+    try:
+        byte_range = _get_range(request, etag, last_modified, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = "bytes */%d" % size
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    if byte_range is None:
+        offset, length = 0, size
+    else:
+        offset, length = byte_range[0], byte_range[1] - byte_range[0] + 1
 
-    response = HttpResponse(_file_reader(fh), mimetype=mimetype)
-    response["Last-Modified"] = http_date(stats['mtime'])
-    response["Content-Length"] = stats['size']
+    if hasattr(request.fs, 'read_stream'):
+        # One request for the whole range, closed with the response
+        content = request.fs.read_stream(path, offset, length, chunk_size=DOWNLOAD_STREAM_CHUNK_SIZE)
+    else:
+        # TODO(philip): Ideally a with statement would protect from leaks,
+        # but tricky to do here.
+        fh = request.fs.open(path)
+        if offset:
+            fh.seek(offset)
+        content = _file_reader(fh, length)
+
+    if byte_range is None:
+        response = HttpResponse(content, mimetype=mimetype)
+    else:
+        response = HttpResponse(content, mimetype=mimetype, status=206)
+        response["Content-Range"] = "bytes %d-%d/%d" % (byte_range[0], byte_range[1], size)
+    response["Last-Modified"] = last_modified
+    response["ETag"] = etag
+    response["Accept-Ranges"] = "bytes"
+    response["Content-Length"] = length
     response["Content-Disposition"] = "attachment"
     return response
 
@@ -37,10 +37,11 @@ from nose.tools import assert_true, assert_false, assert_equal, assert_not_equal
 from desktop.lib.django_test_util import make_logged_in_client
 from desktop.lib.test_utils import grant_access
 from hadoop import pseudo_hdfs4
+from hadoop.fs.webhdfs_types import WebHdfsStat
 
 from conf import MAX_SNAPPY_DECOMPRESSION_SIZE
 from lib.rwx import expand_mode
-from views import snappy_installed
+from views import snappy_installed, _get_etag
 
 
 LOG = logging.getLogger(__name__)
@@ -803,6 +804,93 @@ def test_view_i18n():
       LOG.error('Failed to cleanup test directory: %s' % (ex,))
 
 
+@attr('requires_hadoop')
+def test_download():
+  cluster = pseudo_hdfs4.shared_cluster()
+  try:
+    c = make_logged_in_client()
+    cluster.fs.setuser(cluster.superuser)
+    cluster.fs.mkdir('/test-download-filebrowser/')
+
+    data = 'hello world\n' * 100000
+    f = cluster.fs.open('/test-download-filebrowser/test-download.txt', 'w')
+    f.write(data)
+    f.close()
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt')
+    assert_equal(200, response.status_code)
+    assert_equal(str(len(data)), response['Content-Length'])
+    assert_equal('attachment', response['Content-Disposition'])
+    assert_equal(data, response.content)
+
+    assert_equal('bytes', response['Accept-Ranges'])
+    etag = response['ETag']
+    last_modified = response['Last-Modified']
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert_equal(304, response.status_code)
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_IF_NONE_MATCH=etag)
+    assert_equal(304, response.status_code)
+    assert_equal(etag, response['ETag'])
+
+    # Ranges
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_RANGE='bytes=6-10')
+    assert_equal(206, response.status_code)
+    assert_equal('bytes 6-10/%d' % len(data), response['Content-Range'])
+    assert_equal('5', response['Content-Length'])
+    assert_equal('world', response.content)
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_RANGE='bytes=%d-' % (len(data) - 12), HTTP_IF_RANGE=etag)
+    assert_equal(206, response.status_code)
+    assert_equal('hello world\n', response.content)
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_RANGE='bytes=-6', HTTP_IF_RANGE=last_modified)
+    assert_equal(206, response.status_code)
+    assert_equal('world\n', response.content)
+
+    # The file changed since If-Range
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_RANGE='bytes=6-10', HTTP_IF_RANGE='"0-0"')
+    assert_equal(200, response.status_code)
+    assert_equal(data, response.content)
+
+    # Several ranges are not served
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_RANGE='bytes=0-4,6-10')
+    assert_equal(200, response.status_code)
+    assert_equal(data, response.content)
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/test-download.txt',
+                     HTTP_RANGE='bytes=%d-' % len(data))
+    assert_equal(416, response.status_code)
+    assert_equal('bytes */%d' % len(data), response['Content-Range'])
+
+    response = c.get('/filebrowser/download/test-download-filebrowser/does-not-exist.txt')
+    assert_equal(404, response.status_code)
+  finally:
+    try:
+      cluster.fs.rmtree('/test-download-filebrowser/')
+    except:
+      pass      # Don't let cleanup errors mask earlier failures
+
+
+def test_get_etag():
+  def make_stat(modification_time):
+    return WebHdfsStat({'pathSuffix': 'f', 'type': 'FILE', 'accessTime': 0, 'modificationTime': modification_time,
+                        'owner': 'test', 'group': 'test', 'length': 10, 'blockSize': 0, 'replication': 3,
+                        'permission': '644'}, '/tmp')
+
+  # Written twice within the same second
+  assert_not_equal(_get_etag(make_stat(1370000000100)), _get_etag(make_stat(1370000000900)))
+  assert_equal(_get_etag(make_stat(1370000000000)), _get_etag({'mtime': 1370000000, 'size': 10}))
+
+
 @attr('requires_hadoop')
 def test_view_access():
   cluster = pseudo_hdfs4.shared_cluster()
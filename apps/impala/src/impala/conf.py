@@ -42,3 +42,25 @@ IMPALA_PRINCIPAL=Config(
   help=_("Kerberos principal name for Impala. Typically 'impala/hostname.foo.com'."),
   type=str,
   default="impala/%s" % socket.getfqdn())
+
+SERVER_CONN_POOL_SIZE = Config(
+  key='server_conn_pool_size',
+  help=_("Number of connections to the Impala server. 0 uses the size of [desktop] [[thrift_pool]]."),
+  type=int,
+  default=0)
+
+MAX_CONCURRENT_QUERIES = Config(
+  key='max_concurrent_queries',
+  help=_("Maximum number of queries sent by Hue running at the same time on the Impala server. "
+         "The next ones wait in a queue. 0 is unlimited. The running queries of all the Hue "
+         "processes are counted, but each process admits the queries of its own queue in their order."),
+  type=int,
+  default=0)
+
+MAX_CONCURRENT_QUERIES_PER_USER = Config(
+  key='max_concurrent_queries_per_user',
+  help=_("Maximum number of queries of a user running at the same time on the Impala server. "
+         "The next ones wait in a queue without holding back the queries of the other users. 0 is unlimited. "
+         "The running queries of all the Hue processes are counted, but each process has its own queue."),
+  type=int,
+  default=0)
@@ -52,6 +52,7 @@ class ImpalaServerClient:
                                           service_name='Impala',
                                           kerberos_principal=kerberos_principal_short_name,
                                           use_sasl=use_sasl,
-                                          timeout_seconds=conf.BEESWAX_SERVER_CONN_TIMEOUT.get())
+                                          timeout_seconds=conf.BEESWAX_SERVER_CONN_TIMEOUT.get(),
+                                          pool_size=query_server.get('pool_size'))
   def resetCatalog(self):
     return self._client.ResetCatalog()
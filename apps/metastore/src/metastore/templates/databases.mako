@@ -31,6 +31,7 @@ ${ commonheader(_('Databases'), 'metastore', user) | n,unicode }
             <div class="well sidebar-nav">
                 <ul class="nav nav-list">
                     <li><a href="${ url('beeswax:create_database') }">${_('Create a new database')}</a></li>
+                    <li><a href="${ url('metastore:databases') }?refresh=true">${_('Refresh')}</a></li>
                 </ul>
             </div>
         </div>
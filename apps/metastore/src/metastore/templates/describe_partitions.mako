@@ -16,6 +16,7 @@
 <%!
   from filebrowser.views import location_to_url
   from desktop.views import commonheader, commonfooter
+  from django.utils.http import urlencode
   from django.utils.translation import ugettext as _
 %>
 
@@ -38,6 +39,15 @@ ${ commonheader(_('Table Partitions: %(tableName)s') % dict(tableName=table.name
       </div>
     </div>
     <div class="span10">
+      <div class="well">
+        <form class="form-search" method="GET">
+          <input type="text" name="filter" class="input-xlarge search-query" value="${ partition_filter }"
+                 placeholder="${ ', '.join(['%s=...' % field.name for field in table.partition_keys]) }">
+          <input type="hidden" name="sort" value="${ sort }">
+          <input type="hidden" name="count" value="${ count }">
+          <button type="submit" class="btn">${_('Filter')}</button>
+        </form>
+      </div>
       <table class="table table-striped table-condensed datatables">
           % if partitions:
           <tr>
@@ -46,10 +56,11 @@ ${ commonheader(_('Table Partitions: %(tableName)s') % dict(tableName=table.name
           % endfor
             <th>${_('Path')}</th>
           </tr>
-          % for partition_id, partition in enumerate(partitions):
+          % for name, partition in partitions:
             <tr>
+            <% read_url = url('metastore:read_partition_by_name', database=database, table=table.name) + '?' + urlencode({'name': name}) %>
             % for idx, key in enumerate(partition.values):
-                <td><a href="${ url('metastore:read_partition', database=database, table=table.name, partition_id=partition_id) }" data-row-selector="true">${key}</a></td>
+                <td><a href="${ read_url }" data-row-selector="true">${key}</a></td>
             % endfor
             <% location = location_to_url(partition.sd.location) %>
             % if url:
@@ -63,10 +74,21 @@ ${ commonheader(_('Table Partitions: %(tableName)s') % dict(tableName=table.name
             % endif
             </tr>
           % endfor
+          % elif partition_filter or first:
+            <tr><td>${_('No matching partitions.')}</td></tr>
           % else:
             <tr><td>${_('Table has no partitions.')}</td></tr>
           % endif
       </table>
+      <ul class="pager">
+        % if previous_params:
+        <li class="previous"><a href="?${ previous_params }">${_('Previous')}</a></li>
+        % endif
+        <li><a href="?${ sort_params }">${ sort == 'asc' and _('Sort descending') or _('Sort ascending') }</a></li>
+        % if next_params:
+        <li class="next"><a href="?${ next_params }">${_('Next')}</a></li>
+        % endif
+      </ul>
     </div>
   </div>
 </div>
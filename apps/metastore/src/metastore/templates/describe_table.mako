@@ -64,8 +64,9 @@ ${ commonheader(_("%s : %s") % (view_or_table_noun, table.name), app_name, user)
                     <li><a href="${ url('metastore:read_table', database=database, table=table.name) }">${_('Browse Data')}</a></li>
                     <li><a href="#dropTable" data-toggle="modal">${_('Drop')} ${view_or_table_noun}</a></li>
                     <li><a href="${ table.hdfs_link }" rel="${ table.path_location }">${_('View File Location')}</a></li>
+                    <li><a href="${ url('metastore:describe_table', database=database, table=table.name) }?refresh=true">${_('Refresh')}</a></li>
                     % if table.partition_keys:
-                      <li><a href="${ url('metastore:describe_partitions', database=database, table=table.name) }">${_('Show Partitions')} (${ len(partitions) })</a></li>
+                      <li><a href="${ url('metastore:describe_partitions', database=database, table=table.name) }">${_('Show Partitions')} (${ partition_count })</a></li>
                     % endif
                 </ul>
             </div>
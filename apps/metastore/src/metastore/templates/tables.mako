@@ -40,6 +40,7 @@ ${ commonheader(_('Tables'), 'metastore', user) | n,unicode }
                     <li class="nav-header">${_('Actions')}</li>
                     <li><a href="${ url('beeswax:import_wizard', database=database) }">${_('Create a new table from a file')}</a></li>
                     <li><a href="${ url('beeswax:create_table', database=database) }">${_('Create a new table manually')}</a></li>
+                    <li><a href="${ url('metastore:show_tables', database=database) }?refresh=true">${_('Refresh')}</a></li>
                 </ul>
             </div>
         </div>
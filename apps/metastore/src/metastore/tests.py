@@ -16,6 +16,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+try:
+  import json
+except ImportError:
+  import simplejson as json
 import logging
 
 from nose.tools import assert_true, assert_equal, assert_false
@@ -126,6 +130,29 @@ class TestMetastoreWithHadoop(BeeswaxSampleProvider):
     response = self.client.get("/metastore/table/default/test/partitions", follow=True)
     assert_true("is not partitioned." in response.content)
 
+  def test_describe_partitions_json(self):
+    response = self.client.get("/metastore/table/default/test_partitions/partitions", {'format': 'json'})
+    content = json.loads(response.content)
+    assert_equal(['baz=baz_one/boom=boom_two'], [partition['name'] for partition in content['partitions']])
+    assert_equal([['baz_one', 'boom_two']], [partition['values'] for partition in content['partitions']])
+    assert_false(content['has_more'])
+
+    # The filter is applied by the server
+    response = self.client.get("/metastore/table/default/test_partitions/partitions", {'format': 'json', 'filter': "baz='baz_one'"})
+    assert_equal(1, len(json.loads(response.content)['partitions']))
+    response = self.client.get("/metastore/table/default/test_partitions/partitions", {'format': 'json', 'filter': 'boom=boom_one'})
+    assert_equal([], json.loads(response.content)['partitions'])
+    response = self.client.get("/metastore/table/default/test_partitions/partitions", {'filter': 'foo=1'})
+    assert_true("is not a partition key of the table." in response.content, response.content)
+
+    # Pages after the last one are empty
+    response = self.client.get("/metastore/table/default/test_partitions/partitions", {'format': 'json', 'first': 1})
+    assert_equal([], json.loads(response.content)['partitions'])
+
+    response = self.client.get(json.loads(self.client.get("/metastore/table/default/test_partitions/partitions",
+                                                          {'format': 'json'}).content)['partitions'][0]['read_url'])
+    assert_equal(302, response.status_code)
+
   def test_browse_partitions_with_limit(self):
     # Limit to 90
     finish = BROWSE_PARTITIONED_TABLE_LIMIT.set_for_testing("90")
@@ -24,6 +24,7 @@ import logging
 from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.utils.translation import ugettext as _
+from django.utils.http import urlencode
 from django.core.urlresolvers import reverse
 
 from desktop.lib.django_util import render
@@ -36,6 +37,8 @@ from metastore.forms import LoadDataForm, DbForm
 
 LOG = logging.getLogger(__name__)
 SAVE_RESULTS_CTAS_TIMEOUT = 300         # seconds
+PARTITION_COUNT_LIMIT = 1000            # Partitions counted on the table page
+MAX_PARTITION_PAGE_SIZE = 1000
 
 
 def index(request):
@@ -48,6 +51,8 @@ Database Views
 
 def databases(request):
   db = dbms.get(request.user)
+  if request.GET.get('refresh'):
+    db.invalidate_cache()
   databases = db.get_databases()
 
   return render("databases.mako", request, {
@@ -97,6 +102,9 @@ def show_tables(request, database=None):
   else:
     db_form = DbForm(initial={'database': database}, databases=databases)
 
+  if request.GET.get('refresh'):
+    db.invalidate_cache(database)
+
   tables = db.get_tables(database=database)
 
   resp = render("tables.mako", request, {
@@ -120,10 +128,14 @@ def describe_table(request, database, table):
   error_message = ''
   table_data = ''
 
+  if request.GET.get('refresh'):
+    db.invalidate_cache(database, table)
   table = db.get_table(database, table)
-  partitions = None
+  partition_count = None
   if table.partition_keys:
-    partitions = db.get_partitions(database, table, max_parts=None)
+    partition_count = len(db.get_partition_names(database, table, max_parts=PARTITION_COUNT_LIMIT + 1))
+    if partition_count > PARTITION_COUNT_LIMIT:
+      partition_count = '%d+' % PARTITION_COUNT_LIMIT
 
   try:
     table_data = db.get_sample(database, table)
@@ -140,7 +152,7 @@ def describe_table(request, database, table):
       },
     ],
     'table': table,
-    'partitions': partitions,
+    'partition_count': partition_count,
     'sample': table_data and table_data.rows(),
     'error_message': error_message,
     'database': database,
@@ -191,6 +203,17 @@ def read_partition(request, database, table, partition_id):
     raise PopupException(_('Cannot read table'), detail=e)
 
 
+def read_partition_by_name(request, database, table):
+  db = dbms.get(request.user)
+  try:
+    table_obj = db.get_table(database, table)
+    query_history = db.read_partition(database, table_obj, request.GET.get('name', ''))
+    url = reverse('beeswax:watch_query', args=[query_history.id]) + '?context=table:%s:%s' % (table, database)
+    return redirect(url)
+  except Exception, e:
+    raise PopupException(_('Cannot read table'), detail=e)
+
+
 def load_table(request, database, table):
   db = dbms.get(request.user)
   table = db.get_table(database, table)
@@ -225,15 +248,59 @@ def load_table(request, database, table):
   return HttpResponse(json.dumps(response), mimetype="application/json")
 
 
+def _parse_partition_spec(table, text):
+  """'year=2013, month=01' -> {'year': '2013', 'month': '01'}, the keys must be partition keys"""
+  partition_keys = [key.name for key in table.partition_keys]
+  spec = {}
+  for part in text.split(','):
+    if not part.strip():
+      continue
+    if '=' not in part:
+      raise ValueError(_("Invalid partition filter '%(filter)s', expected: key=value, ...") % {'filter': part.strip()})
+    key, value = [token.strip() for token in part.split('=', 1)]
+    if key not in partition_keys:
+      raise ValueError(_("'%(key)s' is not a partition key of the table.") % {'key': key})
+    spec[key] = value.strip('\'"')
+  return spec
+
+
 def describe_partitions(request, database, table):
+  """
+  One page of the partitions of the table, sorted by name. GET parameters: ``filter``, a partial
+  partition spec applied by the server, ``first``, ``count``, ``sort`` (asc or desc) and ``format``.
+  """
   db = dbms.get(request.user)
 
   table_obj = db.get_table(database, table)
   if not table_obj.partition_keys:
     raise PopupException(_("Table '%(table)s' is not partitioned.") % {'table': table})
 
-  partitions = db.get_partitions(database, table_obj, max_parts=None)
-
+  partition_filter = request.GET.get('filter', '')
+  try:
+    partition_spec = _parse_partition_spec(table_obj, partition_filter)
+    first = max(int(request.GET.get('first', 0)), 0)
+    count = min(max(int(request.GET.get('count', dbms.PARTITION_PAGE_SIZE)), 1), MAX_PARTITION_PAGE_SIZE)
+  except ValueError, e:
+    raise PopupException(_('Invalid parameters'), detail=e)
+  sort = request.GET.get('sort') == 'desc' and 'desc' or 'asc'
+
+  partitions, has_more = db.get_partitions_page(database, table_obj, partition_spec, first, count, reverse=sort == 'desc')
+
+  if request.GET.get('format') == 'json':
+    return HttpResponse(json.dumps({
+      'partitions': [{
+          'name': name,
+          'values': partition.values,
+          'location': partition.sd.location,
+          'read_url': reverse('metastore:read_partition_by_name', kwargs={'database': database, 'table': table}) + '?' + urlencode({'name': name})
+        } for name, partition in partitions],
+      'first': first,
+      'count': count,
+      'sort': sort,
+      'has_more': has_more
+    }), mimetype="application/json")
+
+  page_params = {'filter': partition_filter, 'count': count, 'sort': sort}
   return render("describe_partitions.mako", request,
       {'breadcrumbs': [
         {
@@ -249,4 +316,8 @@ def describe_partitions(request, database, table):
           'url': reverse('metastore:describe_partitions', kwargs={'database': database, 'table': table})
         },
       ],
-      'database': database, 'table': table_obj, 'partitions': partitions, 'request': request})
+      'database': database, 'table': table_obj, 'partitions': partitions, 'request': request,
+      'partition_filter': partition_filter, 'sort': sort, 'first': first, 'count': count, 'has_more': has_more,
+      'previous_params': first > 0 and urlencode(dict(page_params, first=max(first - count, 0))),
+      'next_params': has_more and urlencode(dict(page_params, first=first + count)),
+      'sort_params': urlencode(dict(page_params, sort=sort == 'asc' and 'desc' or 'asc'))})
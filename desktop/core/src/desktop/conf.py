@@ -219,6 +219,58 @@ KERBEROS = ConfigSection(
   )
 )
 
+THRIFT_POOL = ConfigSection(
+  key="thrift_pool",
+  help=_("""Connections of Hue to the Thrift services, e.g. HiveServer2, Impala,
+          the JobTracker and the NameNode plugins."""),
+  members=dict(
+    SIZE=Config(
+      key='size',
+      help=_("Number of connections to each service, unless configured by the service."),
+      type=int,
+      default=10),
+    IDLE_TIMEOUT=Config(
+      key='idle_timeout',
+      help=_("Seconds after which an unused connection is closed. 0 to never close them."),
+      type=int,
+      default=60 * 5),
+    MAX_LIFETIME=Config(
+      key='max_lifetime',
+      help=_("Seconds after which a connection is recycled, even if used. 0 to never recycle them."),
+      type=int,
+      default=60 * 60),
+    VALIDATE_AFTER=Config(
+      key='validate_after',
+      help=_("Seconds of idleness after which a connection is checked for a close by the service before being used."),
+      type=int,
+      default=1),
+    ACCELERATED_PROTOCOL=Config(
+      key='accelerated_protocol',
+      help=_("Decode and encode the Thrift messages with the fastbinary C extension when it is installed."),
+      type=coerce_bool,
+      default=True),
+  )
+)
+
+HTTP_POOL = ConfigSection(
+  key="http_pool",
+  help=_("""Persistent connections of Hue to the REST APIs, e.g. WebHdfs, HttpFs, Oozie
+          and the YARN servers."""),
+  members=dict(
+    SIZE=Config(
+      key='size',
+      help=_("Number of idle connections kept to each host. The requests made while they are all "
+             "used open connections which are closed after them. 0 to never keep connections."),
+      type=int,
+      default=10),
+    IDLE_TIMEOUT=Config(
+      key='idle_timeout',
+      help=_("Seconds after which an unused connection is closed. Most servers close them sooner."),
+      type=int,
+      default=30),
+  )
+)
+
 # See python's documentation for time.tzset for valid values.
 TIME_ZONE = Config(
   key="time_zone",
@@ -234,6 +286,13 @@ DEFAULT_SITE_ENCODING = Config(
   default='utf-8'
 )
 
+DOWNLOAD_COMPRESSION_LEVEL = Config(
+  key='download_compression_level',
+  help=_('Level of the gzip compression of the exported data, from 1 (fastest) to 9 (smallest). 0 disables the compression.'),
+  type=int,
+  default=6
+)
+
 SERVER_USER = Config(
   key="server_user",
   help=_("Username to run servers as."),
@@ -15,21 +15,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """
-Common library to export either CSV or XLS.
+Common library to export either CSV, XLS or XLSX.
 """
 import cStringIO
 import csv
 import logging
+import re
+import struct
+import time
+import types
+import zlib
 
 from django.http import HttpResponse
 from django.utils.encoding import smart_str
+from desktop import conf
 from desktop.lib import i18n
 
 LOG = logging.getLogger(__name__)
 XLS_SIZE_LIMIT = 200 * 1024 * 1024      # 200MB
+BATCH_ROWS = 1000                       # Rows formatted at once
+BUFFER_SIZE = 64 * 1024                 # Size of the chunks sent to the client
 
 class TooBigToDownloadException(Exception):
-  pass
+  partial = ''          # What format_rows() formatted before the limit
 
 class Formatter(object):
   """
@@ -59,6 +67,23 @@ class Formatter(object):
     """
     raise NotImplementedError()
 
+  def format_rows(self, rows):
+    """
+    format_rows(rows) -> lines
+    rows should be a list of rows
+
+    Formats a batch of rows at once. When a row raises TooBigToDownloadException,
+    the rows formatted before it are in the ``partial`` of the exception.
+    """
+    lines = []
+    try:
+      for row in rows:
+        lines.append(self.format_row(row))
+    except TooBigToDownloadException, ex:
+      ex.partial = ''.join(lines)
+      raise
+    return ''.join(lines)
+
   def fini_doc(self):
     """
     fini_doc() -> final data to appear after all rows
@@ -77,25 +102,150 @@ def _force_string(x):
   else:
     return str(x)
 
+_STRING_TYPES = frozenset([str, unicode])
+
+def _force_strings(row):
+  """Same as map(_force_string, row), without looking at each cell when they are all strings"""
+  if _STRING_TYPES.issuperset(map(type, row)):
+    return row
+  return map(_force_string, row)
+
+def batches(data, size=BATCH_ROWS):
+  """
+  batches(data, size) -> generator of lists of at most ``size`` items of ``data``
+  """
+  batch = []
+  for datum in data:
+    batch.append(datum)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def buffered(chunks, size=BUFFER_SIZE):
+  """
+  buffered(chunks, size) -> generator of strings
+
+  Joins the small chunks into strings of about ``size`` bytes, so that the
+  response is not written to the client a few bytes at a time.
+  """
+  buf = []
+  buf_size = 0
+  for chunk in chunks:
+    buf.append(chunk)
+    buf_size += len(chunk)
+    if buf_size >= size:
+      yield ''.join(buf)
+      buf = []
+      buf_size = 0
+  if buf:
+    yield ''.join(buf)
+
+def gzipped(chunks, level=None):
+  """
+  gzipped(chunks, level) -> generator of strings
+
+  Compresses the chunks into a gzip stream as they come. The compressor is
+  flushed after each chunk, so that the client receives a chunk as soon as
+  it is produced.
+  """
+  if level is None:
+    level = conf.DOWNLOAD_COMPRESSION_LEVEL.get()
+  compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+  crc = 0
+  size = 0
+
+  # Header: magic, deflate method, no flags, modification time, no extra flags, unknown OS
+  yield struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0, int(time.time()), 0, 255)
+  for chunk in chunks:
+    if chunk:
+      crc = zlib.crc32(chunk, crc)
+      size += len(chunk)
+      yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+  yield compressor.flush() + struct.pack('<II', crc & 0xffffffff, size & 0xffffffff)
+
+GZIP_ENCODING = 'gzip'                  # Compressed on the wire, saved uncompressed by the browser
+GZIP_FILE = 'gz'                        # Saved as a .gz file
+
+def accepts_encoding(request, encoding):
+  """True when the Accept-Encoding header of the request allows ``encoding`` with a q-value above 0"""
+  accepted = {}
+  for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+    params = item.split(';')
+    coding = params[0].strip().lower()
+    if not coding:
+      continue
+    quality = 1.0
+    for param in params[1:]:
+      name, sep, value = param.partition('=')
+      if name.strip().lower() == 'q':
+        try:
+          quality = float(value)
+        except ValueError:
+          quality = 0.0
+    accepted[coding] = quality
+  return accepted.get(encoding, accepted.get('*', 0.0)) > 0
+
+def get_compression(request):
+  """
+  get_compression(request) -> GZIP_FILE, GZIP_ENCODING or None
+
+  Compression is only used when asked with the ``compress`` parameter: ``compress=gz`` sends
+  a gzip file, ``compress=gzip`` compresses the data on the wire if the client accepts it.
+  """
+  if conf.DOWNLOAD_COMPRESSION_LEVEL.get() <= 0:
+    return None
+  compress = request.GET.get('compress')
+  if compress == GZIP_FILE:
+    return GZIP_FILE
+  if compress == GZIP_ENCODING and accepts_encoding(request, GZIP_ENCODING):
+    return GZIP_ENCODING
+  return None
+
+def make_streaming_response(content, mimetype, filename, compression=None):
+  """
+  make_streaming_response(content, mimetype, filename, compression) -> HttpResponse
+
+  @param content An iterator of strings
+  @param compression None, GZIP_ENCODING or GZIP_FILE
+  """
+  content = buffered(content)
+  if compression == GZIP_FILE:
+    content = gzipped(content)
+    mimetype = 'application/x-gzip'
+    filename = '%s.gz' % (filename,)
+  elif compression == GZIP_ENCODING:
+    content = gzipped(content)
+
+  resp = HttpResponse(content, mimetype=mimetype)
+  resp['Content-Disposition'] = 'attachment; filename=%s' % (filename,)
+  if compression == GZIP_ENCODING:
+    resp['Content-Encoding'] = 'gzip'
+    resp['Vary'] = 'Accept-Encoding'
+  return resp
+
 def generator(header, data, formatter):
   yield formatter.init_doc()
   yield formatter.format_header(header)
-  for datum in data:
+  for rows in batches(data):
     try:
-      yield formatter.format_row(map(_force_string, datum))
+      yield formatter.format_rows([_force_strings(datum) for datum in rows])
     except TooBigToDownloadException, ex:
-      # Truncate the results
-      LOG.exception(ex)
-      pass
+      # Truncate the results, the next rows would not fit either
+      LOG.warn(ex)
+      yield ex.partial
+      break
   yield formatter.fini_doc()
 
-def make_response(header, data, format, name, encoding=None):
+def make_response(header, data, format, name, encoding=None, compression=None):
   """
   @param header List of strings to form the header
   @param data An iterator of rows, where every row is a list of strings
-  @param format Either "csv" or "xls"
+  @param format Either "csv", "xls" or "xlsx"
   @param name Base name for output file
   @param encoding Unicode encoding for data
+  @param compression None, GZIP_ENCODING or GZIP_FILE
   """
   if format == 'csv':
     formatter = CSVformatter(encoding)
@@ -103,21 +253,26 @@ def make_response(header, data, format, name, encoding=None):
   elif format == 'xls':
     formatter = CSVformatter(encoding)
     mimetype = 'application/xls'
+  elif format == 'xlsx':
+    formatter = XLSXformatter(encoding)
+    mimetype = XLSX_MIMETYPE
+    compression = None                  # Already compressed
   else:
     raise Exception("Unknown format: %s" % (format,))
 
-  resp = HttpResponse(generator(header, data, formatter), mimetype=mimetype)
-  resp['Content-Disposition'] = 'attachment; filename=%s.%s' % (name, format)
-  return resp
+  return make_streaming_response(generator(header, data, formatter), mimetype, '%s.%s' % (name, format), compression)
 
 class CSVformatter(Formatter):
   def __init__(self, encoding=None):
     super(CSVformatter, self).__init__()
     dialect = csv.excel()
     dialect.quoting = csv.QUOTE_ALL
+    self._dialect = dialect
     self._encoding = encoding or i18n.get_site_encoding()
     self._csv_writer = csv.writer(self, dialect=dialect)
     self._line = None
+    self._row_types = None
+    self._encoders = []
 
   def write(self, line):
     self._line = line
@@ -134,5 +289,207 @@ class CSVformatter(Formatter):
     self._csv_writer.writerow(row)
     return self._line
 
+  def format_rows(self, rows):
+    """
+    Same output as format_row() on each row. The cells are encoded by the encoders
+    of the types of the row, which are only looked up again when the types change.
+    """
+    buf = cStringIO.StringIO()
+    writer = csv.writer(buf, dialect=self._dialect)
+    for row in rows:
+      row_types = map(type, row)
+      if row_types != self._row_types:
+        self._row_types = row_types
+        self._encoders = [(i, encoder) for i, encoder in enumerate(map(self._get_encoder, row_types))
+                          if encoder is not None]
+      if self._encoders:
+        row = list(row)
+        for i, encoder in self._encoders:
+          row[i] = encoder(row[i])
+      writer.writerow(row)
+    return buf.getvalue()
+
+  def _get_encoder(self, cell_type):
+    """Function doing what smart_str does to the values of this type, or None when they are written as is"""
+    if issubclass(cell_type, (types.NoneType, int)):
+      return None
+    elif cell_type is str:
+      if self._encoding == 'utf-8':
+        return None
+    elif cell_type is unicode:
+      encoding = self._encoding
+      return lambda cell: cell.encode(encoding, 'replace')
+    elif cell_type in (long, float):
+      return str
+    encoding = self._encoding
+    return lambda cell: smart_str(cell, encoding, strings_only=True, errors='replace')
+
   def fini_doc(self):
     return ""
+
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+class _ZipStream(object):
+  """
+  Writes a zip archive sequentially, without ever seeking back.
+
+  Each entry is deflated on the fly. Its CRC and sizes follow the data in a
+  data descriptor, and the central directory is written at the end. Zip64 is
+  not supported, which limits the archive to 4GB.
+  """
+  def __init__(self, level=6):
+    self._level = level
+    self._offset = 0
+    self._entries = []
+    self._entry = None
+
+  def _emit(self, data):
+    self._offset += len(data)
+    return data
+
+  def start_entry(self, name):
+    now = time.localtime()
+    dos_time = now[3] << 11 | now[4] << 5 | now[5] / 2
+    dos_date = (now[0] - 1980) << 9 | now[1] << 5 | now[2]
+    self._entry = {
+      'name': name, 'time': dos_time, 'date': dos_date, 'offset': self._offset,
+      'crc': 0, 'size': 0, 'compressed_size': 0,
+      'compressor': zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS),
+    }
+    header = struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x08, 8, dos_time, dos_date, 0, 0, 0, len(name), 0)
+    return self._emit(header + name)
+
+  def write(self, data):
+    entry = self._entry
+    entry['crc'] = zlib.crc32(data, entry['crc'])
+    entry['size'] += len(data)
+    compressed = entry['compressor'].compress(data)
+    entry['compressed_size'] += len(compressed)
+    return self._emit(compressed)
+
+  def end_entry(self):
+    entry = self._entry
+    compressed = entry['compressor'].flush()
+    entry['compressed_size'] += len(compressed)
+    entry['crc'] &= 0xffffffff
+    del entry['compressor']
+    self._entries.append(entry)
+    self._entry = None
+    descriptor = struct.pack('<IIII', 0x08074b50, entry['crc'], entry['compressed_size'], entry['size'])
+    return self._emit(compressed + descriptor)
+
+  def add_entry(self, name, data):
+    return self.start_entry(name) + self.write(data) + self.end_entry()
+
+  def close(self):
+    start = self._offset
+    directory = []
+    for entry in self._entries:
+      directory.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x08, 8, entry['time'], entry['date'],
+                                   entry['crc'], entry['compressed_size'], entry['size'], len(entry['name']),
+                                   0, 0, 0, 0, 0, entry['offset']))
+      directory.append(entry['name'])
+    directory = ''.join(directory)
+    end = struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self._entries), len(self._entries), len(directory), start, 0)
+    return self._emit(directory + end)
+
+
+_XLSX_STATIC_PARTS = [
+  ('[Content_Types].xml',
+   '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+   '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+   '<Default Extension="xml" ContentType="application/xml"/>'
+   '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+   '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+   '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+   '</Types>'),
+  ('_rels/.rels',
+   '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+   '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+   '</Relationships>'),
+  ('xl/workbook.xml',
+   '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+   '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+   'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+   '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+   '</workbook>'),
+  ('xl/_rels/workbook.xml.rels',
+   '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+   '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+   '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+   '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+   '</Relationships>'),
+  ('xl/styles.xml',
+   '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+   '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+   '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+   '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+   '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+   '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+   '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+   '</styleSheet>'),
+]
+
+# Characters not allowed in XML 1.0
+_XML_INVALID_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+class XLSXformatter(Formatter):
+  """
+  Streams a single sheet Office Open XML workbook.
+
+  Strings are written inline in the cells instead of in a shared strings table,
+  so that the memory used does not depend on the number of rows.
+  """
+  MAX_ROWS = 1048576                    # Limit of a sheet
+
+  def __init__(self, encoding=None):
+    super(XLSXformatter, self).__init__()
+    self._encoding = encoding or i18n.get_site_encoding()
+    self._zip = _ZipStream()
+    self._row_count = 0
+
+  def init_doc(self):
+    parts = [self._zip.add_entry(name, data) for name, data in _XLSX_STATIC_PARTS]
+    parts.append(self._zip.start_entry('xl/worksheets/sheet1.xml'))
+    parts.append(self._zip.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                                 '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                                 '<sheetData>'))
+    return ''.join(parts)
+
+  def format_header(self, header):
+    return self.format_row(header)
+
+  def format_row(self, row):
+    if self._row_count >= XLSXformatter.MAX_ROWS:
+      raise TooBigToDownloadException('A sheet is limited to %d rows' % XLSXformatter.MAX_ROWS)
+    self._row_count += 1
+
+    cells = ['<row>']
+    for cell in row:
+      cells.append(self._format_cell(cell))
+    cells.append('</row>')
+    return self._zip.write(''.join(cells))
+
+  def _format_cell(self, cell):
+    if cell is None:
+      return '<c/>'
+    elif isinstance(cell, bool):
+      return '<c t="b"><v>%d</v></c>' % cell
+    elif isinstance(cell, (int, long)):
+      return '<c><v>%d</v></c>' % cell
+    elif isinstance(cell, float) and cell - cell == 0: # Not NaN nor infinite
+      return '<c><v>%r</v></c>' % cell
+
+    if isinstance(cell, str):
+      cell = cell.decode(self._encoding, 'replace')
+    elif not isinstance(cell, unicode):
+      cell = unicode(cell)
+    cell = _XML_INVALID_CHARS.sub(u'', cell)
+    cell = cell.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;')
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % cell.encode('utf-8')
+
+  def fini_doc(self):
+    return self._zip.write('</sheetData></worksheet>') + self._zip.end_entry() + self._zip.close()
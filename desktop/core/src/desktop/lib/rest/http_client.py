@@ -23,6 +23,8 @@ import urllib2
 
 from urllib2_kerberos import HTTPKerberosAuthHandler
 
+from desktop.lib.rest import http_pool
+
 __docformat__ = "epytext"
 
 LOG = logging.getLogger(__name__)
@@ -85,9 +87,9 @@ class HttpClient(object):
     # Make a cookie processor
     cookiejar = cookielib.CookieJar()
 
-    self._opener = urllib2.build_opener(
-        HTTPErrorProcessor(),
-        urllib2.HTTPCookieProcessor(cookiejar))
+    # The connections are kept alive in the pool shared by the clients
+    handlers = [HTTPErrorProcessor(), urllib2.HTTPCookieProcessor(cookiejar)] + http_pool.get_handlers()
+    self._opener = urllib2.build_opener(*handlers)
 
 
   def set_basic_auth(self, username, password, realm):
@@ -14,11 +14,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from urllib2 import HTTPError, URLError
+import BaseHTTPServer
+import SocketServer
+import httplib
+import socket
+import threading
+import time
 
-from nose.tools import assert_equal
+from urllib2 import HTTPError, Request, URLError
 
-from desktop.lib.rest.http_client import RestException
+from nose.tools import assert_equal, assert_true
+
+import desktop.conf
+from desktop.lib.rest import http_pool
+from desktop.lib.rest.http_client import HttpClient, RestException
+from desktop.lib.rest.resource import Resource
 
 
 class MockFile:
@@ -38,3 +48,180 @@ def test_http_error_rest_exception():
 
   exception = RestException(HTTPError('url', 404, 'My error', headers, MockFile()))
   assert_equal(headers, exception._headers)
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  # The headers and the body are sent separately
+  disable_nagle_algorithm = True
+
+  def do_POST(self):
+    self.server.posts += 1
+    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    self.do_GET()
+
+  def do_GET(self):
+    self.server.connections.add(self.client_address)
+    self.server.cookies.append(self.headers.get('Cookie'))
+    if self.path.startswith('/missing'):
+      body, status = 'not found', 404
+    else:
+      body, status = '{"path": "%s"}' % self.path, 200
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('Set-Cookie', 'session=%s' % len(self.server.cookies))
+    if self.path.startswith('/close'):
+      self.send_header('Connection', 'close')
+      self.close_connection = 1
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class KeepAliveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), KeepAliveHandler)
+    self.connections = set()
+    self.cookies = []
+    self.posts = 0
+
+  def handle_error(self, request, client_address):
+    # The connections closed by the client
+    pass
+
+
+class TestHttpPool(object):
+  def setUp(self):
+    http_pool.pool.clear()
+    self.server = KeepAliveServer()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.setDaemon(True)
+    self.thread.start()
+    self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    http_pool.pool.clear()
+
+  def _get_stats(self):
+    for stats in http_pool.get_pool_stats():
+      if stats['host'] == self.url[len('http://'):]:
+        return stats
+
+  def test_keep_alive(self):
+    root = Resource(HttpClient(self.url))
+    for i in range(5):
+      assert_equal({'path': '/api/%d' % i}, root.get('api/%d' % i))
+    assert_equal(1, len(self.server.connections))
+
+    # The cookies are still sent back
+    assert_equal([None, 'session=1', 'session=2', 'session=3', 'session=4'], self.server.cookies)
+
+    # The errors are read before giving back their connection
+    try:
+      root.get('missing')
+      assert_true(False, 'Expected a RestException')
+    except RestException, ex:
+      assert_equal(404, ex.code)
+      assert_equal('not found', ex.message)
+    assert_equal({'path': '/api'}, root.get('api'))
+    assert_equal(1, len(self.server.connections))
+
+    stats = self._get_stats()
+    assert_equal(7, stats['requests'])
+    assert_equal(1, stats['creates'])
+    assert_equal(6, stats['reuses'])
+    assert_equal(0, stats['in_use'])
+    assert_equal(1, stats['idle'])
+
+  def test_closed_connections(self):
+    root = Resource(HttpClient(self.url))
+
+    # The server says it closes the connection
+    root.get('close')
+    root.get('api')
+    assert_equal(2, len(self.server.connections))
+
+    # The server closed it without saying so
+    for conn, returned_at in http_pool.pool._idle.values()[0]:
+      conn.sock.shutdown(socket.SHUT_RD)
+    root.get('api')
+    stats = self._get_stats()
+    assert_equal(1, stats['evictions'])
+    assert_equal(0, stats['in_use'])
+
+    # Unused for too long
+    finish = desktop.conf.HTTP_POOL.IDLE_TIMEOUT.set_for_testing(0)
+    try:
+      time.sleep(0.01)
+      root.get('api')
+    finally:
+      finish()
+    assert_equal(2, self._get_stats()['evictions'])
+
+    # Closed after being checked, the request is sent again on a new connection
+    is_connected = http_pool._is_connected
+    http_pool._is_connected = lambda conn: True
+    try:
+      for conn, returned_at in http_pool.pool._idle.values()[0]:
+        conn.sock.shutdown(socket.SHUT_RDWR)
+      assert_equal({'path': '/api'}, root.get('api'))
+    finally:
+      http_pool._is_connected = is_connected
+    assert_equal(1, self._get_stats()['retries'])
+    assert_equal(0, self._get_stats()['failures'])
+
+    # The requests which are not idempotent are never sent twice
+    root.post('api', data='a=1')
+    http_pool._is_connected = lambda conn: True
+    try:
+      for conn, returned_at in http_pool.pool._idle.values()[0]:
+        conn.sock.shutdown(socket.SHUT_RDWR)
+      try:
+        root.post('api', data='a=2')
+        assert_true(False, 'Expected a RestException')
+      except RestException:
+        pass
+    finally:
+      http_pool._is_connected = is_connected
+    assert_equal(1, self.server.posts)
+    assert_equal(1, self._get_stats()['retries'])
+    assert_equal(1, self._get_stats()['failures'])
+
+  def test_can_retry(self):
+    get = Request(self.url + '/api')
+    post = Request(self.url + '/api', data='a=1')
+    reset = socket.error(104, 'Connection reset by peer')
+
+    # Failed while sending the request, or closed without any response
+    assert_true(http_pool._can_retry(get, reset, False))
+    assert_true(http_pool._can_retry(get, httplib.BadStatusLine(''), True))
+    # The server could have processed it
+    assert_true(not http_pool._can_retry(get, reset, True))
+    assert_true(not http_pool._can_retry(get, httplib.BadStatusLine('HTTP/1.1 20'), True))
+    assert_true(not http_pool._can_retry(get, socket.timeout('timed out'), False))
+    assert_true(not http_pool._can_retry(post, reset, False))
+    assert_true(not http_pool._can_retry(post, httplib.BadStatusLine(''), True))
+
+  def test_pool_size(self):
+    finish = desktop.conf.HTTP_POOL.SIZE.set_for_testing(0)
+    try:
+      root = Resource(HttpClient(self.url))
+      for i in range(3):
+        root.get('api')
+      assert_equal(3, len(self.server.connections))
+    finally:
+      finish()
+
+    # A response which is not read to the end closes its connection
+    client = HttpClient(self.url)
+    client.execute('GET', 'api').close()
+    client.execute('GET', 'api').read()
+    assert_equal(5, len(self.server.connections))
+    assert_equal(0, self._get_stats()['in_use'])
@@ -0,0 +1,314 @@
+# Licensed to Cloudera, Inc. under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  Cloudera, Inc. licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Persistent HTTP/1.1 connections for urllib2, shared by the REST clients
+
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+import urllib
+import urllib2
+
+from desktop.conf import HTTP_POOL
+
+
+LOG = logging.getLogger(__name__)
+
+# Size of the reads of readline()
+READ_SIZE = 8 * 1024
+# Requests which can be sent twice (RFC 2616 9.1.2)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE')
+
+
+class HttpConnectionPool(object):
+  """
+  Idle keep-alive connections to each host, the most recently used first.
+
+  At most HTTP_POOL.SIZE connections are kept per host. The pool never waits: the
+  requests made while they are all used get a new connection, which is closed after
+  them if the pool is full. A response held open can then not block another request.
+  """
+  def __init__(self):
+    self._idle = {}                     # (scheme, host) -> [(connection, returned at)]
+    self._stats = {}                    # (scheme, host) -> {counter: value}
+    self._lock = threading.Lock()
+
+  def _count(self, key, counter, value=1):
+    stats = self._stats.get(key)
+    if stats is None:
+      stats = dict(requests=0, creates=0, reuses=0, retries=0, evictions=0, failures=0, in_use=0)
+      self._stats[key] = stats
+    stats[counter] += value
+
+  def get(self, key, http_class, timeout=None):
+    """get(key, http_class) -> (connection, whether it was used before)"""
+    evicted = []
+    self._lock.acquire()
+    try:
+      self._count(key, 'requests')
+      self._count(key, 'in_use')
+      idle = self._idle.get(key, [])
+      while idle:
+        conn, returned_at = idle.pop()
+        if time.time() - returned_at > HTTP_POOL.IDLE_TIMEOUT.get() or not _is_connected(conn):
+          self._count(key, 'evictions')
+          evicted.append(conn)
+        else:
+          self._count(key, 'reuses')
+          break
+      else:
+        conn = None
+        self._count(key, 'creates')
+    finally:
+      self._lock.release()
+
+    for stale in evicted:
+      stale.close()
+
+    if conn is None:
+      return http_class(key[1]), False
+    if timeout is not None and conn.sock is not None:
+      conn.sock.settimeout(timeout)
+    return conn, True
+
+  def put(self, key, conn, reuse=True):
+    """Gives back a connection, which is closed unless ``reuse`` and there is room for it"""
+    self._lock.acquire()
+    try:
+      self._count(key, 'in_use', -1)
+      idle = self._idle.setdefault(key, [])
+      if reuse and len(idle) < HTTP_POOL.SIZE.get():
+        idle.append((conn, time.time()))
+        return
+    finally:
+      self._lock.release()
+    conn.close()
+
+  def record(self, key, counter):
+    self._lock.acquire()
+    try:
+      self._count(key, counter)
+    finally:
+      self._lock.release()
+
+  def get_stats(self):
+    """get_stats() -> [ activity of the connections to each host ]"""
+    self._lock.acquire()
+    try:
+      stats = []
+      for (scheme, host), counters in sorted(self._stats.items()):
+        host_stats = dict(counters)
+        host_stats.update(scheme=scheme, host=host, size=HTTP_POOL.SIZE.get(),
+                          idle=len(self._idle.get((scheme, host), [])))
+        stats.append(host_stats)
+      return stats
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    """Closes the idle connections"""
+    self._lock.acquire()
+    try:
+      idle, self._idle = self._idle, {}
+    finally:
+      self._lock.release()
+    for connections in idle.itervalues():
+      for conn, returned_at in connections:
+        conn.close()
+
+
+def _is_connected(conn):
+  """An idle connection whose socket is readable was closed by the server"""
+  if conn.sock is None:
+    return False
+  try:
+    readable, writable, errors = select.select([conn.sock], [], [], 0)
+    return not readable
+  except (select.error, socket.error, ValueError):
+    return False
+
+
+def _can_retry(req, ex, sent):
+  """
+  A request which failed on a reused connection is sent again on a new one when it is
+  idempotent and the failure came before any byte of the response: while sending it, or
+  with the connection closed instead of a status line. After a timeout, the server could
+  still be processing it.
+  """
+  if req.get_method() not in IDEMPOTENT_METHODS or isinstance(ex, socket.timeout):
+    return False
+  if req.data is not None and not isinstance(req.data, basestring):
+    # A file being uploaded can not be read again
+    return False
+  if not sent:
+    return isinstance(ex, socket.error)
+  return isinstance(ex, httplib.BadStatusLine) and ex.line in ('', repr(''))
+
+
+class PooledResponseFile(object):
+  """
+  Body of a response read from a pooled connection. The connection goes back to
+  the pool once the body is read entirely, and is closed if it is closed before.
+  """
+  def __init__(self, response, release):
+    self._response = response
+    self._release = release
+    self._buffer = ''
+    if response.length == 0:
+      # No body, e.g. HEAD, 204 and 304
+      self._read()
+
+  def _read(self, amt=None):
+    if self._response is None:
+      return ''
+    if amt is None:
+      data = self._response.read()
+    else:
+      data = self._response.read(amt)
+    if self._response.isclosed():
+      self._release(not self._response.will_close)
+      self._response = None
+    return data
+
+  def read(self, amt=None):
+    if amt is None:
+      data, self._buffer = self._buffer + self._read(), ''
+    elif len(self._buffer) >= amt:
+      data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+    else:
+      data, self._buffer = self._buffer + self._read(amt - len(self._buffer)), ''
+    return data
+
+  def readline(self):
+    while '\n' not in self._buffer and self._response is not None:
+      self._buffer += self._read(READ_SIZE)
+    end = self._buffer.find('\n') + 1 or len(self._buffer)
+    line, self._buffer = self._buffer[:end], self._buffer[end:]
+    return line
+
+  def readlines(self):
+    lines = []
+    line = self.readline()
+    while line:
+      lines.append(line)
+      line = self.readline()
+    return lines
+
+  def buffer_all(self):
+    """Reads the body now, to release the connection"""
+    self._buffer += self._read()
+
+  def close(self):
+    if self._response is not None:
+      # Not read to the end, the connection can not be used again
+      self._response.close()
+      self._response = None
+      self._release(False)
+
+
+class KeepAliveHandlerMixin:
+  """
+  Opens the requests of urllib2 on the persistent connections of the pool.
+  The other handlers, e.g. of the cookies or the Kerberos authentication, are unchanged.
+  """
+  def _open_pooled(self, http_class, req):
+    host = req.get_host()
+    if not host:
+      raise urllib2.URLError('no host given')
+    if getattr(req, '_tunnel_host', None):
+      # Through a HTTPS proxy
+      return self.do_open(http_class, req)
+
+    key = (req.get_type(), host)
+    timeout = getattr(req, 'timeout', None)
+    if timeout is getattr(socket, '_GLOBAL_DEFAULT_TIMEOUT', None):
+      timeout = None
+
+    headers = dict(req.unredirected_hdrs)
+    headers.update(dict([ (name, value) for name, value in req.headers.items() if name not in headers ]))
+    headers = dict([ (name.title(), value) for name, value in headers.items() ])
+
+    conn, reused = pool.get(key, http_class, timeout)
+    try:
+      sent = False
+      try:
+        self._send(conn, req, headers, timeout)
+        sent = True
+        response = conn.getresponse()
+      except (socket.error, httplib.HTTPException), ex:
+        conn.close()
+        if not reused or not _can_retry(req, ex, sent):
+          raise
+        # The server closed the idle connection meanwhile, without answering the request
+        LOG.debug('Retrying %s %s on a new connection: %s' % (req.get_method(), req.get_full_url(), ex))
+        pool.record(key, 'retries')
+        conn = http_class(host)
+        self._send(conn, req, headers, timeout)
+        response = conn.getresponse()
+    except (socket.error, httplib.HTTPException), ex:
+      pool.record(key, 'failures')
+      pool.put(key, conn, reuse=False)
+      raise urllib2.URLError(ex)
+
+    def release(reuse):
+      pool.put(key, conn, reuse)
+
+    fp = PooledResponseFile(response, release)
+    if not 200 <= response.status < 300:
+      # The bodies of the errors and the redirects are small, and often never read,
+      # e.g. the 401 answered by HTTPKerberosAuthHandler.
+      fp.buffer_all()
+
+    resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+    resp.code = response.status
+    resp.msg = response.reason
+    return resp
+
+  def _send(self, conn, req, headers, timeout):
+    if timeout is not None:
+      conn.timeout = timeout
+    conn.set_debuglevel(self._debuglevel)
+    conn.request(req.get_method(), req.get_selector(), req.data, headers)
+
+
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, urllib2.HTTPHandler):
+  def http_open(self, req):
+    return self._open_pooled(httplib.HTTPConnection, req)
+
+
+if hasattr(httplib, 'HTTPSConnection'):
+  class KeepAliveHTTPSHandler(KeepAliveHandlerMixin, urllib2.HTTPSHandler):
+    def https_open(self, req):
+      return self._open_pooled(httplib.HTTPSConnection, req)
+
+
+def get_handlers():
+  """get_handlers() -> [ urllib2 handlers of the schemes using the pool ]"""
+  handlers = [ KeepAliveHTTPHandler() ]
+  if hasattr(httplib, 'HTTPSConnection'):
+    handlers.append(KeepAliveHTTPSHandler())
+  return handlers
+
+
+def get_pool_stats():
+  """get_pool_stats() -> [ activity of the connections to each host ]"""
+  return pool.get_stats()
+
+
+pool = HttpConnectionPool()
@@ -91,6 +91,17 @@ class Resource(object):
     return self.invoke("GET", relpath, params, headers=headers)
 
 
+  def get_stream(self, relpath=None, params=None, headers=None):
+    """
+    Invoke the GET method on a resource, without reading the body of the response.
+    @param relpath: Optional. A relative path to this resource's path.
+    @param params: Key-value data.
+
+    @return: The response, a file-like object to read and close.
+    """
+    return self._client.execute("GET", self._join_uri(relpath), params=params, headers=headers)
+
+
   def delete(self, relpath=None, params=None):
     """
     Invoke the DELETE method on a resource.
@@ -16,7 +16,14 @@
 # limitations under the License.
 
 import cStringIO
-from desktop.lib.export_csvxls import make_response
+import gzip
+import logging
+import time
+import zipfile
+import zlib
+from desktop.lib.export_csvxls import make_response, generator, buffered, gzipped, get_compression, GZIP_ENCODING, GZIP_FILE, CSVformatter,\
+                                      XLSXformatter, XLSX_MIMETYPE, TooBigToDownloadException, _force_string
+from nose.plugins.attrib import attr
 from nose.tools import assert_true, assert_equal, assert_false
 
 def test_export_csvxls():
@@ -35,3 +42,150 @@ def test_export_csvxls():
   assert_equal("application/xls", response["content-type"])
   assert_equal("attachment; filename=bar.xls", response["content-disposition"])
   assert_equal('"x","y"\r\n"1","2"\r\n"3","4"\r\n', response.content)
+
+LOG = logging.getLogger(__name__)
+
+def test_csv_format_rows():
+  rows = [ ["a", u"\u00e9", 1, 2L, 1.5, None, True],
+           [u"b", "c", None, 3, 0.1 + 0.2, 4, False],
+           ["d", u"e", 5, 6L, 7.0, None, True] ]
+
+  for encoding in ('utf-8', 'latin-1'):
+    formatter = CSVformatter(encoding)
+    expected = ''.join([formatter.format_row(row) for row in rows])
+    assert_equal(expected, formatter.format_rows(rows))
+    # The encoders are kept between batches
+    assert_equal(expected, formatter.format_rows(rows[:1]) + formatter.format_rows(rows[1:]))
+
+def test_export_gzip():
+  header = ["x", "y"]
+  data = [ ["1", "2"], ["3", "4"] ]
+  csv = '"x","y"\r\n"1","2"\r\n"3","4"\r\n'
+
+  response = make_response(header, data, "csv", "foo", compression=GZIP_FILE)
+  assert_equal("application/x-gzip", response["content-type"])
+  assert_equal("attachment; filename=foo.csv.gz", response["content-disposition"])
+  assert_equal(csv, gzip.GzipFile(fileobj=cStringIO.StringIO(response.content)).read())
+
+  response = make_response(header, data, "csv", "foo", compression=GZIP_ENCODING)
+  assert_equal("application/csv", response["content-type"])
+  assert_equal("gzip", response["content-encoding"])
+  assert_equal("attachment; filename=foo.csv", response["content-disposition"])
+  assert_equal(csv, gzip.GzipFile(fileobj=cStringIO.StringIO(response.content)).read())
+
+  # Each chunk can be decompressed as soon as it is received
+  chunks = list(gzipped(['a' * 1000, 'b' * 1000], level=1))
+  assert_equal(4, len(chunks))
+  assert_equal('a' * 1000, zlib.decompressobj(-zlib.MAX_WBITS).decompress(chunks[1]))
+
+def test_get_compression():
+  def request(compress=None, accept_encoding=None):
+    GET = compress and {'compress': compress} or {}
+    META = accept_encoding and {'HTTP_ACCEPT_ENCODING': accept_encoding} or {}
+    return type('Request', (object,), {'GET': GET, 'META': META})
+
+  assert_equal(None, get_compression(request(accept_encoding='gzip, deflate')))
+  assert_equal(GZIP_FILE, get_compression(request('gz')))
+  assert_equal(GZIP_ENCODING, get_compression(request('gzip', 'deflate, gzip')))
+  assert_equal(GZIP_ENCODING, get_compression(request('gzip', 'gzip;q=0.5, identity')))
+  assert_equal(GZIP_ENCODING, get_compression(request('gzip', '*')))
+  assert_equal(None, get_compression(request('gzip', 'gzip;q=0')))
+  assert_equal(None, get_compression(request('gzip', '*, gzip; q=0.0')))
+  assert_equal(None, get_compression(request('gzip', 'x-gzip')))
+  assert_equal(None, get_compression(request('gzip')))
+
+def test_buffered():
+  chunks = ['a' * 10] * 25
+  assert_equal(['a' * 100, 'a' * 100, 'a' * 50], list(buffered(chunks, 100)))
+  assert_equal([], list(buffered([], 100)))
+
+def _format_row_by_row(header, data):
+  formatter = CSVformatter()
+  chunks = [formatter.init_doc(), formatter.format_header(header)]
+  for datum in data:
+    chunks.append(formatter.format_row(map(_force_string, datum)))
+  chunks.append(formatter.fini_doc())
+  return chunks
+
+def test_generator():
+  header = ["id", "name", "value"]
+  data = [ [str(i), "name%d" % i, "%d.5" % i] for i in xrange(5000) ]
+
+  chunks = _format_row_by_row(header, data)
+  buffers = list(buffered(generator(header, data, CSVformatter())))
+  assert_equal(''.join(chunks), ''.join(buffers))
+  assert_true(len(buffers) < len(chunks) / 100, len(buffers))
+
+@attr('benchmark')
+def test_generator_benchmark():
+  header = ["id", "name", "value"]
+  data = [ [str(i), "name%d" % i, "%d.5" % i] for i in xrange(100000) ]
+
+  start = time.time()
+  chunks = _format_row_by_row(header, data)
+  row_time = time.time() - start
+
+  start = time.time()
+  buffers = list(buffered(generator(header, data, CSVformatter())))
+  batch_time = time.time() - start
+
+  assert_equal(''.join(chunks), ''.join(buffers))
+  LOG.info('export_csvxls.generator: %d rows/s row by row (%d chunks), %d rows/s in batches (%d chunks)' %
+           (len(data) / max(row_time, 0.001), len(chunks), len(data) / max(batch_time, 0.001), len(buffers)))
+
+def _read_xlsx_sheet(content):
+  archive = zipfile.ZipFile(cStringIO.StringIO(content))
+  assert_equal(None, archive.testzip())
+  assert_true('[Content_Types].xml' in archive.namelist())
+  assert_true('xl/workbook.xml' in archive.namelist())
+  return archive.read('xl/worksheets/sheet1.xml')
+
+def test_export_xlsx():
+  header = ["x", "y"]
+  data = [ ["1", "2"], [u"<\u00e9&>", " a "] ]
+
+  response = make_response(header, data, "xlsx", "foo")
+  assert_equal(XLSX_MIMETYPE, response["content-type"])
+  assert_equal("attachment; filename=foo.xlsx", response["content-disposition"])
+
+  sheet = _read_xlsx_sheet(response.content)
+  assert_true('<row><c t="inlineStr"><is><t xml:space="preserve">x</t></is></c>'
+              '<c t="inlineStr"><is><t xml:space="preserve">y</t></is></c></row>' in sheet, sheet)
+  assert_true(u'<t xml:space="preserve">&lt;\u00e9&amp;&gt;</t>'.encode('utf-8') in sheet, sheet)
+  assert_true('<t xml:space="preserve"> a </t>' in sheet, sheet)
+  assert_equal(3, sheet.count('<row>'))
+
+def test_xlsx_typed_cells():
+  formatter = XLSXformatter()
+  content = formatter.init_doc() + formatter.format_header(["a", "b", "c", "d"]) + \
+            formatter.format_row([2, 3.5, None, True]) + formatter.fini_doc()
+
+  sheet = _read_xlsx_sheet(content)
+  assert_true('<row><c><v>2</v></c><c><v>3.5</v></c><c/><c t="b"><v>1</v></c></row>' in sheet, sheet)
+
+def test_xlsx_row_limit():
+  formatter = XLSXformatter()
+  content = formatter.init_doc()
+  formatter._row_count = XLSXformatter.MAX_ROWS
+  try:
+    formatter.format_row(["1"])
+    assert_false(True)
+  except TooBigToDownloadException:
+    pass
+  # The document can still be closed
+  content += formatter.fini_doc()
+  assert_equal(0, _read_xlsx_sheet(content).count('<row>'))
+
+def test_generator_row_limit():
+  formatter = XLSXformatter()
+  formatter._row_count = XLSXformatter.MAX_ROWS - 3     # The header and 2 rows still fit
+  consumed = []
+  def data():
+    for i in xrange(5000):
+      consumed.append(i)
+      yield [str(i)]
+
+  content = ''.join(generator(["a"], data(), formatter))
+  assert_equal(3, _read_xlsx_sheet(content).count('<row>'))
+  # The generator stops at the first batch over the limit
+  assert_true(len(consumed) < 5000, len(consumed))
@@ -25,6 +25,19 @@ from thrift.protocol import TBinaryProtocol
 import sasl
 import struct
 
+try:
+  memoryview
+  HAS_RECV_INTO = True
+except NameError:
+  # Python < 2.7, the frames are read by chunks
+  HAS_RECV_INTO = False
+
+# Initial size of the read buffer of the transports over a socket, which receives as
+# many frames as are available. It grows for the bigger frames, and is dropped after
+# frames bigger than MAX_READ_BUFFER_SIZE.
+READ_BUFFER_SIZE = 64 * 1024
+MAX_READ_BUFFER_SIZE = 8 * 1024 * 1024
+
 class TSaslClientTransport(TTransportBase, CReadableTransport):
   START = 1
   OK = 2
@@ -43,7 +56,13 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
     self.sasl = None
     self.mechanism = mechanism
     self.__wbuf = StringIO()
-    self.__rbuf = StringIO()
+    # An input buffer, as the fastbinary extension of TBinaryProtocolAccelerated
+    # only reads from those through cstringio_buf
+    self.__rbuf = StringIO('')
+    # Where the frames are received when the underlying transport is a socket,
+    # the bytes in [start, end) are not read yet
+    self.__frame_buf = None
+    self.__frame_start = self.__frame_end = 0
     self.opened = False
     self.encode = None
 
@@ -153,7 +172,29 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
     self._read_frame()
     return self.__rbuf.read(sz)
 
+  def readAll(self, sz):
+    # The parts of several frames are joined once, instead of being
+    # appended one after the other by TTransportBase.readAll()
+    ret = self.read(sz)
+    if len(ret) == sz:
+      return ret
+
+    chunks = [ret]
+    have = len(ret)
+    while have < sz:
+      chunk = self.read(sz - have)
+      if len(chunk) == 0:
+        raise EOFError()
+      chunks.append(chunk)
+      have += len(chunk)
+    return ''.join(chunks)
+
   def _read_frame(self):
+    sock = getattr(self._trans, 'handle', None)
+    if HAS_RECV_INTO and hasattr(sock, 'recv_into'):
+      self._read_buffered_frame(sock)
+      return
+
     header = self._trans.readAll(4)
     (length,) = struct.unpack(">I", header)
     if self.encode:
@@ -170,9 +211,76 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
       decoded = self._trans.readAll(length)
     self.__rbuf = StringIO(decoded)
 
+  def _read_buffered_frame(self, sock):
+    """
+    Same as _read_frame(), with the socket receiving directly into the read buffer,
+    which is reused for the next frames. The small frames take one recv() for several
+    of them, and the plain ones are read by self.__rbuf from the buffer, without copy.
+
+    Only called once self.__rbuf has been read entirely, as its bytes get overwritten.
+    """
+    self._fill_frame_buf(sock, 4)
+    (length,) = struct.unpack_from(">I", self.__frame_buf, self.__frame_start)
+    if self.encode:
+      # sasl.decode() wants the header too
+      self._fill_frame_buf(sock, 4 + length)
+      encoded = str(buffer(self.__frame_buf, self.__frame_start, 4 + length))
+      self._consume_frame_buf(4 + length)
+      success, decoded = self.sasl.decode(encoded)
+      if not success:
+        raise TTransportException(type=TTransportException.UNKNOWN,
+                                  message=self.sasl.getError())
+      self.__rbuf = StringIO(decoded)
+    else:
+      self._consume_frame_buf(4)
+      self._fill_frame_buf(sock, length)
+      self.__rbuf = StringIO(buffer(self.__frame_buf, self.__frame_start, length))
+      self._consume_frame_buf(length)
+
+  def _fill_frame_buf(self, sock, length):
+    """Receives until the read buffer holds ``length`` unread bytes"""
+    buf, start, end = self.__frame_buf, self.__frame_start, self.__frame_end
+    if end - start >= length:
+      return
+
+    if buf is None or start + length > len(buf):
+      # Moves the unread bytes to the beginning of the buffer, in a bigger one if needed
+      if buf is None or length > len(buf):
+        new_buf = bytearray(max(READ_BUFFER_SIZE, length, 2 * len(buf or '')))
+      else:
+        new_buf = buf
+      new_buf[:end - start] = buf and buf[start:end] or ''
+      buf, start, end = new_buf, 0, end - start
+      self.__frame_buf = buf
+
+    view = memoryview(buf)
+    try:
+      while end - start < length:
+        # Reads ahead at most READ_BUFFER_SIZE bytes, which might have to be moved
+        wanted = min(start + length - end + READ_BUFFER_SIZE, len(buf) - end)
+        received = sock.recv_into(view[end:], wanted)
+        if received == 0:
+          raise TTransportException('TSocket read 0 bytes')
+        end += received
+    finally:
+      self.__frame_start, self.__frame_end = start, end
+
+  def _consume_frame_buf(self, length):
+    self.__frame_start += length
+    if self.__frame_start == self.__frame_end:
+      self.__frame_start = self.__frame_end = 0
+      if len(self.__frame_buf) > MAX_READ_BUFFER_SIZE:
+        self.__frame_buf = None
+
   def close(self):
     self._trans.close()
     self.sasl = None
+    self.encode = None
+    # Drop what was left of the connection
+    self.__wbuf = StringIO()
+    self.__rbuf = StringIO('')
+    self.__frame_buf = None
+    self.__frame_start = self.__frame_end = 0
 
   # Implement the CReadableTransport interface.
   # Stolen shamelessly from TFramedTransport
@@ -184,8 +292,12 @@ class TSaslClientTransport(TTransportBase, CReadableTransport):
     # self.__rbuf will already be empty here because fastbinary doesn't
     # ask for a refill until the previous buffer is empty.  Therefore,
     # we can start reading new frames immediately.
-    while len(prefix) < reqlen:
+    chunks = [prefix]
+    have = len(prefix)
+    while have < reqlen:
       self._read_frame()
-      prefix += self.__rbuf.getvalue()
-    self.__rbuf = StringIO(prefix)
+      chunks.append(self.__rbuf.read())
+      have += len(chunks[-1])
+    # The frames are joined once rather than appended to the prefix one by one
+    self.__rbuf = StringIO(''.join(chunks))
     return self.__rbuf
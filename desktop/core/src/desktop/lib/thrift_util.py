@@ -18,6 +18,7 @@
 # Utilities for Thrift
 
 import Queue
+import bisect
 import logging
 import select
 import socket
@@ -29,11 +30,17 @@ import sys
 from thrift.Thrift import TType, TApplicationException
 from thrift.transport.TSocket import TSocket
 from thrift.transport.TTransport import TBufferedTransport, TMemoryBuffer,\
-                                        TTransportException
-from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+                                        TTransportException, CReadableTransport
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol, TBinaryProtocolAccelerated
+from desktop.conf import THRIFT_POOL
 from desktop.lib.thrift_sasl import TSaslClientTransport
 from desktop.lib.exceptions import StructuredException, StructuredThriftTransportException
 
+try:
+  from thrift.protocol import fastbinary
+except ImportError:
+  fastbinary = None
+
 # The maximum depth that we will recurse through a "jsonable" structure
 # while converting to thrift. This prevents us from infinite recursion
 # in the case of circular references.
@@ -44,6 +51,13 @@ MAX_RECURSION_DEPTH = 50
 WARN_LEVEL_CALL_DURATION_MS = 5000
 INFO_LEVEL_CALL_DURATION_MS = 1000
 
+# Maximum length of the arguments and results of the thrift calls in the logs
+MAX_LOGGED_REPR_LENGTH = 1000
+
+# Upper bounds in milliseconds of the buckets of the latency histograms of the thrift calls.
+# The last bucket counts the slower calls.
+CALL_LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 60000)
+
 class LifoQueue(Queue.Queue):
     '''
     Variant of Queue that retrieves most recently added entries first.
@@ -70,7 +84,8 @@ class ConnectionConfig(object):
   def __init__(self, klass, host, port, service_name,
                use_sasl=False,
                kerberos_principal="thrift",
-               timeout_seconds=45):
+               timeout_seconds=45,
+               pool_size=None):
     """
     @param klass The thrift client class
     @param host Host to connect to
@@ -81,6 +96,7 @@ class ConnectionConfig(object):
               NOTE: for a service like fooservice/foo.blah.com@REALM only
               specify "fooservice", NOT the full principal name.
     @param timeout_seconds Timeout for thrift calls
+    @param pool_size Number of connections to the service, [desktop] [[thrift_pool]] size if None
     """
     self.klass = klass
     self.host = host
@@ -89,10 +105,148 @@ class ConnectionConfig(object):
     self.use_sasl = use_sasl
     self.kerberos_principal = kerberos_principal
     self.timeout_seconds = timeout_seconds
+    self.pool_size = pool_size
 
   def __str__(self):
     return ', '.join(map(str, [self.klass, self.host, self.port, self.service_name, self.use_sasl, self.kerberos_principal, self.timeout_seconds]))
 
+class ConnectionPool(object):
+  """
+  The clients of one endpoint, the most recently returned first.
+
+  The clients are created up front but only connect on their first call. On checkout,
+  a connected client is disconnected when it was idle for more than ``idle_timeout``,
+  connected for more than ``max_lifetime``, connected before a failure of another
+  client of the endpoint, or closed by the server, which is checked after
+  ``validate_after`` seconds of idleness. It then reconnects on its next call, so that
+  the calls do not fail on a stale socket, e.g. after a restart of the service.
+  """
+
+  def __init__(self, conf, size):
+    self.conf = conf
+    self.size = size
+    self.queue = LifoQueue(size)
+    self.lock = threading.Lock()
+    self.failed_at = 0                  # Connections opened before are closed on checkout
+    self.checkouts = 0
+    self.waits = 0
+    self.wait_time = 0.0
+    self.creates = 0
+    self.failures = 0
+    self.evictions = 0
+    for i in xrange(size):
+      client = construct_superclient(conf)
+      client.CID = i
+      self.queue.put(client, False)
+
+  def _count(self, **counters):
+    self.lock.acquire()
+    try:
+      for name, value in counters.iteritems():
+        setattr(self, name, getattr(self, name) + value)
+    finally:
+      self.lock.release()
+
+  def get(self, get_client_timeout=None):
+    """
+    Could block while we wait for the pool to become non-empty.
+
+    @param get_client_timeout: how long (in seconds) to wait on the pool
+                               to get a client before failing
+    """
+    try:
+      connection = self.queue.get(block=False)
+    except Queue.Empty:
+      connection = None
+      self._count(waits=1)
+
+    start_pool_get_time = time.time()
+    has_waited_for = 0
+    waited = connection is None
+
+    try:
+      while connection is None:
+        if get_client_timeout is not None:
+          this_round_timeout = max(min(get_client_timeout - has_waited_for, 1), 0)
+        else:
+          this_round_timeout = None
+
+        try:
+          connection = self.queue.get(block=True, timeout=this_round_timeout)
+        except Queue.Empty:
+          has_waited_for = time.time() - start_pool_get_time
+          if get_client_timeout is not None and has_waited_for > get_client_timeout:
+            raise socket.timeout(
+              ("Timed out after %.2f seconds waiting to retrieve a " +
+               "%s client from the pool.") % (has_waited_for, self.conf.service_name))
+          logging.warn("Waited %d seconds for a thrift client to %s:%d" %
+            (has_waited_for, self.conf.host, self.conf.port))
+    finally:
+      if waited:
+        self._count(wait_time=time.time() - start_pool_get_time)
+
+    self._count(checkouts=1)
+    self._check(connection)
+    connection.checkout_opens = connection.opens
+    return connection
+
+  def _check(self, client):
+    """Closes the connection of the client if it should not be used anymore"""
+    if not client.transport.isOpen():
+      return
+
+    now = time.time()
+    idle = now - (client.returned_at or now)
+    lifetime = now - (client.opened_at or now)
+    if THRIFT_POOL.IDLE_TIMEOUT.get() > 0 and idle > THRIFT_POOL.IDLE_TIMEOUT.get():
+      reason = "idle for %d seconds" % idle
+    elif THRIFT_POOL.MAX_LIFETIME.get() > 0 and lifetime > THRIFT_POOL.MAX_LIFETIME.get():
+      reason = "connected for %d seconds" % lifetime
+    elif (client.opened_at or now) < self.failed_at:
+      reason = "connected before a failure"
+    elif idle >= THRIFT_POOL.VALIDATE_AFTER.get() and not _is_connected(client):
+      reason = "closed by the server"
+    else:
+      return
+
+    logging.debug("Closing connection to %s (%s:%d): %s" % (self.conf.service_name, self.conf.host, self.conf.port, reason))
+    self._count(evictions=1)
+    client.transport.close()
+
+  def put(self, client):
+    client.returned_at = time.time()
+    self._count(creates=client.opens - client.checkout_opens)
+    self.queue.put(client)
+
+  def record_failure(self, reconnect=True):
+    """A call failed, the other connections are likely to be broken too if ``reconnect``"""
+    self.lock.acquire()
+    try:
+      self.failures += 1
+      if reconnect:
+        self.failed_at = time.time()
+    finally:
+      self.lock.release()
+
+  def get_stats(self):
+    self.lock.acquire()
+    try:
+      return {
+        'service_name': self.conf.service_name,
+        'host': self.conf.host,
+        'port': self.conf.port,
+        'size': self.size,
+        'idle': self.queue.qsize(),
+        'checkouts': self.checkouts,
+        'waits': self.waits,
+        'wait_time': self.wait_time,
+        'creates': self.creates,
+        'failures': self.failures,
+        'evictions': self.evictions,
+      }
+    finally:
+      self.lock.release()
+
 class ConnectionPooler(object):
   """
   Thread-safe connection pooling for thrift. (With about 3 changes,
@@ -103,26 +257,21 @@ class ConnectionPooler(object):
   none are available.
 
   A connection is a 'SuperClient', which deals with timeout errors
-  automatically so we don't have to worry about refreshing a stale pool.
+  automatically. The ConnectionPool of each endpoint also refreshes its stale
+  connections on checkout, and counts its activity for get_stats().
 
   We could be fancier here - we could reclaim clients ourselves without
   relying on them to be returned but that would increase complexity. The
   benefit would be not having to hit the connection pool on every client call.
   """
 
-  def __init__(self, poolsize=10):
+  def __init__(self, poolsize=None):
     self.pooldict = {}
     self.poolsize = poolsize
     self.dictlock = threading.Lock()
 
-  def get_client(self, conf,
-                 get_client_timeout=None):
-    """
-    Could block while we wait for the pool to become non-empty.
-
-    @param get_client_timeout: how long (in seconds) to wait on the pool
-                               to get a client before failing
-    """
+  def get_pool(self, conf):
+    """The ConnectionPool of the endpoint of ``conf``, created on the first use"""
     # First up, check to see if we have a pool for this endpoint
     if _get_pool_key(conf) not in self.pooldict:
       # Uh-oh, we need to initialise the queue. Take the dict lock.
@@ -141,39 +290,22 @@ class ConnectionPooler(object):
       self.dictlock.acquire()
       try:
         if _get_pool_key(conf) not in self.pooldict:
-          q = LifoQueue(self.poolsize)
-          self.pooldict[_get_pool_key(conf)] = q
-          for i in xrange(self.poolsize):
-            client = construct_superclient(conf)
-            client.CID = i
-            q.put(client, False)
+          poolsize = conf.pool_size or self.poolsize or THRIFT_POOL.SIZE.get()
+          self.pooldict[_get_pool_key(conf)] = ConnectionPool(conf, poolsize)
       finally:
         self.dictlock.release()
 
-    connection = None
-
-    start_pool_get_time = time.time()
-    has_waited_for = 0
+    return self.pooldict[_get_pool_key(conf)]
 
-    while connection is None:
-      if get_client_timeout is not None:
-        this_round_timeout = max(min(get_client_timeout - has_waited_for, 1), 0)
-      else:
-        this_round_timeout = None
-
-      try:
-        connection = self.pooldict[_get_pool_key(conf)].get(
-          block=True, timeout=this_round_timeout)
-      except Queue.Empty:
-        has_waited_for = time.time() - start_pool_get_time
-        if get_client_timeout is not None and has_waited_for > get_client_timeout:
-          raise socket.timeout(
-            ("Timed out after %.2f seconds waiting to retrieve a " +
-             "%s client from the pool.") % (has_waited_for, conf.service_name))
-        logging.warn("Waited %d seconds for a thrift client to %s:%d" %
-          (has_waited_for, conf.host, conf.port))
+  def get_client(self, conf,
+                 get_client_timeout=None):
+    """
+    Could block while we wait for the pool to become non-empty.
 
-    return connection
+    @param get_client_timeout: how long (in seconds) to wait on the pool
+                               to get a client before failing
+    """
+    return self.get_pool(conf).get(get_client_timeout)
 
   def return_client(self, conf, client):
     """
@@ -183,6 +315,13 @@ class ConnectionPooler(object):
     """
     self.pooldict[_get_pool_key(conf)].put(client)
 
+  def record_failure(self, conf, reconnect=True):
+    self.pooldict[_get_pool_key(conf)].record_failure(reconnect)
+
+  def get_stats(self):
+    """get_stats() -> [ stats of each pool ]"""
+    return [ pool.get_stats() for pool in self.pooldict.values() ]
+
 def _get_pool_key(conf):
   """
   Given a ConnectionConfig, return the tuple used as the key in the dictionary
@@ -190,12 +329,30 @@ def _get_pool_key(conf):
   """
   return (conf.klass, conf.host, conf.port)
 
+def _is_connected(superclient):
+  """
+  Poke the socket to see if it's closed on the other end. This can happen if a connection
+  sits in the connection pool longer than the read timeout of the server.
+  """
+  sock = _grab_transport_from_wrapper(superclient.transport).handle
+  if sock:
+    rlist,wlist,xlist = select.select([sock], [], [], 0)
+    if rlist:
+      # the socket is readable, meaning there is either data from a previous call
+      # (i.e our protocol is out of sync), or the connection was shut down on the
+      # remote side. Either way, we need to reopen the connection.
+      # If the socket was closed remotely, btw, socket.read() will return
+      # an empty string.  This is a fairly normal condition, btw, since
+      # there are timeouts on both the server and client sides.
+      return False
+  return True
+
 def construct_superclient(conf):
   """
   Constructs a thrift client, lazily.
   """
   service, protocol, transport = connect_to_thrift(conf)
-  return SuperClient(service, transport, timeout_seconds=conf.timeout_seconds)
+  return SuperClient(service, transport, timeout_seconds=conf.timeout_seconds, service_name=conf.service_name)
 
 
 def connect_to_thrift(conf):
@@ -222,13 +379,39 @@ def connect_to_thrift(conf):
   else:
     transport = TBufferedTransport(sock)
 
-  protocol = TBinaryProtocol(transport)
+  protocol = get_protocol_class(transport)(transport)
   service = conf.klass(protocol)
   return service, protocol, transport
 
 
+_fastbinary_warned = False
+
+def get_protocol_class(transport):
+  """
+  TBinaryProtocolAccelerated, whose structs are decoded and encoded by the generated code
+  with the fastbinary C extension, if it is available and can read from the transport.
+  TBinaryProtocol otherwise.
+  """
+  global _fastbinary_warned
+
+  if not THRIFT_POOL.ACCELERATED_PROTOCOL.get():
+    return TBinaryProtocol
+  if fastbinary is None:
+    if not _fastbinary_warned:
+      _fastbinary_warned = True
+      logging.warn("The fastbinary extension of Thrift is not available, falling back to the Python binary protocol")
+    return TBinaryProtocol
+  if not isinstance(transport, CReadableTransport):
+    return TBinaryProtocol
+  return TBinaryProtocolAccelerated
+
+
 _connection_pool = ConnectionPooler()
 
+def get_pool_stats():
+  """get_pool_stats() -> [ activity of the connection pool of each endpoint ]"""
+  return _connection_pool.get_stats()
+
 def get_client(klass, host, port, service_name, **kwargs):
   conf = ConnectionConfig(klass, host, port, service_name, **kwargs)
   return PooledClient(conf)
@@ -266,21 +449,7 @@ class PooledClient(object):
       def wrapper(*args, **kwargs):
         try:
           try:
-            # Poke it to see if it's closed on the other end. This can happen if a connection
-            # sits in the connection pool longer than the read timeout of the server.
-            sock = _grab_transport_from_wrapper(superclient.transport).handle
-            if sock:
-              rlist,wlist,xlist = select.select([sock], [], [], 0)
-              if rlist:
-                # the socket is readable, meaning there is either data from a previous call
-                # (i.e our protocol is out of sync), or the connection was shut down on the
-                # remote side. Either way, we need to reopen the connection.
-                # If the socket was closed remotely, btw, socket.read() will return
-                # an empty string.  This is a fairly normal condition, btw, since
-                # there are timeouts on both the server and client sides.
-                superclient.transport.close()
-                superclient.transport.open()
-
+            # The pool checked the connection on checkout
             superclient.set_timeout(self.conf.timeout_seconds)
             return res(*args, **kwargs)
           except TApplicationException, e:
@@ -289,9 +458,11 @@ class PooledClient(object):
             raise StructuredException('THRIFTAPPLICATION', str(e), data=None, error_code=502)
           except socket.error, e:
             logging.info("Thrift saw a socket error: " + str(e), exc_info=False)
+            _connection_pool.record_failure(self.conf, reconnect=not isinstance(e, socket.timeout))
             raise StructuredException('THRIFTSOCKET', str(e), data=None, error_code=502)
           except TTransportException, e:
             logging.info("Thrift saw a transport exception: " + str(e), exc_info=False)
+            _connection_pool.record_failure(self.conf)
             raise StructuredThriftTransportException(e, error_code=502)
           except Exception, e:
             # Stack tends to be only noisy here.
@@ -311,10 +482,15 @@ class SuperClient(object):
   TODO(todd): get this into the Thrift lib
   """
 
-  def __init__(self, wrapped_client, transport, timeout_seconds=None):
+  def __init__(self, wrapped_client, transport, timeout_seconds=None, service_name=None):
     self.wrapped = wrapped_client
     self.transport = transport
     self.timeout_seconds = timeout_seconds
+    self.service_name = service_name or str(wrapped_client.__class__)
+    self.opened_at = None
+    self.returned_at = None
+    self.opens = 0
+    self.checkout_opens = 0
 
   def __getattr__(self, attr):
     if attr in self.__dict__:
@@ -323,7 +499,7 @@ class SuperClient(object):
     res = getattr(self.wrapped, attr)
     if not hasattr(res, '__call__'):
       return res
-    def wrapper(*args, **kwargs):
+    def call(*args, **kwargs):
       tries_left = 3
       while tries_left:
         # clear exception state so our re-raise can't reraise something
@@ -332,25 +508,25 @@ class SuperClient(object):
         try:
           if not self.transport.isOpen():
             self.transport.open()
+            self.opened_at = time.time()
+            self.opens += 1
           st = time.time()
-          logging.debug("Thrift call: %s.%s(args=%s, kwargs=%s)"
-            % (str(self.wrapped.__class__), attr, repr(args), repr(kwargs)))
+          # The arguments and the result are only formatted if the message is logged
+          logging.debug("Thrift call: %s.%s(args=%s, kwargs=%s)",
+            str(self.wrapped.__class__), attr, LazyRepr(args), LazyRepr(kwargs))
           ret = res(*args, **kwargs)
-          log_msg = repr(ret)
-          if len(log_msg) > 1000:
-            log_msg = log_msg[0:1000] + "..."
           duration = time.time() - st
 
           # Log the duration at different levels, depending on how long
           # it took.
-          logmsg = "Thrift call %s.%s returned in %dms: %s" % (
-            str(self.wrapped.__class__), attr, duration*1000, log_msg)
-          if duration >= WARN_LEVEL_CALL_DURATION_MS:
-            logging.warn(logmsg)
-          elif duration >= INFO_LEVEL_CALL_DURATION_MS:
-            logging.info(logmsg)
+          if duration * 1000 >= WARN_LEVEL_CALL_DURATION_MS:
+            level = logging.WARN
+          elif duration * 1000 >= INFO_LEVEL_CALL_DURATION_MS:
+            level = logging.INFO
           else:
-            logging.debug(logmsg)
+            level = logging.DEBUG
+          logging.log(level, "Thrift call %s.%s returned in %dms: %s",
+            str(self.wrapped.__class__), attr, duration * 1000, LazyRepr(ret))
 
           return ret
         except socket.error, e:
@@ -371,6 +547,17 @@ class SuperClient(object):
             logging.info("Thrift exception; retrying: " + str(e), exc_info=0)
       logging.warn("Out of retries for thrift call: " + attr)
       raise
+
+    def wrapper(*args, **kwargs):
+      start = time.time()
+      try:
+        ret = call(*args, **kwargs)
+      except:
+        exc_info = sys.exc_info()
+        call_stats.record(self.service_name, attr, time.time() - start, error=True)
+        raise exc_info[0], exc_info[1], exc_info[2]
+      call_stats.record(self.service_name, attr, time.time() - start)
+      return ret
     return wrapper
 
   def set_timeout(self, timeout_seconds):
@@ -382,6 +569,153 @@ class SuperClient(object):
       else:
         _grab_transport_from_wrapper(self.transport).setTimeout(None)
 
+class LazyRepr(object):
+  """
+  repr() of an object for the logs. It is only computed when the message is logged,
+  and stops after ``max_length`` characters instead of formatting the whole object.
+  The thrift structs are shown without their null fields, as in simpler_string().
+  """
+  def __init__(self, obj, max_length=MAX_LOGGED_REPR_LENGTH):
+    self.obj = obj
+    self.max_length = max_length
+
+  def __str__(self):
+    out = []
+    if _bounded_repr(self.obj, out, self.max_length) < 0:
+      return ''.join(out)[:self.max_length] + '...'
+    return ''.join(out)
+
+def _bounded_repr(obj, out, budget):
+  """Appends the repr of ``obj`` to ``out`` until ``budget`` characters, returns what is left of it"""
+  def append(text, budget):
+    out.append(text)
+    return budget - len(text)
+
+  def append_all(values, budget, separator=', '):
+    for i, value in enumerate(values):
+      if budget < 0:
+        break
+      if i:
+        budget = append(separator, budget)
+      budget = _bounded_repr(value, out, budget)
+    return budget
+
+  if budget < 0:
+    return budget
+  elif hasattr(obj, 'thrift_spec'):
+    budget = append('%s(' % obj.__class__.__name__, budget)
+    fields = [ (spec[2], getattr(obj, spec[2], None)) for spec in obj.thrift_spec if spec is not None ]
+    fields = [ (key, value) for key, value in fields if value is not None ]
+    for i, (key, value) in enumerate(fields):
+      if budget < 0:
+        break
+      budget = append('%s%s=' % (i and ', ' or '', key), budget)
+      budget = _bounded_repr(value, out, budget)
+    return append(')', budget)
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    if isinstance(obj, list):
+      start, end = '[', ']'
+    elif isinstance(obj, tuple):
+      start, end = '(', len(obj) == 1 and ',)' or ')'
+    else:
+      start, end = '%s([' % obj.__class__.__name__, '])'
+    budget = append(start, budget)
+    budget = append_all(obj, budget)
+    return append(end, budget)
+  elif isinstance(obj, dict):
+    budget = append('{', budget)
+    for i, (key, value) in enumerate(obj.iteritems()):
+      if budget < 0:
+        break
+      if i:
+        budget = append(', ', budget)
+      budget = _bounded_repr(key, out, budget)
+      budget = append(': ', budget)
+      budget = _bounded_repr(value, out, budget)
+    return append('}', budget)
+  elif isinstance(obj, basestring):
+    # Only quote the beginning of long strings, the quotes already take them over the budget
+    return append(repr(obj[:budget + 1]), budget)
+  else:
+    return append(repr(obj), budget)
+
+
+class CallStats(object):
+  """
+  Latency histogram and number of errors of each method of each thrift service.
+  The latencies include the retries of SuperClient, but not the wait for a client of the pool.
+  """
+  def __init__(self, buckets=CALL_LATENCY_BUCKETS_MS):
+    self.buckets = buckets
+    self._methods = {}                  # (service name, method) -> [calls, errors, total ms, max ms, counts]
+    self._lock = threading.Lock()
+
+  def record(self, service_name, method, duration, error=False):
+    duration_ms = duration * 1000
+    self._lock.acquire()
+    try:
+      entry = self._methods.get((service_name, method))
+      if entry is None:
+        entry = [0, 0, 0.0, 0.0, [0] * (len(self.buckets) + 1)]
+        self._methods[(service_name, method)] = entry
+      entry[0] += 1
+      if error:
+        entry[1] += 1
+      entry[2] += duration_ms
+      entry[3] = max(entry[3], duration_ms)
+      entry[4][bisect.bisect_left(self.buckets, duration_ms)] += 1
+    finally:
+      self._lock.release()
+
+  def get_stats(self, percentiles=(50, 90, 99)):
+    """
+    get_stats() -> [ stats of each method ]
+
+    The percentiles are the upper bounds of the buckets holding them, or the maximum
+    latency for the last bucket.
+    """
+    self._lock.acquire()
+    try:
+      methods = [ (key, list(entry[:4]) + [list(entry[4])]) for key, entry in self._methods.iteritems() ]
+    finally:
+      self._lock.release()
+
+    stats = []
+    for (service_name, method), (calls, errors, total, maximum, counts) in sorted(methods):
+      estimates = []
+      for percentile in percentiles:
+        rank = max(int(round(percentile / 100.0 * calls)), 1)
+        seen = 0
+        for i, count in enumerate(counts):
+          seen += count
+          if seen >= rank:
+            break
+        estimates.append(i < len(self.buckets) and min(self.buckets[i], maximum) or maximum)
+      stats.append({
+        'service_name': service_name,
+        'method': method,
+        'calls': calls,
+        'errors': errors,
+        'mean': total / calls,
+        'max': maximum,
+        'percentiles': zip(percentiles, estimates),
+        'histogram': zip(list(self.buckets) + [None], counts),
+      })
+    return stats
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._methods.clear()
+    finally:
+      self._lock.release()
+
+call_stats = CallStats()
+
+def get_call_stats():
+  """get_call_stats() -> [ latencies and errors of each method of each thrift service ]"""
+  return call_stats.get_stats()
+
 def simpler_string(thrift_obj):
   """
   Strips out nulls and empty arrays from the string representation.
@@ -403,18 +737,18 @@ def simpler_string(thrift_obj):
 
   return '%s(%s)' % (thrift_obj.__class__.__name__, ', '.join(L))
 
-def from_bytes(klass, data):
+def from_bytes(klass, data, protocol_class=None):
   """Returns thrift object from a string, using standard binary representation."""
   obj = klass()
   b = TMemoryBuffer(data)
-  p = TBinaryProtocol(b)
+  p = (protocol_class or get_protocol_class(b))(b)
   obj.read(p)
   return obj
 
-def to_bytes(obj):
+def to_bytes(obj, protocol_class=None):
   """Creates the standard binary representation of a thrift object."""
   b = TMemoryBuffer()
-  p = TBinaryProtocol(b)
+  p = (protocol_class or get_protocol_class(b))(b)
   obj.write(p)
   return b.getvalue()
 
@@ -17,6 +17,7 @@
 import logging
 import os
 import socket
+import struct
 import sys
 import threading
 import time
@@ -29,16 +30,21 @@ if not gen_py_path in sys.path:
 from djangothrift_test_gen.ttypes import TestStruct, TestNesting, TestEnum, TestManyTypes
 from djangothrift_test_gen import TestService
 
+import desktop.conf
 import hadoop
 import thrift_util
 from thrift_util import jsonable2thrift, thrift2json
 
-from thrift.protocol.TBinaryProtocol import TBinaryProtocolFactory
+from thrift.protocol.TBinaryProtocol import TBinaryProtocolFactory, TBinaryProtocol, TBinaryProtocolAccelerated
 from thrift.server import TServer
 from thrift.transport import TSocket
-from thrift.transport.TTransport import TBufferedTransportFactory
+from thrift.transport.TTransport import TBufferedTransportFactory, TMemoryBuffer
 
-from nose.tools import assert_equal
+from desktop.lib import thrift_sasl
+from desktop.lib.thrift_sasl import TSaslClientTransport
+
+from nose.tools import assert_equal, assert_true
+from nose.plugins.attrib import attr
 
 
 class SimpleThriftServer(object):
@@ -110,6 +116,70 @@ class SimpleThriftServer(object):
     self.pid = 0
 
 
+class PlainSaslClient(object):
+  """Stand-in for sasl.Client with the PLAIN mechanism, whose QOP is auth"""
+  def start(self, mechanism):
+    return True, 'PLAIN', '\0hue\0hue'
+
+  def encode(self, data):
+    return True, data
+
+  def decode(self, data):
+    return True, data
+
+  def getError(self):
+    return None
+
+
+class LoopbackSaslServer(object):
+  """
+  Accepts a SASL-PLAIN connection on a local port and sends it the frames.
+  In a subprocess, to only measure the client in the benchmarks.
+  """
+  def __init__(self, frames):
+    self.frames = frames
+    self.pid = 0
+
+  def _recv(self, conn, length):
+    data = ''
+    while len(data) < length:
+      data += conn.recv(length - len(data))
+    return data
+
+  def start(self):
+    data = ''.join([ struct.pack('>I', len(frame)) + frame for frame in self.frames ])
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1)
+    self.port = sock.getsockname()[1]
+
+    self.pid = os.fork()
+    if self.pid != 0:
+      sock.close()
+      return
+
+    try:
+      conn, addr = sock.accept()
+      # The mechanism, then the credentials
+      for message in range(2):
+        status, length = struct.unpack('>BI', self._recv(conn, 5))
+        self._recv(conn, length)
+      conn.sendall(struct.pack('>BI', TSaslClientTransport.COMPLETE, 0))
+      conn.sendall(data)
+      conn.close()
+    finally:
+      os._exit(0)
+
+  def join(self):
+    os.waitpid(self.pid, 0)
+    self.pid = 0
+
+  def connect(self):
+    transport = TSaslClientTransport(PlainSaslClient, 'PLAIN', TSocket.TSocket('127.0.0.1', self.port))
+    transport.open()
+    return transport
+
+
 class TestWithThriftServer(object):
   @classmethod
   def setup_class(cls):
@@ -128,6 +198,20 @@ class TestWithThriftServer(object):
   def test_basic_operation(self):
     assert_equal(10, self.client.ping(5))
 
+  def test_call_stats(self):
+    def get_ping_stats():
+      for call in thrift_util.get_call_stats():
+        if call['service_name'] == 'Hue Unit Test Client' and call['method'] == 'ping':
+          return call
+      return {'calls': 0, 'errors': 0}
+
+    before = get_ping_stats()
+    assert_equal(4, self.client.ping(2))
+    after = get_ping_stats()
+    assert_equal(before['calls'] + 1, after['calls'])
+    assert_equal(before['errors'], after['errors'])
+    assert_equal(after['calls'], sum([count for bound, count in after['histogram']]))
+
   def test_connection_race(self):
     class Racer(threading.Thread):
       def __init__(self, client, n_iter, begin):
@@ -154,6 +238,58 @@ class TestWithThriftServer(object):
       racer.join()
       assert_equal(0, len(racer.errors))
 
+  def test_pool_recycling(self):
+    pool = thrift_util._connection_pool.get_pool(self.client.conf)
+    assert_equal(10, self.client.ping(5))
+    stats = pool.get_stats()
+    assert_equal('Hue Unit Test Client', stats['service_name'])
+    assert_equal(pool.size, stats['idle'])
+    assert_true(stats['creates'] >= 1)
+
+    # Reused
+    assert_equal(10, self.client.ping(5))
+    assert_equal(stats['checkouts'] + 1, pool.get_stats()['checkouts'])
+    assert_equal(stats['creates'], pool.get_stats()['creates'])
+
+    # Too old
+    stats = pool.get_stats()
+    finish = desktop.conf.THRIFT_POOL.MAX_LIFETIME.set_for_testing(1)
+    try:
+      time.sleep(1.1)
+      assert_equal(10, self.client.ping(5))
+    finally:
+      finish()
+    assert_equal(stats['evictions'] + 1, pool.get_stats()['evictions'])
+    assert_equal(stats['creates'] + 1, pool.get_stats()['creates'])
+
+    # Broken after a failure of another connection
+    stats = pool.get_stats()
+    pool.record_failure()
+    assert_equal(10, self.client.ping(5))
+    assert_equal(stats['failures'] + 1, pool.get_stats()['failures'])
+    assert_equal(stats['evictions'] + 1, pool.get_stats()['evictions'])
+    assert_equal(stats['creates'] + 1, pool.get_stats()['creates'])
+
+  def test_pool_wait(self):
+    # Never connects
+    conf = thrift_util.ConnectionConfig(TestService.Client, '127.0.0.1', hadoop.mini_cluster.find_unused_port(),
+                                        'Hue Unit Test Small Client', timeout_seconds=1, pool_size=1)
+    pool = thrift_util._connection_pool.get_pool(conf)
+    assert_equal(1, pool.size)
+
+    client = pool.get()
+    try:
+      pool.get(get_client_timeout=0.1)
+      assert_true(False, 'The pool has only one client')
+    except socket.timeout:
+      pass
+    pool.put(client)
+
+    stats = [pool for pool in thrift_util.get_pool_stats() if pool['service_name'] == 'Hue Unit Test Small Client'][0]
+    assert_equal(2, stats['checkouts'] + stats['waits'])
+    assert_equal(1, stats['waits'])
+    assert_true(stats['wait_time'] >= 0.1)
+
 class ThriftUtilTest(unittest.TestCase):
   def test_simpler_string(self):
     struct = TestStruct()
@@ -175,6 +311,44 @@ class ThriftUtilTest(unittest.TestCase):
     self.assertEquals("TestNesting(nested_struct=TestStruct(b=12345))",
       thrift_util.simpler_string(nested))
 
+  def test_lazy_repr(self):
+    struct = TestStruct(a='hello world', b=12345)
+    self.assertEquals("TestStruct(a='hello world', b=12345)", str(thrift_util.LazyRepr(struct)))
+    struct.a = None
+    self.assertEquals("TestStruct(b=12345)", str(thrift_util.LazyRepr(struct)))
+    self.assertEquals("[1, (2, 'b'), {'c': None}]", str(thrift_util.LazyRepr([1, (2, 'b'), {'c': None}])))
+    self.assertEquals("(5,)", str(thrift_util.LazyRepr((5,))))
+
+    # Long values are cut without being formatted entirely
+    class Unformattable(object):
+      def __repr__(self):
+        raise AssertionError('Formatted past the maximum length')
+    value = str(thrift_util.LazyRepr(['x' * 100000, Unformattable()], max_length=50))
+    self.assertEquals("['" + 'x' * 48 + '...', value)
+
+    many = TestManyTypes(a_list=[ TestStruct(a='a%d' % i, b=i) for i in range(10000) ])
+    value = str(thrift_util.LazyRepr(many, max_length=100))
+    self.assertEquals(103, len(value))
+    assert_true(value.startswith('TestManyTypes(a_list=[TestStruct(a='), value)
+
+  def test_call_stats(self):
+    stats = thrift_util.CallStats(buckets=(1, 10, 100))
+    for duration in (0.0005, 0.002, 0.003, 0.004, 0.050, 0.060, 0.070, 0.080, 0.090, 0.5):
+      stats.record('Service', 'method', duration)
+    stats.record('Service', 'method', 0.006, error=True)
+    stats.record('Service', 'other', 0.0001)
+
+    method, other = stats.get_stats()
+    self.assertEquals(('Service', 'method', 11, 1), (method['service_name'], method['method'], method['calls'], method['errors']))
+    self.assertEquals([(1, 1), (10, 4), (100, 5), (None, 1)], method['histogram'])
+    self.assertEquals([(50, 100), (90, 100), (99, 500)], [(p, round(value)) for p, value in method['percentiles']])
+    self.assertEquals(500, round(method['max']))
+    self.assertEquals(1, other['calls'])
+    self.assertEquals([(50, 0.1), (90, 0.1), (99, 0.1)], [(p, round(value, 3)) for p, value in other['percentiles']])
+
+    stats.clear()
+    self.assertEquals([], stats.get_stats())
+
   def test_to_from_bytes(self):
     struct = TestStruct()
     struct.a = "hello world"
@@ -184,6 +358,100 @@ class ThriftUtilTest(unittest.TestCase):
     self.assertEquals(thrift_util.to_bytes(struct),
       thrift_util.to_bytes(thrift_util.from_bytes(TestStruct, thrift_util.to_bytes(struct))))
 
+  def test_accelerated_protocol(self):
+    many = TestManyTypes(a_bool=True, a_i64=1 << 40, a_double=0.5, a_string='hello', a_set=set([1, 2]),
+                           a_list=[ TestStruct(a='a%d' % i, b=i) for i in range(100) ],
+                           a_map=dict([ (i, TestStruct(b=i)) for i in range(10) ]), a_string_list=['x', 'y'])
+    data = thrift_util.to_bytes(many, TBinaryProtocol)
+    self.assertEquals(data, thrift_util.to_bytes(many, TBinaryProtocolAccelerated))
+    self.assertEquals(many, thrift_util.from_bytes(TestManyTypes, data, TBinaryProtocolAccelerated))
+
+    # Split in SASL frames (QOP auth), which the extension reads through cstringio_refill()
+    frames = ''.join([ struct.pack('>I', len(data[i:i + 100])) + data[i:i + 100] for i in range(0, len(data), 100) ])
+    for protocol_class in (TBinaryProtocol, TBinaryProtocolAccelerated):
+      decoded = TestManyTypes()
+      decoded.read(protocol_class(TSaslClientTransport(None, 'GSSAPI', TMemoryBuffer(frames))))
+      self.assertEquals(many, decoded)
+
+    # Falls back to the Python protocol
+    if thrift_util.fastbinary is not None:
+      self.assertEquals(TBinaryProtocolAccelerated, thrift_util.get_protocol_class(TMemoryBuffer()))
+    self.assertEquals(TBinaryProtocol, thrift_util.get_protocol_class(TSocket.TSocket('localhost', 1)))
+    finish = desktop.conf.THRIFT_POOL.ACCELERATED_PROTOCOL.set_for_testing(False)
+    try:
+      self.assertEquals(TBinaryProtocol, thrift_util.get_protocol_class(TMemoryBuffer()))
+    finally:
+      finish()
+    fastbinary = thrift_util.fastbinary
+    thrift_util.fastbinary = None
+    try:
+      self.assertEquals(TBinaryProtocol, thrift_util.get_protocol_class(TMemoryBuffer()))
+    finally:
+      thrift_util.fastbinary = fastbinary
+
+  def test_sasl_frames(self):
+    many = TestManyTypes(a_string='hello', a_list=[ TestStruct(a='a%d' % i, b=i) for i in range(1000) ])
+    data = thrift_util.to_bytes(many, TBinaryProtocol)
+    frames = ['a' * 10, 'b' * 100000, 'c' * 5, data[:100], data[100:], data]
+
+    # The buffer grows, and is dropped after the biggest frames
+    read_buffer_sizes = thrift_sasl.READ_BUFFER_SIZE, thrift_sasl.MAX_READ_BUFFER_SIZE
+    thrift_sasl.READ_BUFFER_SIZE, thrift_sasl.MAX_READ_BUFFER_SIZE = 50000, 60000
+    try:
+      for protocol_class in (TBinaryProtocol, TBinaryProtocolAccelerated):
+        server = LoopbackSaslServer(frames)
+        server.start()
+        transport = server.connect()
+        try:
+          # Within a frame, then across frames bigger than the read buffer
+          self.assertEquals('a' * 4, transport.readAll(4))
+          self.assertEquals('a' * 6 + 'b' * 100000 + 'c', transport.readAll(100007))
+          self.assertEquals('cccc', transport.read(10))
+
+          # A struct split in two frames, then in one
+          for i in range(2):
+            decoded = TestManyTypes()
+            decoded.read(protocol_class(transport))
+            self.assertEquals(many, decoded)
+        finally:
+          transport.close()
+        server.join()
+    finally:
+      thrift_sasl.READ_BUFFER_SIZE, thrift_sasl.MAX_READ_BUFFER_SIZE = read_buffer_sizes
+
+  @attr('benchmark')
+  def test_sasl_transport_benchmark(self):
+    many = TestManyTypes(a_list=[ TestStruct(a='row %d of the results' % i, b=i) for i in range(20000) ],
+                         a_string_list=[ 'x' * 100 ] * 10000)
+    data = thrift_util.to_bytes(many, TBinaryProtocol)
+
+    # Many small frames read at once, big frames, then the structs of the big frames
+    for name, frames, protocol_class in (('4KB frames', [ 'x' * 4096 ] * 10000, None),
+                                         ('%d bytes frames' % len(data), [ data ] * 5, None),
+                                         ('TBinaryProtocol', [ data ] * 5, TBinaryProtocol),
+                                         ('TBinaryProtocolAccelerated', [ data ] * 5, TBinaryProtocolAccelerated)):
+      server = LoopbackSaslServer(frames)
+      server.start()
+      transport = server.connect()
+      try:
+        start = time.time()
+        if protocol_class is not None:
+          for frame in frames:
+            decoded = TestManyTypes()
+            decoded.read(protocol_class(transport))
+        elif len(frames[0]) < 1024 * 1024:
+          transport.readAll(sum([ len(frame) for frame in frames ]))
+        else:
+          for frame in frames:
+            transport.readAll(len(frame))
+        duration = time.time() - start
+      finally:
+        transport.close()
+      server.join()
+      logging.info('Read %d bytes over SASL (%s): %.1f MB/s' %
+                   (sum([ len(frame) for frame in frames ]), name,
+                    sum([ len(frame) for frame in frames ]) / 1024.0 / 1024.0 / max(duration, 0.001)))
+
   def test_empty_string_vs_none(self):
     struct1 = TestStruct()
     struct2 = TestStruct()
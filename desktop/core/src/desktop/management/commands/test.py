@@ -40,6 +40,9 @@ class Command(BaseCommand):
 
       fast       Runs the "fast" tests, namely those that don't start Hadoop.
               
+      benchmark  Runs the benchmarks, which are skipped by "all" and "fast".
+                 Their timings are logged.
+
       specific   Explicitly run specific tests using nose.
                  For example, to run all the filebrower tests or
                  to run a specific test function, use
@@ -79,10 +82,12 @@ class Command(BaseCommand):
     all_apps = [ app.module.__name__ for app in appmanager.DESKTOP_MODULES ]
 
     if args[0] == "all":
-      nose_args = args + all_apps + ["-v"]
+      nose_args = args + all_apps + ["-v", "-a", "!benchmark"]
     elif args[0] == "fast":
       test_apps = [ app.module.__name__ for app in appmanager.DESKTOP_MODULES ]
-      nose_args = args + all_apps + ["-v", "-a", "!requires_hadoop"]
+      nose_args = args + all_apps + ["-v", "-a", "!requires_hadoop,!benchmark"]
+    elif args[0] == "benchmark":
+      nose_args = args + all_apps + ["-v", "-a", "benchmark"]
     elif args[0] in ("specific", "nose"):
       nose_args = args + ['-v']
     elif args[0] == "windmill":
@@ -34,6 +34,9 @@ def is_selected(section, matcher):
         <li class="${is_selected(section, 'quick_start')}"><a href="${url("about:admin_wizard")}">${_('Quick start')}</a></li>
         <li class="${is_selected(section, 'dump_config')}"><a href="${url("desktop.views.dump_config")}">${_('Configuration')}</a></li>
         <li class="${is_selected(section, 'log_view')}"><a href="${url("desktop.views.log_view")}">${_('Server Logs')}</a></li>
+        <li class="${is_selected(section, 'thrift_pools')}"><a href="${url("desktop.views.thrift_pools")}">${_('Thrift Pools')}</a></li>
+        <li class="${is_selected(section, 'thrift_calls')}"><a href="${url("desktop.views.thrift_calls")}">${_('Thrift Calls')}</a></li>
+        <li class="${is_selected(section, 'http_pools')}"><a href="${url("desktop.views.http_pools")}">${_('HTTP Pools')}</a></li>
       </ul>
     </div>
   </div>
@@ -0,0 +1,78 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+<%!
+from desktop.views import commonheader, commonfooter
+from django.utils.translation import ugettext as _
+%>
+
+<%namespace name="layout" file="about_layout.mako" />
+
+${ commonheader(_('HTTP Pools'), "about", user, "100px") | n,unicode }
+${layout.menubar(section='http_pools')}
+
+<div class="container-fluid">
+  <div class="widget-box">
+    <div class="widget-title">
+      <span class="icon">
+        <i class="icon-th-list"></i>
+      </span>
+      <h5>${_('Persistent connections to the REST APIs')}</h5>
+    </div>
+    <div class="widget-content">
+        <table class="table table-striped table-condensed">
+          <thead>
+            <tr>
+              <th>${_('Scheme')}</th>
+              <th>${_('Host')}</th>
+              <th>${_('Size')}</th>
+              <th>${_('Idle')}</th>
+              <th>${_('In use')}</th>
+              <th>${_('Requests')}</th>
+              <th>${_('Reuses')}</th>
+              <th>${_('Connections')}</th>
+              <th>${_('Retries')}</th>
+              <th>${_('Failures')}</th>
+              <th>${_('Evictions')}</th>
+            </tr>
+          </thead>
+          <tbody>
+          % for pool in pools:
+            <tr>
+              <td>${ pool['scheme'] }</td>
+              <td>${ pool['host'] }</td>
+              <td>${ pool['size'] }</td>
+              <td>${ pool['idle'] }</td>
+              <td>${ pool['in_use'] }</td>
+              <td>${ pool['requests'] }</td>
+              <td>${ pool['reuses'] }</td>
+              <td>${ pool['creates'] }</td>
+              <td>${ pool['retries'] }</td>
+              <td>${ pool['failures'] }</td>
+              <td>${ pool['evictions'] }</td>
+            </tr>
+          % endfor
+          % if not pools:
+            <tr>
+              <td colspan="11">${_('No request was made to a REST API yet.')}</td>
+            </tr>
+          % endif
+          </tbody>
+        </table>
+    </div>
+  </div>
+</div>
+
+${ commonfooter(messages) | n,unicode }
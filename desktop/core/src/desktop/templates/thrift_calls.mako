@@ -0,0 +1,80 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+<%!
+from desktop.views import commonheader, commonfooter
+from django.utils.translation import ugettext as _
+%>
+
+<%namespace name="layout" file="about_layout.mako" />
+
+${ commonheader(_('Thrift Calls'), "about", user, "100px") | n,unicode }
+${layout.menubar(section='thrift_calls')}
+
+<div class="container-fluid">
+  <div class="widget-box">
+    <div class="widget-title">
+      <span class="icon">
+        <i class="icon-th-list"></i>
+      </span>
+      <h5>${_('Latency of the calls to the Thrift services')}</h5>
+    </div>
+    <div class="widget-content">
+        <table class="table table-striped table-condensed">
+          <thead>
+            <tr>
+              <th>${_('Service')}</th>
+              <th>${_('Method')}</th>
+              <th>${_('Calls')}</th>
+              <th>${_('Errors')}</th>
+              <th>${_('Mean (ms)')}</th>
+              % for percentile in percentiles:
+              <th>${_('%(percentile)sth percentile (ms)') % {'percentile': percentile}}</th>
+              % endfor
+              <th>${_('Max (ms)')}</th>
+              % for bound in buckets:
+              <th>${ bound is None and _('Slower') or '<= %s' % bound }</th>
+              % endfor
+            </tr>
+          </thead>
+          <tbody>
+          % for call in calls:
+            <tr>
+              <td>${ call['service_name'] }</td>
+              <td>${ call['method'] }</td>
+              <td>${ call['calls'] }</td>
+              <td>${ call['errors'] }</td>
+              <td>${ '%.1f' % call['mean'] }</td>
+              % for percentile, value in call['percentiles']:
+              <td>${ '%.1f' % value }</td>
+              % endfor
+              <td>${ '%.1f' % call['max'] }</td>
+              % for bound, count in call['histogram']:
+              <td>${ count }</td>
+              % endfor
+            </tr>
+          % endfor
+          % if not calls:
+            <tr>
+              <td colspan="${ 6 + len(percentiles) + len(buckets) }">${_('No call was made to a Thrift service yet.')}</td>
+            </tr>
+          % endif
+          </tbody>
+        </table>
+    </div>
+  </div>
+</div>
+
+${ commonfooter(messages) | n,unicode }
@@ -0,0 +1,78 @@
+## Licensed to Cloudera, Inc. under one
+## or more contributor license agreements.  See the NOTICE file
+## distributed with this work for additional information
+## regarding copyright ownership.  Cloudera, Inc. licenses this file
+## to you under the Apache License, Version 2.0 (the
+## "License"); you may not use this file except in compliance
+## with the License.  You may obtain a copy of the License at
+##
+##     http://www.apache.org/licenses/LICENSE-2.0
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+<%!
+from desktop.views import commonheader, commonfooter
+from django.utils.translation import ugettext as _
+%>
+
+<%namespace name="layout" file="about_layout.mako" />
+
+${ commonheader(_('Thrift Pools'), "about", user, "100px") | n,unicode }
+${layout.menubar(section='thrift_pools')}
+
+<div class="container-fluid">
+  <div class="widget-box">
+    <div class="widget-title">
+      <span class="icon">
+        <i class="icon-th-list"></i>
+      </span>
+      <h5>${_('Connections to the Thrift services')}</h5>
+    </div>
+    <div class="widget-content">
+        <table class="table table-striped table-condensed">
+          <thead>
+            <tr>
+              <th>${_('Service')}</th>
+              <th>${_('Host')}</th>
+              <th>${_('Port')}</th>
+              <th>${_('Size')}</th>
+              <th>${_('Idle')}</th>
+              <th>${_('Checkouts')}</th>
+              <th>${_('Waits')}</th>
+              <th>${_('Wait time (s)')}</th>
+              <th>${_('Connections')}</th>
+              <th>${_('Failures')}</th>
+              <th>${_('Evictions')}</th>
+            </tr>
+          </thead>
+          <tbody>
+          % for pool in pools:
+            <tr>
+              <td>${ pool['service_name'] }</td>
+              <td>${ pool['host'] }</td>
+              <td>${ pool['port'] }</td>
+              <td>${ pool['size'] }</td>
+              <td>${ pool['idle'] }</td>
+              <td>${ pool['checkouts'] }</td>
+              <td>${ pool['waits'] }</td>
+              <td>${ '%.2f' % pool['wait_time'] }</td>
+              <td>${ pool['creates'] }</td>
+              <td>${ pool['failures'] }</td>
+              <td>${ pool['evictions'] }</td>
+            </tr>
+          % endfor
+          % if not pools:
+            <tr>
+              <td colspan="11">${_('No connection was made to a Thrift service yet.')}</td>
+            </tr>
+          % endif
+          </tbody>
+        </table>
+    </div>
+  </div>
+</div>
+
+${ commonfooter(messages) | n,unicode }
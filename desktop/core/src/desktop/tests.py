@@ -16,6 +16,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+try:
+  import json
+except ImportError:
+  import simplejson as json
 import desktop
 import desktop.urls
 import desktop.conf
@@ -32,7 +36,7 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponse
 from django.db.models import query, CharField, SmallIntegerField
 
-from desktop.lib import django_mako
+from desktop.lib import django_mako, thrift_util
 from desktop.lib.django_test_util import make_logged_in_client
 from desktop.lib.paginator import Paginator
 from desktop.lib.conf import validate_path
@@ -247,6 +251,49 @@ def test_thread_dump():
   response = c.get("/debug/threads")
   assert_true("test_thread_dump" in response.content)
 
+def test_thrift_pools():
+  c = make_logged_in_client()
+  response = c.get("/debug/thrift_pools")
+  assert_true("Connections to the Thrift services" in response.content, response.content)
+
+  response = c.get("/debug/thrift_pools", {'format': 'json'})
+  assert_true(isinstance(json.loads(response.content), list))
+
+  c = make_logged_in_client(username='not_superuser', is_superuser=False)
+  response = c.get("/debug/thrift_pools")
+  assert_true("You must be a superuser" in response.content)
+
+def test_thrift_calls():
+  thrift_util.call_stats.record('Test Service', 'ping', 0.002)
+  thrift_util.call_stats.record('Test Service', 'ping', 2.0, error=True)
+
+  c = make_logged_in_client()
+  response = c.get("/debug/thrift_calls")
+  assert_true("Latency of the calls to the Thrift services" in response.content, response.content)
+  assert_true("Test Service" in response.content, response.content)
+
+  response = c.get("/debug/thrift_calls", {'format': 'json'})
+  calls = [call for call in json.loads(response.content) if call['service_name'] == 'Test Service']
+  assert_equal(1, len(calls))
+  assert_equal(2, calls[0]['calls'])
+  assert_equal(1, calls[0]['errors'])
+
+  c = make_logged_in_client(username='not_superuser', is_superuser=False)
+  response = c.get("/debug/thrift_calls")
+  assert_true("You must be a superuser" in response.content)
+
+def test_http_pools():
+  c = make_logged_in_client()
+  response = c.get("/debug/http_pools")
+  assert_true("Persistent connections to the REST APIs" in response.content, response.content)
+
+  response = c.get("/debug/http_pools", {'format': 'json'})
+  assert_true(isinstance(json.loads(response.content), list))
+
+  c = make_logged_in_client(username='not_superuser', is_superuser=False)
+  response = c.get("/debug/http_pools")
+  assert_true("You must be a superuser" in response.content)
+
 def test_truncating_model():
   class TinyModel(TruncatingModel):
     short_field = CharField(max_length=10)
@@ -57,6 +57,9 @@ dynamic_patterns = patterns('',
   (r'^status_bar/?$', 'desktop.views.status_bar'),
   (r'^admin/', include(admin.site.urls)),
   (r'^debug/threads$', 'desktop.views.threads'),
+  (r'^debug/thrift_pools$', 'desktop.views.thrift_pools'),
+  (r'^debug/thrift_calls$', 'desktop.views.thrift_calls'),
+  (r'^debug/http_pools$', 'desktop.views.http_pools'),
   (r'^debug/who_am_i$', 'desktop.views.who_am_i'),
   (r'^debug/check_config$', 'desktop.views.check_config'),
   (r'^debug/check_config_ajax$', 'desktop.views.check_config_ajax'),
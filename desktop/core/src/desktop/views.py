@@ -32,10 +32,11 @@ from django.shortcuts import redirect
 from django.utils.translation import ugettext as _
 import django.views.debug
 
-from desktop.lib import django_mako
+from desktop.lib import django_mako, thrift_util
 from desktop.lib.conf import GLOBAL_CONFIG
 from desktop.lib.django_util import login_notrequired, render_json, render, render_to_string
 from desktop.lib.paths import get_desktop_root
+from desktop.lib.rest import http_pool
 from desktop.log.access import access_log_level, access_warn
 from desktop.models import UserPreferences, Settings
 from desktop import appmanager
@@ -223,6 +224,42 @@ def threads(request):
     out.append("")
   return HttpResponse("\n".join(out), content_type="text/plain")
 
+@access_log_level(logging.WARN)
+def thrift_pools(request):
+  """Activity of the pools of connections to the Thrift services"""
+  if not request.user.is_superuser:
+    return HttpResponse(_("You must be a superuser."))
+
+  pools = sorted(thrift_util.get_pool_stats(), key=lambda pool: (pool['service_name'], pool['host'], pool['port']))
+  if request.GET.get('format') == 'json':
+    return render_json(pools)
+  return render('thrift_pools.mako', request, dict(pools=pools))
+
+@access_log_level(logging.WARN)
+def thrift_calls(request):
+  """Latency histograms and errors of the calls to the Thrift services"""
+  if not request.user.is_superuser:
+    return HttpResponse(_("You must be a superuser."))
+
+  calls = thrift_util.get_call_stats()
+  if request.GET.get('format') == 'json':
+    return render_json(calls)
+  return render('thrift_calls.mako', request, dict(
+    calls=calls,
+    percentiles=[percentile for percentile, value in calls and calls[0]['percentiles'] or []],
+    buckets=list(thrift_util.CALL_LATENCY_BUCKETS_MS) + [None]))
+
+@access_log_level(logging.WARN)
+def http_pools(request):
+  """Activity of the persistent connections to the REST APIs"""
+  if not request.user.is_superuser:
+    return HttpResponse(_("You must be a superuser."))
+
+  pools = http_pool.get_pool_stats()
+  if request.GET.get('format') == 'json':
+    return render_json(pools)
+  return render('http_pools.mako', request, dict(pools=pools))
+
 def jasmine(request):
   return render('jasmine.mako', request, None)
 
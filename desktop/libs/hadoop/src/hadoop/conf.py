@@ -79,6 +79,8 @@ HDFS_CLUSTERS = UnspecifiedConfigSection(
                             type=int),
       NN_HDFS_PORT=Config("hdfs_port", help="Hadoop IPC port for the name node", default=8020,
                             type=int),
+      THRIFT_POOL_SIZE=Config("thrift_pool_size", help="Number of Thrift connections to the name node. " +
+                              "0 uses the size of [desktop] [[thrift_pool]].", default=0, type=int),
       # End deprecation
       FS_DEFAULTFS=Config("fs_defaultfs", help="The equivalent of fs.defaultFS (aka fs.default.name)",
                           default="hdfs://localhost:8020"),
@@ -136,6 +138,8 @@ MR_CLUSTERS = UnspecifiedConfigSection(
                   type=int),
       JT_THRIFT_PORT=Config("thrift_port", help="Thrift port for JobTracker", default=9290,
                             type=int),
+      THRIFT_POOL_SIZE=Config("thrift_pool_size", help="Number of Thrift connections to the JobTracker. " +
+                              "0 uses the size of [desktop] [[thrift_pool]].", default=0, type=int),
       JT_KERBEROS_PRINCIPAL=Config("jt_kerberos_principal", help="Kerberos principal for JobTracker",
                                    default="mapred", type=str),
       SECURITY_ENABLED=Config("security_enabled", help="Is running with Kerberos authentication",
@@ -369,7 +369,8 @@ class HadoopFileSystem(Hdfs):
                dn_kerberos_principal="hdfs",
                security_enabled=False,
                hadoop_bin_path="hadoop",
-               temp_dir='/tmp'):
+               temp_dir='/tmp',
+               thrift_pool_size=None):
     """
     @param host hostname or IP of the namenode
     @param thrift_port port on which the Thrift plugin is listening
@@ -378,6 +379,7 @@ class HadoopFileSystem(Hdfs):
                            installed system - default is fine if it is in
                            the user's PATH env
     @param temp_dir Temporary directory, for mktemp()
+    @param thrift_pool_size Number of Thrift connections to the namenode
     """
     self.host = host
     self.thrift_port = thrift_port
@@ -395,7 +397,8 @@ class HadoopFileSystem(Hdfs):
       service_name="HDFS Namenode HUE Plugin",
       use_sasl=security_enabled,
       kerberos_principal=nn_kerberos_principal,
-      timeout_seconds=NN_THRIFT_TIMEOUT)
+      timeout_seconds=NN_THRIFT_TIMEOUT,
+      pool_size=thrift_pool_size)
 
     # The file systems are cached globally.  We store
     # user information in a thread-local variable so that
@@ -412,7 +415,8 @@ class HadoopFileSystem(Hdfs):
                security_enabled=fs_config.SECURITY_ENABLED.get(),
                nn_kerberos_principal=fs_config.NN_KERBEROS_PRINCIPAL.get(),
                dn_kerberos_principal=fs_config.DN_KERBEROS_PRINCIPAL.get(),
-               hadoop_bin_path=hadoop_bin_path)
+               hadoop_bin_path=hadoop_bin_path,
+               thrift_pool_size=fs_config.THRIFT_POOL_SIZE.get())
 
 
   def _get_hdfs_base(self):
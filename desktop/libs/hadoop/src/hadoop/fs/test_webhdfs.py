@@ -120,6 +120,32 @@ class WebhdfsTests(unittest.TestCase):
     finally:
       fs.remove("/fortest-blocks.txt")
 
+  def test_read_stream(self):
+    """Reads a file with a lot of blocks with a single request"""
+    fs = self.cluster.fs
+    fs.create("/fortest-stream.txt", replication=1, blocksize=1024)
+    f = fs.open("/fortest-stream.txt", "w")
+    try:
+      data = "abcdefghijklmnopqrstuvwxyz" * 3000
+      f.write(data)
+      f.close()
+
+      chunks = list(fs.read_stream("/fortest-stream.txt", chunk_size=10000))
+      assert_equals(data, ''.join(chunks))
+      assert_equals(8, len(chunks))
+
+      assert_equals(data[5000:5100], ''.join(fs.read_stream("/fortest-stream.txt", 5000, 100)))
+      assert_equals(data[-10:], ''.join(fs.read_stream("/fortest-stream.txt", len(data) - 10)))
+      assert_equals('', ''.join(fs.read_stream("/fortest-stream.txt", len(data) + 10)))
+
+      # Stopped before the end
+      stream = fs.read_stream("/fortest-stream.txt", chunk_size=100)
+      assert_equals(data[:100], stream.next())
+      stream.close()
+      assert_raises(StopIteration, stream.next)
+    finally:
+      fs.remove("/fortest-stream.txt")
+
   def test_exceptions(self):
     """
     Tests that appropriate exceptions are raised.
@@ -435,6 +435,31 @@ class WebHdfs(Hdfs):
       raise ex
 
 
+  def read_stream(self, path, offset=0, length=None, chunk_size=DEFAULT_READ_SIZE, bufsize=None):
+    """
+    read_stream(path[, offset[, length]]) -> iterator over the data
+
+    Read a range of a file, the whole rest of it by default, with a single OPEN.
+    The data is yielded by chunks of ``chunk_size`` as it is received. Closing
+    the iterator before its end closes the connection.
+    """
+    path = Hdfs.normpath(path)
+    params = self._getparams()
+    params['op'] = 'OPEN'
+    params['offset'] = long(offset)
+    if length is not None:
+      params['length'] = long(length)
+    if bufsize is not None:
+      params['bufsize'] = bufsize
+    try:
+      # The redirect to the DataNode is followed by urllib2
+      return ReadStream(self._root.get_stream(path, params), chunk_size)
+    except WebHdfsException, ex:
+      if "out of the range" in ex.message:
+        return ReadStream(None, chunk_size)
+      raise ex
+
+
   def open(self, path, mode='r'):
     """
     DEPRECATED!
@@ -660,6 +685,37 @@ class WebHdfs(Hdfs):
     return self.do_as_user(self.superuser, fn, *args, **kwargs)
 
 
+class ReadStream(object):
+  """
+  Iterator over the body of an OPEN response, read by chunks. The response is
+  closed once read, or by close().
+  """
+  def __init__(self, response, chunk_size):
+    self._response = response
+    self._chunk_size = chunk_size
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    if self._response is None:
+      raise StopIteration
+    try:
+      chunk = self._response.read(self._chunk_size)
+    except Exception, ex:
+      self.close()
+      raise WebHdfsException(_("Failed to read the file: %s") % (ex,))
+    if not chunk:
+      self.close()
+      raise StopIteration
+    return chunk
+
+  def close(self):
+    if self._response is not None:
+      self._response.close()
+      self._response = None
+
+
 class File(object):
   """
   DEPRECATED!
@@ -38,6 +38,7 @@ class WebHdfsStat(object):
     self.type = file_status['type']
     self.atime = file_status['accessTime'] / 1000
     self.mtime = file_status['modificationTime'] / 1000
+    self.modificationTime = file_status['modificationTime']
     self.user = file_status['owner']
     self.group = file_status['group']
     self.size = file_status['length']
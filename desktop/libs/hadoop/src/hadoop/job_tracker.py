@@ -66,13 +66,15 @@ class LiveJobTracker(object):
 
   def __init__(self, host, thrift_port,
                security_enabled=False,
-               kerberos_principal="mapred"):
+               kerberos_principal="mapred",
+               thrift_pool_size=None):
     self.client = thrift_util.get_client(
       Jobtracker.Client, host, thrift_port,
       service_name="Hadoop MR JobTracker HUE Plugin",
       use_sasl=security_enabled,
       kerberos_principal=kerberos_principal,
-      timeout_seconds=JT_THRIFT_TIMEOUT)
+      timeout_seconds=JT_THRIFT_TIMEOUT,
+      pool_size=thrift_pool_size)
     self.host = host
     self.thrift_port = thrift_port
     self.security_enabled = security_enabled
@@ -88,7 +90,8 @@ class LiveJobTracker(object):
       conf.HOST.get(),
       conf.JT_THRIFT_PORT.get(),
       security_enabled=conf.SECURITY_ENABLED.get(),
-      kerberos_principal=conf.JT_KERBEROS_PRINCIPAL.get())
+      kerberos_principal=conf.JT_KERBEROS_PRINCIPAL.get(),
+      thrift_pool_size=conf.THRIFT_POOL_SIZE.get())
 
   def thriftjobid_from_string(self, jobid):
     """The jobid looks like this: job_201001301455_0001"""
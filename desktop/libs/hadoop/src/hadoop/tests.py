@@ -18,17 +18,26 @@
 Tests for libs/hadoop
 """
 import cStringIO
+import logging
 import os
+import time
 
 from nose.tools import assert_true, assert_equal, assert_false
 from nose.plugins.attrib import attr
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol, TBinaryProtocolAccelerated
 
+from desktop.lib import thrift_util
 from desktop.lib.django_test_util import make_logged_in_client
+from hadoop.api.jobtracker.ttypes import ThriftJobList, ThriftJobInProgress, ThriftJobProfile, ThriftJobStatus,\
+  ThriftJobID, ThriftJobState, ThriftJobPriority
 from hadoop import cluster
 from hadoop import conf
 from hadoop import confparse
 from hadoop import pseudo_hdfs4
 
+
+LOG = logging.getLogger(__name__)
+
 @attr('requires_hadoop')
 def test_live_jobtracker():
   """
@@ -177,3 +186,43 @@ def test_non_default_cluster():
     for old_conf in reset:
       old_conf()
     cluster.restore_caches(old)
+
+
+def _make_job_list(job_count):
+  jobs = []
+  for i in xrange(job_count):
+    job_id = ThriftJobID(jobTrackerID='201305011200', jobID=i, asString='job_201305011200_%04d' % i)
+    jobs.append(ThriftJobInProgress(
+        profile=ThriftJobProfile(user='hue', jobID=job_id, jobFile='hdfs://localhost:8020/tmp/job_%d.xml' % i,
+                                 name='select * from sample_%d' % i, queueName='default'),
+        status=ThriftJobStatus(jobID=job_id, mapProgress=1.0, reduceProgress=0.5, cleanupProgress=0.0,
+                               setupProgress=1.0, runState=ThriftJobState.RUNNING, startTime=1367409600000 + i,
+                               user='hue', priority=ThriftJobPriority.NORMAL, schedulingInfo='NA'),
+        jobID=job_id, desiredMaps=10, desiredReduces=1, finishedMaps=10, finishedReduces=0,
+        priority=ThriftJobPriority.NORMAL, startTime=1367409600000 + i, finishTime=0, launchTime=1367409600000 + i))
+  return ThriftJobList(jobs=jobs)
+
+
+def test_jobtracker_accelerated_protocol():
+  job_list = _make_job_list(10)
+  data = thrift_util.to_bytes(job_list, TBinaryProtocol)
+
+  for protocol_class in (TBinaryProtocol, TBinaryProtocolAccelerated):
+    assert_equal(job_list, thrift_util.from_bytes(ThriftJobList, data, protocol_class))
+    assert_equal(data, thrift_util.to_bytes(job_list, protocol_class))
+
+
+@attr('benchmark')
+def test_jobtracker_accelerated_protocol_benchmark():
+  job_list = _make_job_list(10000)
+  data = thrift_util.to_bytes(job_list, TBinaryProtocol)
+
+  durations = []
+  for protocol_class in (TBinaryProtocol, TBinaryProtocolAccelerated):
+    start = time.time()
+    decoded = thrift_util.from_bytes(ThriftJobList, data, protocol_class)
+    durations.append(time.time() - start)
+    assert_equal(job_list, decoded)
+
+  LOG.info('Decoded a list of %d jobs (%d bytes): binary protocol %.2fs, accelerated %.2fs (fastbinary %s)' %
+           (len(job_list.jobs), len(data), durations[0], durations[1], thrift_util.fastbinary and 'loaded' or 'missing'))